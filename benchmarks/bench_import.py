@@ -0,0 +1,61 @@
+"""
+Measures how long importing the package's modules takes from a cold start,
+and which heavy dependencies each one drags in
+
+    python -m benchmarks.bench_import --repeat 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+TARGETS = [
+    "django_s3_csv_2_sfdc",
+    "django_s3_csv_2_sfdc.utils",
+    "django_s3_csv_2_sfdc.csv_helpers",
+    "django_s3_csv_2_sfdc.s3_helpers",
+    "django_s3_csv_2_sfdc.salesforce_client",
+    "django_s3_csv_2_sfdc.orchestrator",
+]
+HEAVY_MODULES = ["django", "boto3", "simple_salesforce", "pyarrow"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "imported": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(target: str) -> dict:
+    # a fresh interpreter every time, as a cold start would be
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(target=target, heavy=HEAVY_MODULES)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<42}{'median ms':>10}  imports")
+    for target in TARGETS:
+        runs = [measure(target) for _ in range(args.repeat)]
+        median = statistics.median(run["seconds"] for run in runs) * 1000
+        imported = ", ".join(runs[0]["imported"]) or "-"
+        print(f"{target:<42}{median:>10.1f}  {imported}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Benchmarks the CSV -> Salesforce flow end to end, against moto's S3 and a
+fake Salesforce bulk endpoint
+
+    python -m benchmarks.bench_pipeline --rows 200000 --columns 20
+
+Reports throughput, peak RSS and how long each stage took, so regressions
+show up before they're deployed
+"""
+
+import argparse
+import csv
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import boto3
+
+from django.conf import settings
+from moto import mock_s3
+
+from benchmarks.fake_salesforce import FakeSfClient
+
+
+def generate_csv(path: Path, rows: int, columns: int) -> Path:
+    """
+    Writes a CSV with an ID column followed by `columns` text columns
+    """
+    fieldnames = ["ID"] + [f"Field_{idx}__c" for idx in range(columns)]
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(fieldnames)
+        for row in range(rows):
+            writer.writerow(
+                [str(row)] + [f"value {row}-{idx}" for idx in range(columns)]
+            )
+    return path
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Timings(dict):
+    @contextmanager
+    def time(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self[stage] = self.get(stage, 0) + time.perf_counter() - started
+
+    def iterate(self, stage: str, iterable: Iterable) -> Iterator:
+        """
+        Times each step of iterable, rather than whatever loops over it
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.time(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+
+def run(args) -> dict:
+    # imported late so that settings are configured first
+    from django_s3_csv_2_sfdc import s3_helpers
+    from django_s3_csv_2_sfdc.orchestrator import Orchestrator
+
+    timings = Timings()
+    parse_stage = "parse_bulk_upsert_results"
+    report_stage = "create_error_report"
+
+    class BenchmarkOrchestrator(Orchestrator):
+        """
+        Times parsing the results and writing the error report as part of
+        each log_batch, so they're shown as the parts of that stage
+        """
+
+        def iter_sfdc_errors(self, *args, **kwargs):
+            errors = super().iter_sfdc_errors(*args, **kwargs)
+            return timings.iterate(parse_stage, errors)
+
+        def create_error_report_file(self, errors):
+            parsed = timings.get(parse_stage, 0)
+            with timings.time(report_stage):
+                error_count = super().create_error_report_file(errors)
+            # errors are parsed lazily, as they're written, so that's taken out
+            timings[report_stage] -= timings[parse_stage] - parsed
+            return error_count
+
+        @property
+        def execution_sfdc_hash(self):
+            return {
+                "Data_File__c": self.s3_object_key,
+                "Error_Report__c": self.error_file_s3_key,
+                "Number_of_Errors__c": self.error_count,
+            }
+
+    temp = Path(settings.TEMP)
+    source = generate_csv(temp / "source.csv", args.rows, args.columns)
+    bucket = "benchmark-bucket"
+    s3_key = "incoming/source.csv"
+
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket=bucket)
+    s3_helpers.upload_file(source, bucket, s3_key)
+
+    sf_client = FakeSfClient(latency=args.latency, error_rate=args.error_rate)
+    started = time.perf_counter()
+
+    with timings.time("download_file"):
+        orchestrator = BenchmarkOrchestrator(
+            s3_key,
+            bucket,
+            sf_client=sf_client,
+            execution_object_name="Integration_Execution__c",
+            stream=args.stream,
+        )
+
+    with timings.time("bulk_upsert + log_batch"):
+        pushed = orchestrator.bulk_upsert(
+            "Contact",
+            orchestrator.iter_rows(),
+            "ID",
+            batch_size=args.batch_size,
+            max_in_flight=args.max_in_flight,
+            wait=args.latency,
+        )
+
+    with timings.time("report()"):
+        orchestrator.automagically_finish_up()
+
+    elapsed = time.perf_counter() - started
+
+    return {
+        "rows": pushed,
+        "columns": args.columns,
+        "errors": orchestrator.error_count,
+        "api_calls": sf_client.api_calls,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(pushed / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--max-in-flight", type=int, default=5)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per Salesforce call"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.01, help="chance each record fails"
+    )
+    parser.add_argument(
+        "--stream", action="store_true", help="stream from S3 instead of downloading"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temp:
+        if not settings.configured:
+            settings.configure(TEMP=temp)
+        # moto needs credentials to sign requests with, any will do
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        # newer botocores upload aws-chunked, which moto stores undecoded
+        os.environ.setdefault("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+        with mock_s3():
+            report = run(args)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    print(
+        f"{report['rows']} rows x {report['columns']} columns in {report['seconds']}s"
+        f" -> {report['rows_per_second']} rows/s"
+    )
+    print(f"errors: {report['errors']}, api calls: {report['api_calls']}")
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+    for stage, seconds in report["stages"].items():
+        print(f"  {stage:<28} {seconds:>8.3f}s")
+    return report
+
+
+if __name__ == "__main__":
+    main()
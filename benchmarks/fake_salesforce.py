@@ -0,0 +1,50 @@
+import time
+
+from tests.fake_salesforce import FakeBulkType
+
+
+class FakeSObject:
+    def __init__(self, latency) -> None:
+        self.latency = latency
+        self.created = []
+
+    def create(self, data):
+        time.sleep(self.latency)
+        self.created.append(data)
+        return {"id": "a00000000000001", "success": True, "errors": []}
+
+
+class FakeBulkHandler:
+    def __init__(self, client) -> None:
+        self.client = client
+
+    def __getattr__(self, name):
+        bulk_type = FakeBulkType(
+            name,
+            latency=self.client.latency,
+            error_rate=self.client.error_rate,
+            keep_batches=False,
+        )
+        self.client.bulk_types.append(bulk_type)
+        return bulk_type
+
+
+class FakeSfClient:
+    """
+    Enough of SfClient for the Orchestrator: bulk upserts and creating the
+    execution object
+    """
+
+    def __init__(self, latency=0.05, error_rate=0.01) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bulk_types = []
+        self.bulk = FakeBulkHandler(self)
+        self.sobjects = {}
+
+    def __getattr__(self, name):
+        return self.sobjects.setdefault(name, FakeSObject(self.latency))
+
+    @property
+    def api_calls(self):
+        return sum(bulk_type.api_calls for bulk_type in self.bulk_types)
@@ -1,4 +1,26 @@
 __version__ = "0.1.0"
 
-from django_s3_csv_2_sfdc.salesforce_client import SfClient as SalesforceClient
-from django_s3_csv_2_sfdc.orchestrator import Orchestrator
\ No newline at end of file
+import importlib
+
+# the top-level names are only imported when they're first used (PEP 562),
+# so that, e.g., utils doesn't pay for simple_salesforce and boto3
+_LAZY_ATTRIBUTES = {
+    "SalesforceClient": ("django_s3_csv_2_sfdc.salesforce_client", "SfClient"),
+    "Orchestrator": ("django_s3_csv_2_sfdc.orchestrator", "Orchestrator"),
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attribute = _LAZY_ATTRIBUTES[name]
+    value = getattr(importlib.import_module(module_name), attribute)
+    # cache it, so __getattr__ isn't called for it again
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
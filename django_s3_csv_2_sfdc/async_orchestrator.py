@@ -0,0 +1,252 @@
+import asyncio
+import functools
+import os
+
+from typing import Iterable
+
+from django_s3_csv_2_sfdc.orchestrator import Orchestrator
+from django_s3_csv_2_sfdc.s3_helpers import DEFAULT_CHUNK_SIZE, upload_file
+from django_s3_csv_2_sfdc.utils import get_temp
+
+# copy_object's limit; bigger files are archived with move_file
+MAX_COPY_OBJECT_BYTES = 5 * 1024 * 1024 * 1024
+
+
+class AsyncOrchestrator(Orchestrator):
+    """
+    The Orchestrator, with awaitable versions of its steps, so one process can
+    have many files on the go at once
+
+        async def handle(s3_object_key):
+            orchestrator = await MyOrchestrator.acreate(
+                s3_object_key, settings.S3_BUCKET, sf_client=salesforce, async_s3_client=s3
+            )
+            records = [serialize(row) for row in orchestrator.iter_rows()]
+            await orchestrator.abulk_upsert("Contact", records, "Email__c")
+            await orchestrator.aautomagically_finish_up()
+
+        async with aiobotocore.session.get_session().create_client("s3") as s3:
+            await asyncio.gather(*(handle(key) for key in keys))
+
+    Like Django's async APIs, the awaitable methods are the sync ones with an
+    "a" in front, and the sync ones still work. With an async_s3_client (e.g.,
+    aiobotocore's), S3 is called without blocking; without one, and for
+    everything that isn't S3 (simple_salesforce only speaks requests), the
+    sync methods are run in the event loop's executor. So is the disk, and
+    so is any sync step a subclass overrides (e.g., archive_file), in place
+    of its awaitable version
+    """
+
+    def __init__(self, *args, async_s3_client=None, **kwargs) -> None:
+        self.async_s3_client = async_s3_client
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    async def acreate(cls, *args, stream: bool = False, **kwargs):
+        """
+        Awaitable constructor, since constructing an Orchestrator downloads
+        the file. Takes the same arguments as __init__
+        """
+        # construct it without downloading, then download the async way
+        orchestrator = await _run_sync(cls, *args, stream=True, **kwargs)
+        orchestrator.stream = stream
+        if not stream:
+            with orchestrator.instrumentation.timer("download_s3_file"):
+                await orchestrator.adownload_s3_file()
+            await _run_sync(orchestrator.count_downloaded_bytes)
+        return orchestrator
+
+    async def adownload_s3_file(self):
+        if not self.async_s3_client or self.overrides("download_s3_file"):
+            return await _run_sync(self.download_s3_file)
+
+        download_path = get_temp() / self.s3_object_key
+        await _run_sync(download_path.parent.mkdir, parents=True, exist_ok=True)
+        response = await self.async_s3_client.get_object(
+            Bucket=self.bucket_name, Key=self.s3_object_key
+        )
+        # the disk is written to in the executor, so the loop never waits on it
+        file = await _run_sync(open, download_path, "wb")
+        try:
+            body = response["Body"]
+            while True:
+                chunk = await body.read(DEFAULT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await _run_sync(file.write, chunk)
+        finally:
+            await _run_sync(file.close)
+        self.downloaded_file = download_path
+
+    def overrides(self, name: str) -> bool:
+        """
+        Whether a subclass has overridden the sync step name, in which case
+        its awaitable version runs that override in the executor instead
+        """
+        return getattr(type(self), name) is not getattr(AsyncOrchestrator, name)
+
+    async def alog_batch(
+        self,
+        results: Iterable[dict],
+        data: Iterable[dict],
+        salesforce_object: str,
+        upsert_key: str,
+    ):
+        return await _run_sync(
+            self.log_batch, results, data, salesforce_object, upsert_key
+        )
+
+    async def abulk_upsert(
+        self, salesforce_object: str, data: Iterable[dict], upsert_key: str, **kwargs
+    ) -> int:
+        """
+        bulk_upsert, in the executor. Its batches are already pushed
+        concurrently, so this mostly frees up the event loop
+        """
+        return await _run_sync(
+            self.bulk_upsert, salesforce_object, data, upsert_key, **kwargs
+        )
+
+    async def aautomagically_finish_up(self):
+        if self.overrides("automagically_finish_up"):
+            return await _run_sync(self.automagically_finish_up)
+        await _run_sync(self.error_report_writer.close)
+        await self.areport()
+        await _run_sync(self.wrap_up)
+
+    async def areport(self):
+        """
+        report, with the awaitable version of each of its steps
+        """
+        if self.overrides("report"):
+            return await _run_sync(self.report)
+        steps = [
+            (name, getattr(self, f"a{name}", functools.partial(_run_sync, method)))
+            for name, method in self.report_steps()
+        ]
+
+        async def run(step):
+            name, method = step
+            with self.instrumentation.timer(name):
+                return await method()
+
+        if not self.concurrent_report:
+            for step in steps:
+                await run(step)
+            return
+
+        results = await asyncio.gather(
+            *(run(step) for step in steps), return_exceptions=True
+        )
+        # every step gets its chance to run, then the first failure is raised
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def aarchive_file(self):
+        if (
+            not self.async_s3_client
+            or self.overrides("archive_file")
+            or self.is_too_big_to_copy()
+        ):
+            return await _run_sync(self.archive_file)
+
+        await self.async_s3_client.copy_object(
+            Bucket=self.bucket_name,
+            Key=self.archive_file_s3_key,
+            CopySource={"Bucket": self.bucket_name, "Key": self.s3_object_key},
+        )
+        await self.async_s3_client.delete_object(
+            Bucket=self.bucket_name, Key=self.s3_object_key
+        )
+
+    def is_too_big_to_copy(self) -> bool:
+        # streamed files weren't downloaded, so they may well be big
+        if not self.downloaded_file:
+            return True
+        return os.path.getsize(self.downloaded_file) > MAX_COPY_OBJECT_BYTES
+
+    async def aupload_error_report(self):
+        if not self.async_s3_client or self.overrides("upload_error_report"):
+            return await _run_sync(self.upload_error_report)
+        assert self.error_report_path, f"error_report_path is not set"
+        await _run_sync(self.prepare_error_report)
+        return await self.aupload(self.error_report_path, self.error_file_s3_key)
+
+    async def aupload_error_summary(self):
+        if not self.async_s3_client or self.overrides("upload_error_summary"):
+            return await _run_sync(self.upload_error_summary)
+        assert self.error_aggregator, f"errors aren't being summarized"
+        await _run_sync(self.error_aggregator.write_summary, self.error_summary_path)
+        return await self.aupload(self.error_summary_path, self.error_summary_s3_key)
+
+    async def aupload(self, local_path, s3_key: str) -> str:
+        """
+        Uploads a file, a chunk at a time, with the async client if there is
+        one. Files bigger than a chunk go up as a multipart upload
+        """
+        if not self.async_s3_client:
+            return await _run_sync(
+                upload_file,
+                local_path,
+                self.bucket_name,
+                s3_key,
+                s3_client=self.s3_client,
+            )
+
+        size = await _run_sync(os.path.getsize, local_path)
+        file = await _run_sync(open, local_path, "rb")
+        try:
+            if size <= DEFAULT_CHUNK_SIZE:
+                body = await _run_sync(file.read)
+                await self.async_s3_client.put_object(
+                    Body=body, Bucket=self.bucket_name, Key=s3_key
+                )
+            else:
+                await self._amultipart_upload(file, s3_key)
+        finally:
+            await _run_sync(file.close)
+        return s3_key
+
+    async def _amultipart_upload(self, file, s3_key: str):
+        client = self.async_s3_client
+        upload = await client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=s3_key
+        )
+        upload_id = upload["UploadId"]
+        parts = []
+        try:
+            while True:
+                chunk = await _run_sync(file.read, DEFAULT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                part_number = len(parts) + 1
+                response = await client.upload_part(
+                    Body=chunk,
+                    Bucket=self.bucket_name,
+                    Key=s3_key,
+                    PartNumber=part_number,
+                    UploadId=upload_id,
+                )
+                parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+            await client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            await client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=s3_key, UploadId=upload_id
+            )
+            raise
+
+    async def acreate_execution_object(self):
+        return await _run_sync(self.create_execution_object)
+
+
+async def _run_sync(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(function, *args, **kwargs)
+    )
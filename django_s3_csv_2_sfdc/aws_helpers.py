@@ -0,0 +1,65 @@
+import boto3
+import threading
+
+from botocore.config import Config
+
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+
+_clients = {}
+_overrides = {}
+_lock = threading.Lock()
+
+
+def get_client(
+    service: str = "s3",
+    region_name: str = None,
+    max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+):
+    """
+    Returns a shared boto3 client, creating it on first use
+
+    Clients are cached by (service, region_name, max_pool_connections), so
+    credential/endpoint resolution only happens once per process and the
+    underlying connections get reused across calls. boto3 clients are
+    thread-safe, so the same client can be shared between threads
+
+    If a client was registered with set_client, that one is returned instead
+    """
+    if service in _overrides:
+        return _overrides[service]
+
+    key = (service, region_name, max_pool_connections)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                # boto3's default session isn't thread-safe, so build our own
+                client = boto3.session.Session().client(
+                    service,
+                    region_name=region_name,
+                    config=Config(max_pool_connections=max_pool_connections),
+                )
+                _clients[key] = client
+    return client
+
+
+def set_client(client, service: str = "s3"):
+    """
+    Use your own client for a service, e.g., in tests or when you need
+    custom credentials. Pass None to go back to the shared clients
+    """
+    with _lock:
+        if client is None:
+            _overrides.pop(service, None)
+        else:
+            _overrides[service] = client
+
+
+def clear_clients():
+    """
+    Drops all cached and registered clients
+    """
+    with _lock:
+        _clients.clear()
+        _overrides.clear()
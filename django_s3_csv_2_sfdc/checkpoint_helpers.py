@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+from django_s3_csv_2_sfdc.s3_helpers import delete_file
+from django_s3_csv_2_sfdc.step_function_helpers import (
+    cache_data_in_s3,
+    pull_cached_data_from_s3,
+)
+from django_s3_csv_2_sfdc.utils import get_temp
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class LocalCheckpointStore:
+    """
+    Keeps checkpoints as json files in a local folder, TEMP/checkpoints by default
+
+    Handy for tests, or wherever the local disk outlives the process. Also
+    good for anything else that's a small json document, e.g., a SessionCache
+    """
+
+    def __init__(self, folder: Path = None) -> None:
+        self.folder = Path(folder) if folder else None
+
+    def get_path(self, name: str) -> Path:
+        folder = self.folder if self.folder else get_temp() / "checkpoints"
+        return folder / f"{name}.json"
+
+    def load(self, name: str) -> Optional[dict]:
+        path = self.get_path(name)
+        if not path.is_file():
+            return None
+        with open(path) as file:
+            return json.load(file)
+
+    def save(self, name: str, state: dict):
+        path = self.get_path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write then rename, so a timeout can't leave half a checkpoint behind,
+        # and concurrent writers don't write over each other's partial files
+        descriptor, partial_path = tempfile.mkstemp(
+            dir=path.parent, prefix=path.name, suffix=".partial"
+        )
+        with os.fdopen(descriptor, "w") as file:
+            json.dump(state, file)
+        os.replace(partial_path, path)
+
+    @contextmanager
+    def lock(self, name: str):
+        """
+        Holds an exclusive lock on name, across processes sharing the folder
+        """
+        path = self.get_path(name).with_suffix(".lock")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a") as file:
+            if fcntl:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def delete(self, name: str):
+        path = self.get_path(name)
+        if path.is_file():
+            path.unlink()
+
+
+class S3CheckpointStore:
+    """
+    Keeps checkpoints in S3 with cache_data_in_s3, under folder/
+    """
+
+    def __init__(self, bucket: str, folder: str = "checkpoints", s3_client=None):
+        self.bucket = bucket
+        self.folder = folder
+        self.s3_client = s3_client
+
+    def get_s3_key(self, name: str) -> str:
+        return (Path(self.folder) / f"{name}.json").as_posix()
+
+    def load(self, name: str) -> Optional[dict]:
+        try:
+            return pull_cached_data_from_s3(
+                self.bucket, self.get_s3_key(name), s3_client=self.s3_client
+            )
+        except ClientError as exception:
+            if exception.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+
+    def save(self, name: str, state: dict):
+        cache_data_in_s3(
+            state, self.bucket, self.get_s3_key(name), s3_client=self.s3_client
+        )
+
+    def delete(self, name: str):
+        delete_file(self.get_s3_key(name), self.bucket, s3_client=self.s3_client)
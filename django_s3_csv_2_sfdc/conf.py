@@ -0,0 +1,95 @@
+import os
+import sys
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class Settings:
+    """
+    Everything this package reads from settings, for when there's no Django
+
+        from django_s3_csv_2_sfdc import conf
+
+        conf.configure(TEMP="/tmp", SFDC_USERNAME=..., SFDC_PASSWORD=...)
+    """
+
+    TEMP: Optional[str] = None
+    SFDC_USERNAME: Optional[str] = None
+    SFDC_PASSWORD: Optional[str] = None
+    SFDC_SECURITY_TOKEN: Optional[str] = None
+    SFDC_DOMAIN: Optional[str] = None
+
+
+# what settings fall back to when they aren't set anywhere
+DEFAULTS = {"SFDC_DOMAIN": "na"}
+
+_configured: Optional[Settings] = None
+_missing = object()
+
+
+def configure(settings: Settings = None, **options):
+    """
+    Use these settings ahead of Django's or the environment's. Pass a
+    Settings, or its fields as keyword arguments; fields left unset are
+    still looked up in Django's settings and the environment
+    """
+    global _configured
+    if settings is None:
+        settings = Settings(**options)
+    _configured = settings
+
+
+def reset():
+    """
+    Forgets configure()'d settings
+    """
+    global _configured
+    _configured = None
+
+
+def _get_django_setting(name: str):
+    # Django's only imported when it's actually in use, so that it's not on
+    # the hot path (e.g., a Lambda cold start) for anyone else
+    if "django" not in sys.modules and not os.environ.get("DJANGO_SETTINGS_MODULE"):
+        return _missing
+    try:
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+    except ImportError:
+        return _missing
+    # reading a setting is what sets up Django's lazy settings, so don't
+    # check settings.configured first
+    try:
+        return getattr(settings, name, _missing)
+    except (ImproperlyConfigured, ImportError):
+        return _missing
+
+
+def get_setting(name: str, default=_missing):
+    """
+    Looks name up in the settings passed to configure(), then in Django's
+    settings (if Django's in use), then in the environment variables
+
+    Raises an AttributeError if it's nowhere to be found and there's no default
+    """
+    if _configured is not None:
+        value = getattr(_configured, name, None)
+        if value is not None:
+            return value
+
+    value = _get_django_setting(name)
+    if value is not _missing:
+        return value
+    if name in os.environ:
+        return os.environ[name]
+
+    if name in DEFAULTS:
+        return DEFAULTS[name]
+    if default is not _missing:
+        return default
+    raise AttributeError(
+        f"{name} isn't set; define it in your django settings, pass it to "
+        "django_s3_csv_2_sfdc.conf.configure, or set it as an environment variable"
+    )
@@ -1,10 +1,108 @@
 import csv
+import datetime
+import functools
+import io
+import itertools
 import os
+import re
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, TextIO, Union
 
+from django_s3_csv_2_sfdc.sfdc_helpers import BulkError
 from django_s3_csv_2_sfdc.utils import get_temp
 
+DEFAULT_ERROR_REPORT_HEADERS = [
+    "salesforce_object",
+    "code",
+    "message",
+    "upsert_key",
+    "upsert_key_value",
+    "object_json",
+]
+
+
+class ErrorReportWriter:
+    """
+    Writes the errors from parse_bulk_upsert_results to a csv error report,
+    keeping the file open between batches
+
+    The file is opened (and its folder created) on the first write. Headers
+    are only written if the file didn't exist yet, so an existing report is
+    appended to. Rows are written as the errors iterable is consumed, so pass
+    a generator to avoid holding them all in memory
+
+    With flush_every_write, the report is flushed after every call to write,
+    so it's always complete on disk between batches. Turn it off to only
+    flush when buffer_size bytes have piled up, and on close
+    """
+
+    def __init__(
+        self,
+        report_path: Path,
+        headers: List[str] = None,
+        buffer_size: int = io.DEFAULT_BUFFER_SIZE,
+        flush_every_write: bool = True,
+    ) -> None:
+        self.report_path = Path(report_path)
+        self.headers = headers if headers else DEFAULT_ERROR_REPORT_HEADERS
+        self.buffer_size = buffer_size
+        self.flush_every_write = flush_every_write
+        self.error_count = 0
+        self._file = None
+        self._writer = None
+
+    def open(self) -> "ErrorReportWriter":
+        if self._file is None:
+            self.report_path.parent.mkdir(parents=True, exist_ok=True)
+            write_headers = not os.path.isfile(self.report_path)
+            self._file = open(
+                self.report_path, mode="a", newline="", buffering=self.buffer_size
+            )
+            self._writer = csv.writer(
+                self._file, delimiter=",", quotechar='"', quoting=csv.QUOTE_MINIMAL
+            )
+            if write_headers:
+                self._writer.writerow(self.headers)
+        return self
+
+    def write(self, errors: Iterable) -> int:
+        """
+        Writes a row for each error and returns how many there were
+
+        Errors can be BulkErrors or dicts with a key for every header
+        """
+        self.open()
+        headers = self.headers
+        default_headers = headers == DEFAULT_ERROR_REPORT_HEADERS
+        writerow = self._writer.writerow
+        errors_count = 0
+        for error in errors:
+            if default_headers and type(error) is BulkError:
+                writerow(error.to_row())
+            else:
+                writerow([error[header] for header in headers])
+            errors_count += 1
+        self.error_count += errors_count
+        if self.flush_every_write:
+            self._file.flush()
+        return errors_count
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def __enter__(self) -> "ErrorReportWriter":
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
 
 def create_error_report(
     errors: list,
@@ -12,36 +110,293 @@ def create_error_report(
     headers: List[str] = None,
 ) -> int:
     """
-    Takes in the errors from the output of parse_bulk_upsert_results and writes a report
+    Takes in the errors from the output of parse_bulk_upsert_results (BulkErrors
+    or dicts) and writes a report
+
+    If you're writing several batches to the same report, an ErrorReportWriter
+    saves reopening the file each time
+
+    TEMP must be set, see conf.get_setting
+    """
+    with ErrorReportWriter(report_path, headers=headers) as writer:
+        return writer.write(errors)
+
+
+TRUE_VALUES = frozenset(("true", "t", "yes", "y", "1"))
+FALSE_VALUES = frozenset(("false", "f", "no", "n", "0"))
+FIELD_TYPES = ("str", "int", "float", "bool", "date", "datetime")
+# what int and float columns accept, whichever engine converts them
+INT_PATTERN = re.compile(r"[+-]?[0-9]+")
+FLOAT_PATTERN = re.compile(
+    r"[+-]?(?:(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?|inf|infinity|nan)",
+    re.IGNORECASE,
+)
+
+
+def _to_bool(value: str) -> bool:
+    lowered = value.strip().lower()
+    if lowered in TRUE_VALUES:
+        return True
+    if lowered in FALSE_VALUES:
+        return False
+    raise ValueError(f"{value!r} isn't a boolean")
+
+
+def _to_int(value: str) -> int:
+    if not INT_PATTERN.fullmatch(value):
+        raise ValueError(f"{value!r} isn't an integer")
+    return int(value)
+
+
+def _to_float(value: str) -> float:
+    if not FLOAT_PATTERN.fullmatch(value):
+        raise ValueError(f"{value!r} isn't a number")
+    return float(value)
+
 
-    TEMP must be defined in your django settings
+class Field:
     """
-    csv_rows = []
-    if not headers:
-        headers = [
-            "salesforce_object",
-            "code",
-            "message",
-            "upsert_key",
-            "upsert_key_value",
-            "object_json",
+    How one csv column becomes one Salesforce field
+
+    Parameters:
+        column: The csv header
+        field: The Salesforce field name, defaults to column
+        type: One of FIELD_TYPES, or a callable taking the (non-null) string
+        date_format: strptime format for date and datetime columns; defaults
+            to ISO 8601. Either way, they're sent to Salesforce as ISO 8601
+        null_values: Cell values that mean null, after stripping whitespace
+        default: What nulls become
+        omit_nulls: Leave the field out of the record when it's null, so that
+            the upsert doesn't overwrite what's in Salesforce
+    """
+
+    def __init__(
+        self,
+        column: str,
+        field: str = None,
+        type: Union[str, Callable[[str], object]] = "str",
+        date_format: str = None,
+        null_values: Iterable[str] = ("",),
+        default=None,
+        omit_nulls: bool = False,
+    ) -> None:
+        assert (
+            callable(type) or type in FIELD_TYPES
+        ), f"type must be one of {FIELD_TYPES}"
+        self.column = column
+        self.field = field if field else column
+        self.type = type
+        self.date_format = date_format
+        self.null_values = frozenset(null_values)
+        self.default = default
+        self.omit_nulls = omit_nulls
+
+    def get_converter(self) -> Callable[[str], object]:
+        if callable(self.type):
+            return self.type
+        if self.type == "str":
+            return str.strip
+        if self.type == "int":
+            return _to_int
+        if self.type == "float":
+            return _to_float
+        if self.type == "bool":
+            return _to_bool
+        if self.type == "date":
+            if self.date_format:
+                strptime = datetime.datetime.strptime
+                date_format = self.date_format
+                return lambda value: strptime(value, date_format).date().isoformat()
+            return lambda value: datetime.date.fromisoformat(value).isoformat()
+        if self.date_format:
+            strptime = datetime.datetime.strptime
+            date_format = self.date_format
+            return lambda value: strptime(value, date_format).isoformat()
+        return lambda value: datetime.datetime.fromisoformat(value).isoformat()
+
+    def convert(self, values: Sequence[str]) -> list:
+        """
+        Converts a whole column of cells at once
+        """
+        nulls = self.null_values
+        default = self.default
+        convert = self.get_converter()
+
+        if self.type in ("bool", "date", "datetime"):
+            # these repeat a lot, so convert each distinct value just once
+            lookup = {
+                value: convert(value.strip())
+                for value in set(values)
+                if value is not None and value.strip() not in nulls
+            }
+            return [lookup.get(value, default) for value in values]
+
+        stripped = (None if value is None else value.strip() for value in values)
+        return [
+            default if value is None or value in nulls else convert(value)
+            for value in stripped
         ]
 
-    if not os.path.isfile(report_path):
-        csv_rows.append(headers)
 
-    errors_count = 0
-    for error in errors:
-        errors_count += 1
-        csv_rows.append([error[header] for header in headers])
+@functools.lru_cache(maxsize=None)
+def _import_pyarrow():
+    """
+    pyarrow, or None if it isn't installed. It's imported when it's first
+    needed, rather than along with this module (and so the Orchestrator)
+    """
+    try:
+        import pyarrow
+        import pyarrow.compute
+    except ImportError:  # pragma: no cover
+        return None
+    return pyarrow
+
+
+def _convert_with_pyarrow(field: Field, values: Sequence[str]) -> list:
+    pyarrow = _import_pyarrow()
+    compute = pyarrow.compute
+    array = compute.utf8_trim_whitespace(pyarrow.array(values, type=pyarrow.string()))
+    is_null = compute.is_in(
+        array, value_set=pyarrow.array(list(field.null_values), type=pyarrow.string())
+    )
+    array = compute.if_else(is_null, pyarrow.scalar(None, pyarrow.string()), array)
+
+    if field.type in ("int", "float"):
+        # pyarrow's casts take some things python's don't and vice versa, so
+        # hold both to the same patterns
+        pattern = INT_PATTERN if field.type == "int" else FLOAT_PATTERN
+        matches = compute.match_substring_regex(
+            array, pattern=f"^(?:{pattern.pattern})$", ignore_case=True
+        )
+        if not compute.all(matches).as_py():
+            bad_value = compute.filter(array, compute.invert(matches))[0].as_py()
+            kind = "an integer" if field.type == "int" else "a number"
+            raise ValueError(f"{bad_value!r} isn't {kind}")
+    if field.type == "int":
+        array = compute.replace_substring_regex(array, pattern=r"^\+", replacement="")
+        array = array.cast(pyarrow.int64())
+    elif field.type == "float":
+        array = array.cast(pyarrow.float64())
+
+    converted = array.to_pylist()
+    if field.default is not None:
+        default = field.default
+        converted = [default if value is None else value for value in converted]
+    return converted
+
 
-    Path(report_path.parent).mkdir(parents=True, exist_ok=True)
+class RecordSerializer:
+    """
+    Turns csv rows into upsert-ready records, per a list of Fields
 
-    with open(report_path, mode="a", newline="") as file:
-        writer = csv.writer(
-            file, delimiter=",", quotechar='"', quoting=csv.QUOTE_MINIMAL
+        serializer = RecordSerializer(
+            [
+                Field("Email", "Email__c"),
+                Field("Joined", "Join_Date__c", type="date", date_format="%m/%d/%Y"),
+                Field("Score", "Score__c", type="float", omit_nulls=True),
+            ]
         )
-        for row in csv_rows:
-            writer.writerow(row)
+        with orchestrator.open_file() as file:
+            records = serializer.iter_records(file)
+            orchestrator.bulk_upsert("Contact", records, "Email__c")
+
+    Rows are read chunk_size at a time and converted a column at a time, so
+    the type dispatch happens once per column rather than once per cell, and
+    only a chunk is ever in memory. With engine="pyarrow" (the default when
+    it's installed), str, int and float columns are converted by pyarrow,
+    and accept the same values as with engine="python". bool, date, datetime
+    and callable types are always converted in python; bool, date and
+    datetime just once per distinct value
+    """
+
+    def __init__(
+        self, fields: List[Field], chunk_size: int = 10000, engine: str = None
+    ) -> None:
+        if engine is None:
+            engine = "pyarrow" if _import_pyarrow() else "python"
+        assert engine in ("python", "pyarrow"), f"engine must be python or pyarrow"
+        assert engine == "python" or _import_pyarrow(), f"pyarrow isn't installed"
+        self.fields = fields
+        self.chunk_size = chunk_size
+        self.engine = engine
+
+    def convert_column(self, field: Field, values: Sequence[str]) -> list:
+        if self.engine == "pyarrow" and field.type in ("str", "int", "float"):
+            return _convert_with_pyarrow(field, values)
+        return field.convert(values)
+
+    def serialize_columns(self, columns: Dict[str, Sequence[str]]) -> List[dict]:
+        """
+        Converts a chunk held as {column: [cells]} into a list of records
+        """
+        names = []
+        converted = []
+        for field in self.fields:
+            assert field.column in columns, f"{field.column} isn't a column"
+            try:
+                converted.append(self.convert_column(field, columns[field.column]))
+            except (ValueError, TypeError) as exception:
+                raise ValueError(
+                    f"couldn't convert {field.column} to {field.type}: {exception}"
+                ) from exception
+            names.append(field.field)
+
+        records = [dict(zip(names, values)) for values in zip(*converted)]
+
+        omitted = [field.field for field in self.fields if field.omit_nulls]
+        if omitted:
+            for record in records:
+                for name in omitted:
+                    if record[name] is None:
+                        del record[name]
+        return records
+
+    def serialize_rows(self, rows: Sequence[dict]) -> List[dict]:
+        """
+        Converts dicts, e.g., from Orchestrator.iter_rows, into records
+        """
+        columns = {
+            field.column: [row.get(field.column) for row in rows]
+            for field in self.fields
+        }
+        return self.serialize_columns(columns)
+
+    def iter_batches(self, file: TextIO) -> Iterator[List[dict]]:
+        """
+        Yields lists of up to chunk_size records from an open csv file
+        """
+        reader = csv.reader(file)
+        headers = next(reader, None)
+        if headers is None:
+            return
+        positions = {header: position for position, header in enumerate(headers)}
+        for field in self.fields:
+            assert field.column in positions, f"{field.column} isn't a column"
+
+        while True:
+            chunk = list(itertools.islice(reader, self.chunk_size))
+            if not chunk:
+                break
+            # short rows get None for their missing cells, like csv.DictReader
+            width = len(headers)
+            columns = list(
+                zip(
+                    *(
+                        row if len(row) >= width else row + [None] * (width - len(row))
+                        for row in chunk
+                    )
+                )
+            )
+            yield self.serialize_columns(
+                {
+                    field.column: columns[positions[field.column]]
+                    for field in self.fields
+                }
+            )
 
-    return errors_count
+    def iter_records(self, file: TextIO) -> Iterator[dict]:
+        """
+        Yields records one at a time, e.g., for Orchestrator.bulk_upsert
+        """
+        for batch in self.iter_batches(file):
+            yield from batch
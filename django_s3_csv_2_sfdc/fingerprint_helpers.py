@@ -0,0 +1,164 @@
+import hashlib
+import json
+import struct
+import zlib
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+
+from botocore.exceptions import ClientError
+
+from django_s3_csv_2_sfdc.aws_helpers import get_client
+
+MAGIC = b"FPX1"
+DIGEST_SIZE = 8
+KEY_LENGTH = struct.Struct(">H")
+
+
+class FingerprintIndex:
+    """
+    Remembers a fingerprint (a short hash) of every record upserted, keyed by
+    its upsert key value, so that the next run only sends what's changed
+
+        index = FingerprintIndex(
+            "Email__c", bucket=settings.S3_BUCKET, s3_key="fingerprints/contacts.bin"
+        ).load()
+        for record in index.filter(records):
+            ...
+        index.save()
+
+    filter also drops later duplicates of a key within the run. Pass it to the
+    Orchestrator (fingerprint_index=index) and it does all of this for you,
+    and forgets the fingerprints of records that errored, so they're retried
+
+    The index is kept in S3 when bucket and s3_key are given, otherwise at
+    path, as a zlib compressed file of (key, digest) pairs. fields limits the
+    fingerprint to the fields that matter; by default it's the whole record
+    """
+
+    def __init__(
+        self,
+        upsert_key: str,
+        fields: List[str] = None,
+        bucket: str = None,
+        s3_key: str = None,
+        path: Path = None,
+        s3_client=None,
+    ) -> None:
+        assert (bucket and s3_key) or path, f"pass bucket and s3_key, or path"
+        self.upsert_key = upsert_key
+        self.fields = fields
+        self.bucket = bucket
+        self.s3_key = s3_key
+        self.path = Path(path) if path else None
+        self.s3_client = s3_client
+        self.fingerprints: Dict[str, bytes] = {}
+        self.new_count = 0
+        self.changed_count = 0
+        self.unchanged_count = 0
+        self.duplicate_count = 0
+
+    @property
+    def skipped_count(self) -> int:
+        return self.unchanged_count + self.duplicate_count
+
+    def fingerprint(self, record: dict) -> bytes:
+        if self.fields:
+            record = {field: record.get(field) for field in self.fields}
+        serialized = json.dumps(
+            record, sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.blake2b(
+            serialized.encode("utf-8"), digest_size=DIGEST_SIZE
+        ).digest()
+
+    def filter(self, records: Iterable[dict]) -> Iterator[dict]:
+        """
+        Yields the records that are new or have changed since the index was
+        saved, the first time their key comes up. The index is updated as it
+        goes
+        """
+        fingerprints = self.fingerprints
+        fingerprint = self.fingerprint
+        upsert_key = self.upsert_key
+        seen = set()
+        for record in records:
+            key = str(record[upsert_key])
+            if key in seen:
+                self.duplicate_count += 1
+                continue
+            seen.add(key)
+
+            digest = fingerprint(record)
+            previous = fingerprints.get(key)
+            if previous == digest:
+                self.unchanged_count += 1
+                continue
+            if previous is None:
+                self.new_count += 1
+            else:
+                self.changed_count += 1
+            fingerprints[key] = digest
+            yield record
+
+    def forget(self, key_value):
+        """
+        Drops a key, e.g., because its upsert failed, so it's sent next time
+        """
+        self.fingerprints.pop(str(key_value), None)
+
+    def dumps(self) -> bytes:
+        parts = [MAGIC]
+        pack = KEY_LENGTH.pack
+        for key, digest in self.fingerprints.items():
+            encoded = key.encode("utf-8")
+            parts.append(pack(len(encoded)))
+            parts.append(encoded)
+            parts.append(digest)
+        return zlib.compress(b"".join(parts))
+
+    def loads(self, content: bytes):
+        content = zlib.decompress(content)
+        assert content.startswith(MAGIC), f"not a fingerprint index"
+        fingerprints = {}
+        position = len(MAGIC)
+        unpack = KEY_LENGTH.unpack_from
+        while position < len(content):
+            (length,) = unpack(content, position)
+            position += KEY_LENGTH.size
+            key = content[position : position + length].decode("utf-8")
+            position += length
+            fingerprints[key] = content[position : position + DIGEST_SIZE]
+            position += DIGEST_SIZE
+        self.fingerprints = fingerprints
+
+    def load(self) -> "FingerprintIndex":
+        """
+        Loads the saved index, if there is one. Returns the index itself
+        """
+        if self.path:
+            if self.path.is_file():
+                self.loads(self.path.read_bytes())
+            return self
+
+        s3 = self.s3_client if self.s3_client else get_client("s3")
+        try:
+            body = s3.get_object(Bucket=self.bucket, Key=self.s3_key)["Body"]
+        except ClientError as exception:
+            if exception.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return self
+            raise
+        self.loads(body.read())
+        return self
+
+    def save(self):
+        content = self.dumps()
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            partial_path = self.path.with_suffix(".partial")
+            partial_path.write_bytes(content)
+            partial_path.replace(self.path)
+            return
+
+        s3 = self.s3_client if self.s3_client else get_client("s3")
+        s3.put_object(Body=content, Bucket=self.bucket, Key=self.s3_key)
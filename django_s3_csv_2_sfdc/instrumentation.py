@@ -0,0 +1,129 @@
+import json
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Dict
+
+
+class Instrumentation:
+    """
+    Where the Orchestrator and SfClient report timings and counts to
+
+    This base class throws everything away. Use MetricsRecorder to keep them,
+    or one of its subclasses to also emit them somewhere when flushed
+    """
+
+    # whether anything's actually being recorded
+    enabled = False
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Times the block, adding the seconds it took to `name`
+        """
+        yield
+
+    def incr(self, name: str, value: float = 1):
+        """
+        Adds value to the counter `name`
+        """
+        pass
+
+    def snapshot(self) -> dict:
+        return {"timings": {}, "counters": {}}
+
+    def flush(self):
+        pass
+
+
+class MetricsRecorder(Instrumentation):
+    """
+    Keeps timings (in seconds) and counters in memory. Safe to use from
+    several threads at once
+    """
+
+    enabled = True
+
+    def __init__(self) -> None:
+        self.timings: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.timings[name] = self.timings.get(name, 0) + elapsed
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"timings": dict(self.timings), "counters": dict(self.counters)}
+
+
+class LoggingInstrumentation(MetricsRecorder):
+    """
+    Logs everything recorded so far as a single json line when flushed
+    """
+
+    def __init__(
+        self, logger: logging.Logger = None, level: int = logging.INFO, **context
+    ) -> None:
+        super().__init__()
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.level = level
+        # e.g., s3_object_key, to tell runs apart
+        self.context = context
+
+    def flush(self):
+        self.logger.log(self.level, json.dumps({**self.context, **self.snapshot()}))
+
+
+class EMFInstrumentation(MetricsRecorder):
+    """
+    Prints everything recorded so far in CloudWatch's embedded metric format
+    when flushed. On Lambda, anything printed in this format becomes a metric
+
+    https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+    """
+
+    def __init__(self, namespace: str = "django-s3-csv-2-sfdc", **dimensions) -> None:
+        super().__init__()
+        self.namespace = namespace
+        self.dimensions = {key: str(value) for key, value in dimensions.items()}
+
+    def to_emf(self) -> dict:
+        snapshot = self.snapshot()
+        metrics = [
+            {"Name": name, "Unit": "Milliseconds"} for name in snapshot["timings"]
+        ] + [{"Name": name, "Unit": "Count"} for name in snapshot["counters"]]
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(self.dimensions.keys())],
+                        "Metrics": metrics,
+                    }
+                ],
+            },
+            **self.dimensions,
+            **{
+                name: round(seconds * 1000, 3)
+                for name, seconds in snapshot["timings"].items()
+            },
+            **snapshot["counters"],
+        }
+
+    def flush(self):
+        print(json.dumps(self.to_emf()))
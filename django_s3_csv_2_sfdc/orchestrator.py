@@ -1,15 +1,54 @@
+import copy
+import csv
+import io
+import itertools
+import os
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from pathlib import Path
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Type,
+)
+
+from simple_salesforce.exceptions import SalesforceGeneralError
 
-from django_s3_csv_2_sfdc.csv_helpers import create_error_report
+from django_s3_csv_2_sfdc.csv_helpers import ErrorReportWriter
+from django_s3_csv_2_sfdc.fingerprint_helpers import FingerprintIndex
+from django_s3_csv_2_sfdc.instrumentation import Instrumentation
 from django_s3_csv_2_sfdc.s3_helpers import (
+    DEFAULT_MAX_WORKERS,
+    delete_files,
+    download_bytes,
     download_file,
+    list_s3_keys,
+    open_s3_binary_stream,
+    open_s3_stream,
+    upload_bytes,
     upload_file,
     timestamp_s3_key,
     move_file,
+    move_files,
 )
 from django_s3_csv_2_sfdc.salesforce_client import SfClient
-from django_s3_csv_2_sfdc.sfdc_helpers import parse_bulk_upsert_results
-from django_s3_csv_2_sfdc.utils import get_iso, get_temp
+from django_s3_csv_2_sfdc.sfdc_helpers import (
+    BulkUpsertCounts,
+    ErrorAggregator,
+    iter_bulk_upsert_errors,
+    parse_bulk_upsert_results,
+)
+from django_s3_csv_2_sfdc.utils import batch_collection, get_iso, get_temp
 
 
 class Orchestrator:
@@ -18,7 +57,7 @@ class Orchestrator:
 
     __init__
     1. S3 event triggerred
-    2. File is downloaded
+    2. File is downloaded (or, with stream=True, read straight from S3 as it's consumed)
 
     (developer must implement this code themselves)
     3. File is serialized into whatever the business requirements are (abstract step)
@@ -32,8 +71,43 @@ class Orchestrator:
     8. a custom SFDC object is created, logging all of the above
 
     If you don't need/need to change something, subclass it!
+
+    Pass a checkpoint_store (see checkpoint_helpers) to survive timeouts. Every
+    batch bulk_upsert completes is checkpointed, along with the errors it added
+    to the report, so a run restarted on the same file skips the records
+    Salesforce has already seen and carries on with the same error report.
+    bulk_upsert_rows goes one better, and doesn't read those records' rows
+    again at all. The checkpoint is deleted once automagically_finish_up is
+    done
+
+    Pass a fingerprint_index (see fingerprint_helpers) and bulk_upsert only
+    sends records that are new or changed since the last run, once per key.
+    How many it skipped is self.skipped_count
+
+    Set summarize_errors and a summary of the errors, grouped by object, code
+    and message with a few samples each, is uploaded next to the error report.
+    Set max_error_report_rows too and, past that many, errors only make it
+    into the summary, which keeps mass failures from writing a huge report
+
+    Pass an instrumentation (e.g., instrumentation.EMFInstrumentation) to time
+    each of the steps above and count rows, errors and API calls. What it's
+    recorded so far is available as self.metrics
     """
 
+    # passed along to the ErrorReportWriter
+    error_report_buffer_size: int = io.DEFAULT_BUFFER_SIZE
+    flush_error_report_every_batch: bool = True
+    # run archive_file, upload_error_report and create_execution_object at
+    # the same time in report(). They don't depend on each other, unless
+    # you've overridden them so that they do
+    concurrent_report: bool = False
+    summarize_errors: bool = False
+    error_summary_sample_size: int = 5
+    # "csv" or "json"
+    error_summary_format: str = "csv"
+    # None means no limit. Implies summarize_errors
+    max_error_report_rows: int = None
+
     def __init__(
         self,
         s3_object_key,
@@ -43,21 +117,59 @@ class Orchestrator:
         error_report_file_name: str = None,
         error_folder: str = None,
         execution_object_name: str = None,
+        stream: bool = False,
+        s3_client=None,
+        instrumentation: Instrumentation = None,
+        checkpoint_store=None,
+        fingerprint_index: FingerprintIndex = None,
     ) -> None:
+        self.instrumentation = instrumentation if instrumentation else Instrumentation()
         self.s3_object_key = s3_object_key
         self.bucket_name = bucket_name
+        # None means the shared client from aws_helpers.get_client
+        self.s3_client = s3_client
 
         self.archive_folder = archive_folder
         self.error_folder = error_folder if error_folder else "errors"
 
         self.execution_object_name = execution_object_name
 
-        self.download_s3_file()
-        self.sf_client = sf_client
+        self.stream = stream
+        self.downloaded_file = None
+        if not self.stream:
+            with self.instrumentation.timer("download_s3_file"):
+                self.download_s3_file()
+            self.count_downloaded_bytes()
+        self.sf_client = None
+        self.set_sf_client(sf_client)
         self.timestamp = None
         self.set_timestamp()
+        self.error_report_writer: ErrorReportWriter = None
         self.set_error_report_name(error_report_file_name)
         self.error_count: int = 0
+        self.success_count: int = 0
+        # errors left out of the full report, past max_error_report_rows
+        self.error_report_overflow: int = 0
+        self.error_aggregator: ErrorAggregator = None
+        if self.summarize_errors or self.max_error_report_rows is not None:
+            self.error_aggregator = ErrorAggregator(self.error_summary_sample_size)
+
+        self.fingerprint_index = fingerprint_index
+
+        self.checkpoint_store = checkpoint_store
+        # records completed so far, per checkpoint key (the object, by default)
+        self.completed_records: Dict[str, int] = {}
+        # for bulk_upsert_rows, where in the file those records' rows end
+        self.row_offsets: Dict[str, int] = {}
+        # the error report is checkpointed a part (i.e., the rows it's gained
+        # since the last checkpoint) at a time
+        self.error_report_parts: List[str] = []
+        self.checkpointed_report_size: int = 0
+        # the keys the fingerprint index has forgotten, so that a restarted
+        # run forgets them again once it's skipped past their records
+        self.failed_keys: Set[str] = set()
+        if self.checkpoint_store:
+            self.load_checkpoint()
 
     def set_error_report_name(self, error_report_file_name=None):
         if error_report_file_name:
@@ -69,53 +181,528 @@ class Orchestrator:
         self.error_report_path = (
             Path(get_temp()) / self.error_folder / self.error_report_file_name
         )
+        if self.error_report_writer:
+            self.error_report_writer.close()
+        self.error_report_writer = ErrorReportWriter(
+            self.error_report_path,
+            buffer_size=self.error_report_buffer_size,
+            flush_every_write=self.flush_error_report_every_batch,
+        )
 
     def download_s3_file(self):
-        self.downloaded_file = download_file(self.s3_object_key, self.bucket_name)
+        self.downloaded_file = download_file(
+            self.s3_object_key, self.bucket_name, s3_client=self.s3_client
+        )
+
+    def open_file(self) -> TextIO:
+        """
+        Opens the triggering file for reading, either from the temp directory,
+        or, when streaming, straight from S3
+        """
+        if self.stream:
+            return open_s3_stream(
+                self.s3_object_key, self.bucket_name, s3_client=self.s3_client
+            )
+        return open(self.downloaded_file, newline="")
+
+    def iter_rows(self) -> Iterator[dict]:
+        """
+        Yields the rows of the triggering file as dicts, one at a time
+        """
+        with self.open_file() as file:
+            yield from csv.DictReader(file)
+
+    def open_binary_file(self) -> BinaryIO:
+        """
+        Like open_file, but for bytes, so it can be seeked around in
+        """
+        if self.stream:
+            return open_s3_binary_stream(
+                self.s3_object_key, self.bucket_name, s3_client=self.s3_client
+            )
+        return open(self.downloaded_file, "rb")
+
+    def iter_rows_with_offsets(
+        self, start: int = 0, encoding: str = "utf-8"
+    ) -> Iterator[Tuple[dict, int]]:
+        """
+        Yields (row, offset) for the rows of the triggering file, where offset
+        is the byte the row ends on. Starts with the row at byte start (or
+        right after the headers), without reading the rows before it
+        """
+        with self.open_binary_file() as file:
+            lines = _CountingLines(file, encoding)
+            reader = csv.DictReader(lines)
+            if reader.fieldnames is None:
+                return
+            if start > lines.offset:
+                file.seek(start)
+                lines.offset = start
+            for row in reader:
+                yield row, lines.offset
+
+    def count_downloaded_bytes(self):
+        # an overridden download_s3_file needn't download anything
+        if self.downloaded_file:
+            self.instrumentation.incr(
+                "bytes_downloaded", os.path.getsize(self.downloaded_file)
+            )
 
     def set_sf_client(self, sf_client: SfClient):
         self.sf_client = sf_client
 
+    def instruments_sf_client(self) -> bool:
+        """
+        Whether Salesforce's API calls and retries are reported along with
+        ours, which they are unless the client is being instrumented itself
+        """
+        if not self.instrumentation.enabled:
+            return False
+        instrumentation = getattr(self.sf_client, "instrumentation", None)
+        return (
+            isinstance(instrumentation, Instrumentation) and not instrumentation.enabled
+        )
+
+    def get_bulk_type(self, salesforce_object: str):
+        """
+        sf_client's bulk type for salesforce_object. The client can be shared
+        by several orchestrators, so rather than setting the client's
+        instrumentation, each gets its own copy of the type reporting to it
+        """
+        bulk_type = getattr(self.sf_client.bulk, salesforce_object)
+        if self.instruments_sf_client():
+            bulk_type = copy.copy(bulk_type)
+            bulk_type.instrumentation = self.instrumentation
+        return bulk_type
+
+    @property
+    def metrics(self) -> dict:
+        """
+        The timings (in seconds) and counters recorded so far, e.g., for
+        execution_sfdc_hash. Empty unless an instrumentation was passed in
+        """
+        return self.instrumentation.snapshot()
+
     def log_batch(
-        self, results: list, data: list, salesforce_object: str, upsert_key: str
+        self,
+        results: Iterable[dict],
+        data: Iterable[dict],
+        salesforce_object: str,
+        upsert_key: str,
     ):
         """
         The intention here is to call this method after making a bulk upsert
 
+        Errors are streamed into the error report as they're found, so results
+        and data can be any iterables, and neither is copied
+
         Parameters:
             results: The results from the Salesforce API
             data: The data you pushed
             salesforce_object: The name of the object you upserted to
             upsert_key: The upsert key you used
         """
-        batch = (results, list(data), salesforce_object, upsert_key)
-        _, errors = self.parse_sfdc_results(*batch)
-        error_count = self.create_error_report_file(errors)
+        counts = BulkUpsertCounts()
+        with self.instrumentation.timer("log_batch"):
+            errors = self.iter_sfdc_errors(
+                results, data, salesforce_object, upsert_key, counts=counts
+            )
+            if self.fingerprint_index:
+                errors = self.forget_fingerprints(errors)
+            if self.error_aggregator:
+                errors = self.error_aggregator.aggregate(errors)
+            overflow = self.error_report_overflow
+            if self.max_error_report_rows is not None:
+                errors = self.cap_error_report(errors)
+            error_count = self.create_error_report_file(errors)
+            error_count += self.error_report_overflow - overflow
         self.error_count += error_count
+        self.success_count += counts.successes
+        self.instrumentation.incr("batches")
+        self.instrumentation.incr("rows", counts.records)
+        self.instrumentation.incr("errors", error_count)
+
+    def forget_fingerprints(self, errors: Iterable[dict]) -> Iterator[dict]:
+        # so that records that failed aren't skipped as unchanged next time
+        for error in errors:
+            self.fingerprint_index.forget(error["upsert_key_value"])
+            if self.checkpoint_store:
+                self.failed_keys.add(str(error["upsert_key_value"]))
+            yield error
+
+    def cap_error_report(self, errors: Iterable[dict]) -> Iterator[dict]:
+        room = self.max_error_report_rows - (
+            self.error_count - self.error_report_overflow
+        )
+        for error in errors:
+            if room > 0:
+                room -= 1
+                yield error
+            else:
+                self.error_report_overflow += 1
+
+    @property
+    def skipped_count(self) -> int:
+        return self.fingerprint_index.skipped_count if self.fingerprint_index else 0
+
+    def bulk_upsert(
+        self,
+        salesforce_object: str,
+        data: Iterable[dict],
+        upsert_key: str,
+        checkpoint_key: str = None,
+        **kwargs,
+    ) -> int:
+        """
+        Upserts data through SfClient's concurrent bulk pipeline, calling
+        log_batch for every batch as its results come back
+
+        kwargs are passed along to SFBulkType.pipeline, e.g., batch_size or
+        max_in_flight. Returns the number of records pushed
+
+        With a checkpoint_store, records completed by a previous run are
+        skipped. Upserting to the same object more than once per file? Give
+        each call its own checkpoint_key
+
+        With a fingerprint_index, unchanged and duplicate records are skipped
+        before they're pushed (and aren't counted as pushed)
+        """
+        if self.fingerprint_index:
+            data = self.fingerprint_index.filter(data)
+        checkpoint_key = checkpoint_key if checkpoint_key else salesforce_object
+        # batches come back in order, so whatever was completed is a prefix
+        completed = self.completed_records.get(checkpoint_key, 0)
+        if completed:
+            data = self.skip_completed(data, completed)
+            self.instrumentation.incr("records_resumed", completed)
+        return self._bulk_upsert(
+            salesforce_object, data, upsert_key, checkpoint_key, completed, **kwargs
+        )
+
+    def skip_completed(self, data: Iterable[dict], completed: int) -> Iterator[dict]:
+        """
+        Skips the first completed records, which a previous run pushed. They
+        still went through the fingerprint index, so it lines up with that
+        run's, which marked the ones that failed as up to date. Those are
+        forgotten again
+        """
+        data = iter(data)
+        for _ in itertools.islice(data, completed):
+            pass
+        if self.fingerprint_index:
+            for key in self.failed_keys:
+                self.fingerprint_index.forget(key)
+        yield from data
+
+    def bulk_upsert_rows(
+        self,
+        salesforce_object: str,
+        serialize: Callable[[dict], Optional[dict]],
+        upsert_key: str,
+        checkpoint_key: str = None,
+        **kwargs,
+    ) -> int:
+        """
+        bulk_upsert for every row of the triggering file, as serialize turns
+        it into a record (or None, to leave the row out)
+
+        With a checkpoint_store, where the completed rows end in the file is
+        checkpointed too, so a restarted run picks up reading from there,
+        rather than reading (or, when streaming, downloading) them again
+        """
+        checkpoint_key = checkpoint_key if checkpoint_key else salesforce_object
+        completed = self.completed_records.get(checkpoint_key, 0)
+        if completed:
+            self.instrumentation.incr("records_resumed", completed)
+        # the offset of the row each record in flight came from, in order
+        offsets = deque()
+        read_to = [self.row_offsets.get(checkpoint_key, 0)]
+
+        def records():
+            for row, offset in self.iter_rows_with_offsets(read_to[0]):
+                read_to[0] = offset
+                record = serialize(row)
+                if record is not None:
+                    yield record
+
+        data = records()
+        if self.fingerprint_index:
+            data = self.fingerprint_index.filter(data)
+
+        def tracked():
+            # filter is lazy, so each record comes out right after its row
+            for record in data:
+                offsets.append(read_to[0])
+                yield record
+
+        def batch_done(batch):
+            for _ in batch:
+                offset = offsets.popleft()
+            self.row_offsets[checkpoint_key] = offset
+
+        return self._bulk_upsert(
+            salesforce_object,
+            tracked(),
+            upsert_key,
+            checkpoint_key,
+            completed,
+            batch_done=batch_done,
+            **kwargs,
+        )
+
+    def _bulk_upsert(
+        self,
+        salesforce_object: str,
+        data: Iterable[dict],
+        upsert_key: str,
+        checkpoint_key: str,
+        completed: int,
+        batch_done: Callable[[List[dict]], None] = None,
+        **kwargs,
+    ) -> int:
+        assert self.sf_client, f"sf_client isn't set"
+        bulk_type = self.get_bulk_type(salesforce_object)
+        # the index's count is for the whole run, and data is still unread
+        skipped = self.skipped_count
+        pushed = 0
+        for batch, results in bulk_type.pipeline_upsert(data, upsert_key, **kwargs):
+            self.log_batch(results, batch, salesforce_object, upsert_key)
+            pushed += len(batch)
+            if batch_done:
+                batch_done(batch)
+            self.save_checkpoint(checkpoint_key, completed + pushed)
+        if self.fingerprint_index:
+            self.instrumentation.incr("records_skipped", self.skipped_count - skipped)
+        return pushed
+
+    @property
+    def checkpoint_name(self) -> str:
+        return f"{self.bucket_name}/{self.s3_object_key}"
+
+    def load_checkpoint(self):
+        """
+        Picks up where a previous run on the same file left off, if it left a
+        checkpoint: same timestamp, same error report (pieced back together
+        from its parts, so new errors are appended to it) and same counts
+        """
+        state = self.checkpoint_store.load(self.checkpoint_name)
+        if not state:
+            return
+        self.set_timestamp(state["timestamp"])
+        self.error_folder = state["error_folder"]
+        self.set_error_report_name(state["error_report_file_name"])
+        self.error_report_parts = state.get("error_report_parts", [])
+        # a report left behind by the run that died (e.g., on a warm
+        # container) can have rows no part has, so it's always replaced
+        if os.path.isfile(self.error_report_path):
+            os.remove(self.error_report_path)
+        if self.error_report_parts:
+            self.error_report_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.error_report_path, "wb") as report:
+                for part in self.error_report_parts:
+                    report.write(
+                        download_bytes(part, self.bucket_name, s3_client=self.s3_client)
+                    )
+        self.checkpointed_report_size = (
+            os.path.getsize(self.error_report_path) if self.error_report_parts else 0
+        )
+        self.error_count = state["error_count"]
+        self.success_count = state["success_count"]
+        self.error_report_overflow = state.get("error_report_overflow", 0)
+        if self.error_aggregator and state.get("error_summary"):
+            self.error_aggregator.load(state["error_summary"])
+        self.completed_records = state["completed_records"]
+        self.row_offsets = state.get("row_offsets", {})
+        self.failed_keys = set(state.get("failed_keys", []))
+
+    def save_checkpoint(self, checkpoint_key: str, completed: int):
+        """
+        Records that the first completed records under checkpoint_key are done
+
+        Whatever the error report's gained since the last checkpoint is
+        uploaded first, as its own part, so the checkpoint never points past
+        errors that could be lost. A part uploaded by a run that died before
+        checkpointing it is left out, and overwritten, next time
+        """
+        self.completed_records[checkpoint_key] = completed
+        if not self.checkpoint_store:
+            return
+        with self.instrumentation.timer("save_checkpoint"):
+            self.upload_error_report_part()
+            self.checkpoint_store.save(
+                self.checkpoint_name,
+                {
+                    "timestamp": self.get_timestamp(),
+                    "error_folder": self.error_folder,
+                    "error_report_file_name": self.error_report_file_name,
+                    "error_count": self.error_count,
+                    "success_count": self.success_count,
+                    "error_report_overflow": self.error_report_overflow,
+                    "error_summary": (
+                        self.error_aggregator.summary()
+                        if self.error_aggregator
+                        else None
+                    ),
+                    "completed_records": self.completed_records,
+                    "row_offsets": self.row_offsets,
+                    "error_report_parts": self.error_report_parts,
+                    "failed_keys": sorted(self.failed_keys),
+                },
+            )
+
+    def upload_error_report_part(self):
+        self.error_report_writer.flush()
+        if not os.path.isfile(self.error_report_path):
+            return
+        with open(self.error_report_path, "rb") as report:
+            report.seek(self.checkpointed_report_size)
+            part = report.read()
+        if not part:
+            return
+        s3_key = f"{self.error_file_s3_key}.parts/{len(self.error_report_parts):05}"
+        upload_bytes(part, self.bucket_name, s3_key, s3_client=self.s3_client)
+        self.error_report_parts.append(s3_key)
+        self.checkpointed_report_size += len(part)
+
+    def delete_checkpoint(self):
+        """
+        Deletes the checkpoint, and the error report's parts along with it
+        """
+        self.checkpoint_store.delete(self.checkpoint_name)
+        if self.error_report_parts:
+            delete_files(
+                self.error_report_parts, self.bucket_name, s3_client=self.s3_client
+            )
+            self.error_report_parts = []
 
     def automagically_finish_up(self):
+        self.error_report_writer.close()
         self.report()
+        self.wrap_up()
+
+    def wrap_up(self):
+        """
+        What's left once the report's done: the fingerprint index is saved,
+        the checkpoint deleted and the instrumentation flushed
+        """
+        if self.fingerprint_index:
+            with self.instrumentation.timer("save_fingerprint_index"):
+                self.fingerprint_index.save()
+        if self.checkpoint_store:
+            self.delete_checkpoint()
+        self.flush_instrumentation()
+
+    def flush_instrumentation(self):
+        # SfClient's connection reuse, as well as everything else recorded
+        if isinstance(self.sf_client, SfClient):
+            self.sf_client.record_connection_stats(
+                self.instrumentation if self.instruments_sf_client() else None
+            )
+        self.instrumentation.flush()
+
+    @property
+    def api_budget(self) -> Optional[dict]:
+        """
+        How much of the org's API budget is left, per SfClient's governor,
+        e.g., to report in execution_sfdc_hash
+        """
+        if isinstance(self.sf_client, SfClient):
+            return self.sf_client.governor.budget()
+        return None
 
     def parse_sfdc_results(self, *args):
         return parse_bulk_upsert_results(*args)
 
+    def iter_sfdc_errors(self, *args, **kwargs):
+        return iter_bulk_upsert_errors(*args, **kwargs)
+
     def create_error_report_file(self, errors):
-        return create_error_report(errors, self.error_report_path)
+        return self.error_report_writer.write(errors)
+
+    def report_steps(self) -> List[Tuple[str, Callable[[], object]]]:
+        """
+        The steps report runs, as (name, method)
+        """
+        steps = [
+            ("archive_file", self.archive_file),
+            ("upload_error_report", self.upload_error_report),
+            ("create_execution_object", self.create_execution_object),
+        ]
+        if self.error_aggregator:
+            steps.insert(2, ("upload_error_summary", self.upload_error_summary))
+        return steps
 
     def report(self):
-        self.archive_file()
-        self.upload_error_report()
-        self.create_execution_object()
+        steps = self.report_steps()
+
+        def run(step):
+            name, method = step
+            with self.instrumentation.timer(name):
+                return method()
+
+        if not self.concurrent_report:
+            for step in steps:
+                run(step)
+            return
+
+        with ThreadPoolExecutor(max_workers=len(steps)) as pool:
+            futures = [pool.submit(run, step) for step in steps]
+        # every step gets its chance to run, then the first failure is raised
+        for future in futures:
+            future.result()
 
     def archive_file(self):
-        move_file(self.s3_object_key, self.archive_file_s3_key, self.bucket_name)
+        move_file(
+            self.s3_object_key,
+            self.archive_file_s3_key,
+            self.bucket_name,
+            s3_client=self.s3_client,
+        )
+
+    def prepare_error_report(self):
+        """
+        Makes sure everything logged so far is in the report file, and that
+        there is one, even if nothing was logged (e.g., the file was empty)
+        """
+        self.error_report_writer.flush()
+        if not os.path.isfile(self.error_report_path):
+            ErrorReportWriter(
+                self.error_report_path, headers=self.error_report_writer.headers
+            ).open().close()
 
     def upload_error_report(self):
         assert self.error_report_path, f"error_report_path is not set"
+        self.prepare_error_report()
         return upload_file(
-            self.error_report_path, self.bucket_name, self.error_file_s3_key
+            self.error_report_path,
+            self.bucket_name,
+            self.error_file_s3_key,
+            s3_client=self.s3_client,
         )
 
+    def upload_error_summary(self):
+        assert self.error_aggregator, f"errors aren't being summarized"
+        self.error_aggregator.write_summary(self.error_summary_path)
+        return upload_file(
+            self.error_summary_path,
+            self.bucket_name,
+            self.error_summary_s3_key,
+            s3_client=self.s3_client,
+        )
+
+    @property
+    def error_summary_file_name(self) -> str:
+        stem = Path(self.error_report_file_name).stem
+        return f"{stem}-summary.{self.error_summary_format}"
+
+    @property
+    def error_summary_path(self) -> Path:
+        return self.error_report_path.parent / self.error_summary_file_name
+
+    @property
+    def error_summary_s3_key(self) -> str:
+        return (Path(self.error_folder) / self.error_summary_file_name).as_posix()
+
     def set_timestamp(self, timestamp: str = None):
         self.timestamp = timestamp if timestamp else get_iso()
 
@@ -152,6 +739,275 @@ class Orchestrator:
             "Archive_Path__c": self.archive_file_s3_key,
             "Errors_Path__c": self.error_file_s3_key,
             "Errors_Count__c": self.error_count,
+            "Timings__c": json.dumps(self.metrics["timings"]),
         }
+
+        Bear in mind that create_execution_object's own timing can't be in here
         """
         raise NotImplementedError
+
+
+class _CountingLines:
+    """
+    Decodes a binary file a line at a time for the csv module, keeping track
+    of how many bytes it's read
+    """
+
+    def __init__(self, file: BinaryIO, encoding: str) -> None:
+        self.file = file
+        self.encoding = encoding
+        self.offset = file.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.file.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode(self.encoding)
+
+
+class MultiFileOrchestrator:
+    """
+    Handles several S3 files (e.g., a burst of small drops) as if they were one
+
+    Every file gets its own Orchestrator, and so its own error report and
+    archive, but their rows are pushed to Salesforce together, in full-size
+    batches, and the execution objects are all created in one call
+
+        orchestrator = MultiFileOrchestrator(
+            settings.S3_BUCKET,
+            prefix="incoming/",
+            orchestrator_class=MyOrchestrator,
+            sf_client=salesforce,
+            execution_object_name="Integration_Execution__c",
+        )
+        records = (
+            (s3_object_key, serialize(row))
+            for s3_object_key, row in orchestrator.iter_rows()
+        )
+        orchestrator.bulk_upsert("Account", records, "My_External_ID__c")
+        orchestrator.automagically_finish_up()
+
+    Rows always travel with the key of the file they came from, so that their
+    results end up in the right error report
+    """
+
+    # the most records the composite sobjects resource takes per request
+    composite_batch_size = 200
+
+    def __init__(
+        self,
+        bucket_name,
+        s3_object_keys: List[str] = None,
+        prefix: str = None,
+        orchestrator_class: Type[Orchestrator] = Orchestrator,
+        sf_client: SfClient = None,
+        execution_object_name: str = None,
+        s3_client=None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        **orchestrator_kwargs,
+    ) -> None:
+        """
+        Files are picked from s3_object_keys and/or everything under prefix.
+        orchestrator_kwargs are passed along to every file's orchestrator,
+        which are set up (i.e., downloaded) up to max_workers at a time
+
+        The files' rows are pushed as one job, which neither skips unchanged
+        records nor checkpoints, so fingerprint_index and checkpoint_store
+        aren't supported
+        """
+        unsupported = [
+            name
+            for name in ("fingerprint_index", "checkpoint_store")
+            if orchestrator_kwargs.get(name) is not None
+        ]
+        assert not unsupported, f"{', '.join(unsupported)} isn't supported here"
+        self.bucket_name = bucket_name
+        self.sf_client = sf_client
+        self.execution_object_name = execution_object_name
+        self.s3_client = s3_client
+        self.max_workers = max_workers
+
+        s3_object_keys = list(s3_object_keys) if s3_object_keys else []
+        if prefix is not None:
+            s3_object_keys += [
+                key
+                for key in list_s3_keys(bucket_name, prefix, s3_client=s3_client)
+                if key not in s3_object_keys
+            ]
+
+        def make_orchestrator(s3_object_key):
+            # all of the files share a timestamp (and any error_report_file_name
+            # passed in), so keep their reports apart
+            report_name = s3_object_key.replace("/", "_")
+            kwargs = {
+                "sf_client": sf_client,
+                "execution_object_name": execution_object_name,
+                "s3_client": s3_client,
+                **orchestrator_kwargs,
+            }
+            if kwargs.get("error_report_file_name"):
+                base_name = Path(kwargs["error_report_file_name"])
+                kwargs["error_report_file_name"] = (
+                    f"{base_name.stem}-{report_name}{base_name.suffix}"
+                )
+            else:
+                kwargs["error_report_file_name"] = (
+                    f"error-report-{report_name}-{get_iso()}.csv"
+                )
+            return orchestrator_class(s3_object_key, bucket_name, **kwargs)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            orchestrators = pool.map(make_orchestrator, s3_object_keys)
+            self.orchestrators: Dict[str, Orchestrator] = dict(
+                zip(s3_object_keys, orchestrators)
+            )
+
+    @property
+    def error_count(self) -> int:
+        return sum(
+            orchestrator.error_count for orchestrator in self.orchestrators.values()
+        )
+
+    def iter_rows(self) -> Iterator[Tuple[str, dict]]:
+        """
+        Yields (s3_object_key, row) for every row of every file, file by file
+        """
+        for s3_object_key, orchestrator in self.orchestrators.items():
+            for row in orchestrator.iter_rows():
+                yield s3_object_key, row
+
+    def log_batch(
+        self,
+        results: Iterable[dict],
+        data: Iterable[dict],
+        salesforce_object: str,
+        upsert_key: str,
+        sources: Iterable[str],
+    ):
+        """
+        Like Orchestrator.log_batch, where sources is the s3_object_key each
+        record in data came from
+        """
+        results, data, sources = list(results), list(data), list(sources)
+        assert (
+            len(results) == len(data) == len(sources)
+        ), f"Results ({len(results)}), upload data ({len(data)}) and sources ({len(sources)}) have different lengths!"
+        by_source = {}
+        for result, record, source in zip(results, data, sources):
+            source_results, source_data = by_source.setdefault(source, ([], []))
+            source_results.append(result)
+            source_data.append(record)
+        for source, (source_results, source_data) in by_source.items():
+            self.orchestrators[source].log_batch(
+                source_results, source_data, salesforce_object, upsert_key
+            )
+
+    def bulk_upsert(
+        self,
+        salesforce_object: str,
+        data: Iterable[Tuple[str, dict]],
+        upsert_key: str,
+        **kwargs,
+    ) -> int:
+        """
+        Upserts (s3_object_key, record) pairs from any number of files as one
+        job, logging every batch's results against the files they came from
+
+        kwargs are passed along to SFBulkType.pipeline. Returns the number of
+        records pushed
+        """
+        assert self.sf_client, f"sf_client isn't set"
+        sources = deque()
+
+        def records():
+            for source, record in data:
+                sources.append(source)
+                yield record
+
+        bulk_type = getattr(self.sf_client.bulk, salesforce_object)
+        pushed = 0
+        # batches come back in the order they were read, so the sources of a
+        # batch are always at the front of the queue
+        for batch, results in bulk_type.pipeline_upsert(
+            records(), upsert_key, **kwargs
+        ):
+            batch_sources = [sources.popleft() for _ in batch]
+            self.log_batch(results, batch, salesforce_object, upsert_key, batch_sources)
+            pushed += len(batch)
+        return pushed
+
+    def automagically_finish_up(self):
+        for orchestrator in self.orchestrators.values():
+            orchestrator.error_report_writer.close()
+        self.report()
+        for orchestrator in self.orchestrators.values():
+            orchestrator.wrap_up()
+
+    def report(self):
+        self.archive_files()
+        self.upload_error_reports()
+        self.create_execution_objects()
+
+    def archive_files(self):
+        move_files(
+            {
+                s3_object_key: orchestrator.archive_file_s3_key
+                for s3_object_key, orchestrator in self.orchestrators.items()
+            },
+            self.bucket_name,
+            max_workers=self.max_workers,
+            s3_client=self.s3_client,
+        )
+
+    def upload_error_reports(self):
+        """
+        Uploads every file's error report, and error summary if it has one
+        """
+        uploads = []
+        for orchestrator in self.orchestrators.values():
+            uploads.append(orchestrator.upload_error_report)
+            if orchestrator.error_aggregator:
+                uploads.append(orchestrator.upload_error_summary)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(upload) for upload in uploads]
+        for future in futures:
+            future.result()
+
+    def create_execution_objects(self) -> List[dict]:
+        """
+        Creates every file's execution object through the composite sobjects
+        resource, so it takes one API call per composite_batch_size files
+
+        Raises a SalesforceGeneralError listing the files whose execution
+        objects weren't created, once every batch has been sent
+        """
+        assert self.sf_client, f"sf_client isn't set"
+        assert self.execution_object_name, f"execution_object_name isn't set"
+        records = (
+            {
+                "attributes": {"type": self.execution_object_name},
+                **orchestrator.execution_sfdc_hash,
+            }
+            for orchestrator in self.orchestrators.values()
+        )
+        responses = []
+        for chunk in batch_collection(records, self.composite_batch_size):
+            responses += self.sf_client.restful(
+                "composite/sobjects",
+                method="POST",
+                json={"allOrNone": False, "records": chunk},
+            )
+        failures = {
+            s3_object_key: response.get("errors")
+            for s3_object_key, response in zip(self.orchestrators, responses)
+            if not response.get("success")
+        }
+        if failures:
+            raise SalesforceGeneralError(
+                "composite/sobjects", 400, self.execution_object_name, failures
+            )
+        return responses
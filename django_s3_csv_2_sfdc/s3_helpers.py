@@ -1,11 +1,43 @@
-import boto3
+import datetime
+import io
+import json
 import os
+import threading
+import time
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Union
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
 from urllib.parse import unquote_plus
 
-from django_s3_csv_2_sfdc.utils import get_temp, get_iso
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
+
+from django_s3_csv_2_sfdc.aws_helpers import get_client
+from django_s3_csv_2_sfdc.utils import batch_collection, get_temp, get_iso
+
+# 8MB, which is also boto3's default multipart threshold
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_WORKERS = 10
+# the most keys delete_objects takes at once
+MAX_DELETE_KEYS = 1000
+
+# called with (bytes transferred so far, total bytes, seconds elapsed)
+ProgressCallback = Callable[[int, int, float], None]
+
+
+def get_transfer_config(
+    part_size: int = DEFAULT_CHUNK_SIZE, max_workers: int = DEFAULT_MAX_WORKERS
+) -> TransferConfig:
+    """
+    Builds a boto3 TransferConfig using the same knobs as download_file,
+    for use with upload_file and move_file
+    """
+    return TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=max_workers,
+    )
 
 
 def upload_file(
@@ -13,6 +45,8 @@ def upload_file(
     bucket: str,
     s3_key: Union[Path, str] = None,
     public_read: bool = False,
+    transfer_config: TransferConfig = None,
+    s3_client=None,
 ) -> str:
     """Upload a file to an S3 bucket
 
@@ -20,6 +54,8 @@ def upload_file(
     :param bucket: S3 Bucket to upload to
     :param s3_key: S3 object name. If not specified then local_path is used
     :param public_read: permissions
+    :param transfer_config: multipart tuning, see get_transfer_config
+    :param s3_client: client to use instead of the shared one
     """
 
     # If S3 s3_key was not specified, use local_path
@@ -33,37 +69,252 @@ def upload_file(
     local_path = str(local_path)
     s3_key = str(s3_key)
 
-    s3_client = boto3.client("s3")
+    s3_client = s3_client if s3_client else get_client("s3")
     if public_read:
         s3_client.upload_file(
-            local_path, bucket, s3_key, ExtraArgs={"ACL": "public-read"}
+            local_path,
+            bucket,
+            s3_key,
+            ExtraArgs={"ACL": "public-read"},
+            Config=transfer_config,
         )
     else:
-        s3_client.upload_file(local_path, bucket, s3_key)
+        s3_client.upload_file(local_path, bucket, s3_key, Config=transfer_config)
 
     return s3_key
 
 
+def upload_bytes(data: bytes, bucket: str, s3_key: str, s3_client=None) -> str:
+    """
+    Uploads data that's already in memory, e.g., part of a file
+    """
+    s3_client = s3_client if s3_client else get_client("s3")
+    s3_client.put_object(Bucket=bucket, Key=s3_key, Body=data)
+    return s3_key
+
+
+def download_bytes(s3_key: str, bucket: str, s3_client=None) -> bytes:
+    """
+    Reads a (small) S3 object into memory
+    """
+    s3_client = s3_client if s3_client else get_client("s3")
+    return s3_client.get_object(Bucket=bucket, Key=s3_key)["Body"].read()
+
+
 def move_file(
-    old_key: str, new_key: str, bucket: str, new_bucket: str = None, delete: bool = True
+    old_key: str,
+    new_key: str,
+    bucket: str,
+    new_bucket: str = None,
+    delete: bool = True,
+    transfer_config: TransferConfig = None,
+    s3_client=None,
 ):
     """
     Move a file within an S3 bucket by copying to a different path and deleting the original
     """
-    s3_client = boto3.client("s3")
+    s3_client = s3_client if s3_client else get_client("s3")
     copy_source = {"Bucket": bucket, "Key": old_key}
     destination_bucket = new_bucket if new_bucket else bucket
-    s3_client.copy(copy_source, destination_bucket, new_key)
+    s3_client.copy(copy_source, destination_bucket, new_key, Config=transfer_config)
     if delete:
-        delete_file(old_key, bucket)
+        delete_file(old_key, bucket, s3_client=s3_client)
 
 
-def delete_file(s3_key: str, bucket: str):
-    s3_client = boto3.client("s3")
+def delete_file(s3_key: str, bucket: str, s3_client=None):
+    s3_client = s3_client if s3_client else get_client("s3")
     s3_client.delete_object(Bucket=bucket, Key=s3_key)
 
 
-def download_file(s3_object_key: str, bucket_name: str) -> Path:
+def list_s3_keys(
+    bucket: str,
+    prefix: str = "",
+    suffix: str = None,
+    min_size: int = None,
+    max_size: int = None,
+    modified_after: datetime.datetime = None,
+    modified_before: datetime.datetime = None,
+    s3_client=None,
+) -> Iterator[str]:
+    """
+    Yields the key of every object under prefix, a page at a time
+
+    Objects can be filtered by their key's suffix (e.g., ".csv"), their size
+    in bytes (inclusive), and when they were last modified (modified_after is
+    exclusive, modified_before inclusive). Datetimes must be timezone aware
+    """
+    s3_client = s3_client if s3_client else get_client("s3")
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for s3_object in page.get("Contents", []):
+            if suffix and not s3_object["Key"].endswith(suffix):
+                continue
+            if min_size is not None and s3_object["Size"] < min_size:
+                continue
+            if max_size is not None and s3_object["Size"] > max_size:
+                continue
+            if modified_after and s3_object["LastModified"] <= modified_after:
+                continue
+            if modified_before and s3_object["LastModified"] > modified_before:
+                continue
+            yield s3_object["Key"]
+
+
+def drain_s3_prefix(
+    bucket: str,
+    callback: Callable[[str, str], object],
+    prefix: str = "",
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    checkpoint_path: Union[Path, str] = None,
+    s3_client=None,
+    **filters,
+) -> dict:
+    """
+    Calls back for every object under prefix, like respond_to_s3_event, e.g.,
+    to replay a backlog after an outage:
+
+        def process_s3_event(s3_object_key, bucket_name):
+            orchestrator = Orchestrator(s3_object_key, bucket_name)
+            ...
+
+        drain_s3_prefix(settings.S3_BUCKET, process_s3_event, prefix="incoming/")
+
+    Keys are listed lazily and handed to up to max_workers threads, so only a
+    couple of pages of keys are in memory at once. filters are passed along
+    to list_s3_keys
+
+    With a checkpoint_path, every key that's processed successfully is
+    appended to that file, and keys already in it are skipped. So if the
+    drain is interrupted, running it again picks up where it left off.
+    Failed keys aren't recorded, so they're retried
+
+    Returns {"processed": int, "skipped": int, "failed": [{"s3_object_key": ..., "exception": ...}]}
+    """
+    completed = set()
+    checkpoint = None
+    if checkpoint_path:
+        checkpoint_path = Path(checkpoint_path)
+        if checkpoint_path.is_file():
+            with open(checkpoint_path) as file:
+                completed = set(line.rstrip("\n") for line in file)
+        checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        checkpoint = open(checkpoint_path, "a")
+
+    summary = {"processed": 0, "skipped": 0, "failed": []}
+    lock = threading.Lock()
+
+    def process(s3_object_key):
+        try:
+            callback(s3_object_key, bucket)
+        except Exception as exception:
+            with lock:
+                summary["failed"].append(
+                    {"s3_object_key": s3_object_key, "exception": exception}
+                )
+            return
+        with lock:
+            summary["processed"] += 1
+            if checkpoint:
+                checkpoint.write(s3_object_key + "\n")
+                checkpoint.flush()
+
+    keys = list_s3_keys(bucket, prefix, s3_client=s3_client, **filters)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = set()
+            for s3_object_key in keys:
+                if s3_object_key in completed:
+                    summary["skipped"] += 1
+                    continue
+                pending.add(pool.submit(process, s3_object_key))
+                # don't queue up the whole listing
+                if len(pending) >= max_workers * 2:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+    finally:
+        if checkpoint:
+            checkpoint.close()
+
+    return summary
+
+
+def delete_files(s3_keys: Iterable[str], bucket: str, s3_client=None) -> List[dict]:
+    """
+    Deletes many objects, up to MAX_DELETE_KEYS per request
+
+    Returns the errors S3 reported for any keys it couldn't delete, e.g.,
+    [{"Key": ..., "Code": ..., "Message": ...}]
+    """
+    s3_client = s3_client if s3_client else get_client("s3")
+    errors = []
+    for chunk in batch_collection(s3_keys, MAX_DELETE_KEYS):
+        response = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+        )
+        errors += response.get("Errors", [])
+    return errors
+
+
+def move_files(
+    moves: Union[Dict[str, str], Iterable[Tuple[str, str]]],
+    bucket: str,
+    new_bucket: str = None,
+    delete: bool = True,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    transfer_config: TransferConfig = None,
+    s3_client=None,
+) -> List[str]:
+    """
+    Moves many files at once. moves maps old keys to new keys
+
+    The copies happen server-side, up to max_workers at a time, and the
+    originals are then deleted in batches. If any copy fails, only the files
+    that were copied get deleted, and then the first failure is raised
+
+    Returns the new keys
+    """
+    s3_client = s3_client if s3_client else get_client("s3")
+    moves = list(moves.items() if isinstance(moves, dict) else moves)
+    destination_bucket = new_bucket if new_bucket else bucket
+
+    def copy(move):
+        old_key, new_key = move
+        s3_client.copy(
+            {"Bucket": bucket, "Key": old_key},
+            destination_bucket,
+            new_key,
+            Config=transfer_config,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(copy, move) for move in moves]
+    exceptions = [future.exception() for future in futures]
+
+    if delete:
+        copied = [
+            old_key
+            for (old_key, _), exception in zip(moves, exceptions)
+            if exception is None
+        ]
+        errors = delete_files(copied, bucket, s3_client=s3_client)
+        assert not errors, f"Couldn't delete some of the moved files: {errors}"
+
+    for exception in exceptions:
+        if exception is not None:
+            raise exception
+
+    return [new_key for _, new_key in moves]
+
+
+def download_file(
+    s3_object_key: str,
+    bucket_name: str,
+    part_size: int = DEFAULT_CHUNK_SIZE,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    retries: int = 3,
+    callback: ProgressCallback = None,
+    s3_client=None,
+) -> Path:
     """
     Downloads a file from s3, dropping it in the temp directory
     following the pathing convention from the s3_object_key
@@ -73,20 +324,182 @@ def download_file(s3_object_key: str, bucket_name: str) -> Path:
 
         %TEMP%/archive/a_file.txt
 
-    TEMP must be defined in your django settings
+    The object is fetched as parallel ranged GETs of part_size bytes, using
+    up to max_workers threads. Each part is retried up to `retries` times.
+    Pass a callback to track progress/throughput; it's called after every
+    part with (bytes transferred so far, total bytes, seconds elapsed)
+
+    TEMP must be set, see conf.get_setting
     """
     tmp = get_temp()
 
-    s3_client = boto3.client("s3")
+    s3_client = s3_client if s3_client else get_client("s3")
     download_folder = tmp / os.path.dirname(s3_object_key)
     download_path = tmp / s3_object_key
     # spawn the nested folders without the os complaining
     Path(download_folder).mkdir(parents=True, exist_ok=True)
-    s3_client.download_file(bucket_name, s3_object_key, str(download_path))
+
+    size = s3_client.head_object(Bucket=bucket_name, Key=s3_object_key)["ContentLength"]
+    ranges = [
+        (start, min(start + part_size, size) - 1) for start in range(0, size, part_size)
+    ]
+
+    lock = threading.Lock()
+    started = time.monotonic()
+    transferred = 0
+
+    with open(download_path, "wb") as file:
+        file.truncate(size)
+
+        def download_part(byte_range):
+            nonlocal transferred
+            start, end = byte_range
+            chunk = get_object_range(
+                s3_object_key,
+                bucket_name,
+                start,
+                end,
+                retries=retries,
+                s3_client=s3_client,
+            )
+            with lock:
+                file.seek(start)
+                file.write(chunk)
+                transferred += len(chunk)
+                if callback:
+                    callback(transferred, size, time.monotonic() - started)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # list() so that any part's exception is raised here
+            list(pool.map(download_part, ranges))
 
     return download_path
 
 
+class S3RangeReader(io.RawIOBase):
+    """
+    A read-only, file-like view of an S3 object that pulls the object
+    down in ranged GETs as it's read, rather than all at once
+
+    Wrap it in io.BufferedReader with buffer_size=chunk_size so that every
+    request fetches a full chunk. It's seekable, so reading can pick up
+    anywhere in the object
+    """
+
+    def __init__(
+        self,
+        s3_object_key: str,
+        bucket_name: str,
+        retries: int = 3,
+        s3_client=None,
+    ) -> None:
+        self.s3_object_key = s3_object_key
+        self.bucket_name = bucket_name
+        self.retries = retries
+        self.s3_client = s3_client if s3_client else get_client("s3")
+        head = self.s3_client.head_object(Bucket=bucket_name, Key=s3_object_key)
+        self.size: int = head["ContentLength"]
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.size:
+            return 0
+        end = min(self.position + len(buffer), self.size) - 1
+        chunk = get_object_range(
+            self.s3_object_key,
+            self.bucket_name,
+            self.position,
+            end,
+            retries=self.retries,
+            s3_client=self.s3_client,
+        )
+        buffer[: len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+
+def get_object_range(
+    s3_object_key: str,
+    bucket_name: str,
+    start: int,
+    end: int,
+    retries: int = 3,
+    s3_client=None,
+) -> bytes:
+    """
+    Fetches bytes start through end (inclusive) of an S3 object,
+    retrying the range up to `retries` times before giving up
+    """
+    s3_client = s3_client if s3_client else get_client("s3")
+    attempt = 0
+    while True:
+        try:
+            response = s3_client.get_object(
+                Bucket=bucket_name, Key=s3_object_key, Range=f"bytes={start}-{end}"
+            )
+            return response["Body"].read()
+        except (BotoCoreError, ClientError):
+            attempt += 1
+            if attempt > retries:
+                raise
+
+
+def open_s3_stream(
+    s3_object_key: str,
+    bucket_name: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    encoding: str = "utf-8",
+    s3_client=None,
+) -> io.TextIOWrapper:
+    """
+    Opens an S3 object as a text stream without writing it to disk
+
+    Only chunk_size bytes are held in memory at a time, so this is safe
+    to use on files larger than the temp directory, e.g., on Lambda.
+    The stream is opened with newline="" so it can be handed straight to
+    the csv module
+
+        with open_s3_stream("some/file.csv", "a-bucket") as stream:
+            for row in csv.DictReader(stream):
+                ...
+    """
+    buffered = open_s3_binary_stream(
+        s3_object_key, bucket_name, chunk_size=chunk_size, s3_client=s3_client
+    )
+    return io.TextIOWrapper(buffered, encoding=encoding, newline="")
+
+
+def open_s3_binary_stream(
+    s3_object_key: str,
+    bucket_name: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    s3_client=None,
+) -> io.BufferedReader:
+    """
+    Like open_s3_stream, but for bytes. Seeking only fetches from where it
+    lands, e.g., to skip the part of a file that's already been processed
+    """
+    raw = S3RangeReader(s3_object_key, bucket_name, s3_client=s3_client)
+    return io.BufferedReader(raw, buffer_size=chunk_size)
+
+
 def timestamp_s3_key(
     s3_key: str, keep_folder: bool = False, timestamp: str = None
 ) -> str:
@@ -108,6 +521,33 @@ def timestamp_s3_key(
     return timestamped_s3_key
 
 
+def iter_s3_event_records(event) -> Iterator[Tuple[str, str, str]]:
+    """
+    Yields (s3_object_key, bucket_name, item_identifier) for every object in
+    an S3 event, or in an SQS event whose messages are S3 events
+
+    item_identifier is the SQS messageId, for reporting partial batch
+    failures, or the object's key for plain S3 events
+    """
+    for record in event["Records"]:
+        if "s3" in record:
+            s3_records = [record]
+            item_identifier = None
+        else:
+            # S3 -> SQS: the S3 event is the message's body. S3's test
+            # events don't have any records
+            s3_records = json.loads(record["body"]).get("Records", [])
+            item_identifier = record["messageId"]
+
+        for s3_record in s3_records:
+            s3_data = s3_record["s3"]
+            bucket = s3_data["bucket"]
+            bucket_name = unquote_plus(bucket["name"])
+            s3_object = s3_data["object"]
+            s3_object_key = unquote_plus(s3_object["key"])
+            yield s3_object_key, bucket_name, item_identifier or s3_object_key
+
+
 def respond_to_s3_event(event, callback, *args, **kwargs):
     """
     Use like this:
@@ -117,16 +557,70 @@ def respond_to_s3_event(event, callback, *args, **kwargs):
         def handler(event, context):
             respond_to_s3_event(event, process_s3_event)
     """
-    records = event["Records"]
-    for record in records:
-        s3_data = record["s3"]
-        bucket = s3_data["bucket"]
-        bucket_name = unquote_plus(bucket["name"])
-        s3_object = s3_data["object"]
-        s3_object_key = unquote_plus(s3_object["key"])
+    for s3_object_key, bucket_name, _ in iter_s3_event_records(event):
         callback(s3_object_key, bucket_name, *args, **kwargs)
 
 
+def respond_to_s3_event_concurrently(
+    event, callback, *args, max_workers: int = DEFAULT_MAX_WORKERS, **kwargs
+) -> List[dict]:
+    """
+    Like respond_to_s3_event, but calls back for up to max_workers records
+    at once, on a thread pool
+
+    A record raising doesn't stop the others. Instead, you get back a summary
+    with an entry per record, in the order they appear in the event:
+
+        {
+            "s3_object_key": ...,
+            "bucket_name": ...,
+            "item_identifier": ...,  # see iter_s3_event_records
+            "result": ...,  # whatever callback returned
+            "exception": ...,  # or None
+        }
+
+    When triggered through SQS, pass the summary to get_batch_item_failures
+    so that only the failed messages are retried:
+
+        def handler(event, context):
+            summary = respond_to_s3_event_concurrently(event, process_s3_event)
+            return get_batch_item_failures(summary)
+    """
+    records = list(iter_s3_event_records(event))
+
+    def process(record):
+        s3_object_key, bucket_name, item_identifier = record
+        summary = {
+            "s3_object_key": s3_object_key,
+            "bucket_name": bucket_name,
+            "item_identifier": item_identifier,
+            "result": None,
+            "exception": None,
+        }
+        try:
+            summary["result"] = callback(s3_object_key, bucket_name, *args, **kwargs)
+        except Exception as exception:
+            summary["exception"] = exception
+        return summary
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(process, records))
+
+
+def get_batch_item_failures(summary: List[dict]) -> dict:
+    """
+    Turns the summary from respond_to_s3_event_concurrently into an SQS
+    partial batch response. Needs ReportBatchItemFailures enabled on the
+    event source mapping
+    """
+    failures = []
+    for record in summary:
+        failure = {"itemIdentifier": record["item_identifier"]}
+        if record["exception"] is not None and failure not in failures:
+            failures.append(failure)
+    return {"batchItemFailures": failures}
+
+
 def get_filename_from_s3_key(s3_key: str):
     return os.path.basename(s3_key)
 
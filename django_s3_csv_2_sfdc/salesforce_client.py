@@ -1,67 +1,1143 @@
-from django.conf import settings
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+import zlib
 
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 from simple_salesforce import Salesforce
 from simple_salesforce.bulk import (
     SFBulkHandler as BaseSFBulkHandler,
     SFBulkType as BaseSFBulkType,
 )
-from simple_salesforce.exceptions import SalesforceMalformedRequest
+from simple_salesforce.exceptions import (
+    SalesforceGeneralError,
+    SalesforceMalformedRequest,
+)
+from simple_salesforce.util import call_salesforce
+
+from django_s3_csv_2_sfdc.conf import get_setting
+from django_s3_csv_2_sfdc.instrumentation import Instrumentation
+from django_s3_csv_2_sfdc.utils import batch_collection
+
+BATCH_DONE_STATES = ("Completed", "Failed", "NotProcessed")
+
+# Bulk API 1.0 limits per batch. Payloads are ascii-escaped JSON, so
+# characters and bytes are the same thing
+MAX_BATCH_RECORDS = 10000
+MAX_BATCH_BYTES = 10_000_000
+
+BULK2_DONE_STATES = ("JobComplete", "Failed", "Aborted")
+# Salesforce allows 150MB per upload once base64 encoded, i.e., ~100MB of CSV
+BULK2_MAX_UPLOAD_BYTES = 100_000_000
+BULK2_CHUNK_CHARS = 1_000_000
+
+# SfClient's connection pool. Bulk pipelines keep max_in_flight connections
+# busy, so this leaves room for several at once
+HTTP_POOL_SIZE = 50
+
+# The largest payload (in bytes) each object has been able to take, learned
+# from "Exceeded max size limit" errors and shared by every SFBulkType
+_learned_batch_bytes: Dict[str, int] = {}
+_learned_batch_bytes_lock = threading.Lock()
+
+
+def get_max_batch_bytes(object_name: str) -> int:
+    return _learned_batch_bytes.get(object_name, MAX_BATCH_BYTES)
+
+
+def learn_max_batch_bytes(object_name: str, failed_bytes: int) -> int:
+    """
+    Records that a payload of failed_bytes was too large for object_name,
+    and returns the new limit for it
+    """
+    with _learned_batch_bytes_lock:
+        # the failed batch gets split in half, so that's what we try next
+        limit = min(get_max_batch_bytes(object_name), failed_bytes // 2)
+        _learned_batch_bytes[object_name] = limit
+    return limit
+
+
+def measure_record(record: dict) -> int:
+    """
+    The number of bytes a record adds to a batch payload, including the
+    ", " separator simple salesforce puts between records
+    """
+    return len(json.dumps(record, allow_nan=False, default=str)) + 2
+
+
+def pack_batches(
+    data: Iterable[dict],
+    max_records: int = MAX_BATCH_RECORDS,
+    max_bytes: int = MAX_BATCH_BYTES,
+) -> Iterator[List[dict]]:
+    """
+    Groups records into batches that stay under both max_records and
+    max_bytes of serialized payload. Reads data lazily
+    """
+    batch = []
+    # the enclosing []
+    batch_bytes = 2
+    for record in data:
+        record_bytes = measure_record(record)
+        if batch and (
+            len(batch) >= max_records or batch_bytes + record_bytes > max_bytes
+        ):
+            yield batch
+            batch = []
+            batch_bytes = 2
+        batch.append(record)
+        batch_bytes += record_bytes
+    if batch:
+        yield batch
 
 
 class SFBulkType(BaseSFBulkType):
+    # counts API calls and batch splits, see SfClient
+    instrumentation: Instrumentation = Instrumentation()
+    # gzip batches on the way up; JSON shrinks to a fraction of its size.
+    # Results are gzipped on the way down anyway, requests asks for it
+    gzip_requests: bool = True
+    gzip_level: int = 6
+    # holds batches back when the org's API budget runs low, see SfClient
+    governor: "ApiLimitGovernor" = None
+
+    def pipeline(
+        self,
+        operation: str,
+        data: Iterable[dict],
+        external_id_field: str = None,
+        batch_size: int = 10000,
+        max_in_flight: int = 5,
+        use_serial: bool = False,
+        wait: float = 1,
+        max_wait: float = 30,
+        raise_on_failed_batch: bool = True,
+    ) -> Iterator[Tuple[List[dict], List[dict]]]:
+        """
+        Runs a bulk operation as a single job, submitting batches concurrently
+
+        Up to max_in_flight batches are submitted and polled at once. Polling
+        starts at `wait` seconds and doubles up to `max_wait`. data can be any
+        iterable (e.g., a generator over a streamed file); it's only read as
+        fast as batches are submitted
+
+        Batches hold at most batch_size records and are packed to stay under
+        the payload size this object is known to accept. If Salesforce still
+        rejects a batch as too large, only that batch is split and resent
+
+        Yields (batch_data, batch_results) for each batch, in input order, as
+        soon as that batch and every batch before it are done, so you can hand
+        them straight to Orchestrator.log_batch
+
+        A batch that Salesforce fails (or doesn't process) raises a
+        SalesforceGeneralError, unless raise_on_failed_batch is False, in which
+        case whatever results it has are yielded, like simple salesforce does
+
+        With a governor, each batch waits for API budget first, and fewer are
+        kept in flight when it's running low
+        """
+        job = self._create_job(
+            operation=operation,
+            use_serial=use_serial,
+            external_id_field=external_id_field,
+        )
+        self.instrumentation.incr("salesforce_api_calls")
+        in_flight = deque()
+        batches = pack_batches(
+            data,
+            max_records=min(batch_size, MAX_BATCH_RECORDS),
+            max_bytes=get_max_batch_bytes(self.object_name),
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+                try:
+                    for batch in batches:
+                        limit = max_in_flight
+                        if self.governor:
+                            self.governor.wait_for_budget()
+                            limit = self.governor.allowed_in_flight(max_in_flight)
+                        while len(in_flight) >= limit:
+                            batch_done, future = in_flight.popleft()
+                            yield batch_done, future.result()
+                        future = pool.submit(
+                            self._run_batch,
+                            job["id"],
+                            batch,
+                            operation,
+                            wait,
+                            max_wait,
+                            raise_on_failed_batch,
+                        )
+                        in_flight.append((batch, future))
+                    while in_flight:
+                        batch, future = in_flight.popleft()
+                        yield batch, future.result()
+                finally:
+                    # don't submit whatever's queued if we bailed early
+                    for _, future in in_flight:
+                        future.cancel()
+        finally:
+            self._close_job(job_id=job["id"])
+            self.instrumentation.incr("salesforce_api_calls")
+
+    def pipeline_upsert(
+        self, data: Iterable[dict], external_id_field: str, **kwargs
+    ) -> Iterator[Tuple[List[dict], List[dict]]]:
+        return self.pipeline(
+            "upsert", data, external_id_field=external_id_field, **kwargs
+        )
+
+    def _run_batch(
+        self,
+        job_id: str,
+        batch: List[dict],
+        operation: str,
+        wait: float,
+        max_wait: float,
+        raise_on_failed_batch: bool = True,
+    ) -> List[dict]:
+        """
+        Submits one batch, waits for it with exponential back-off, and returns its results
+        """
+        if self.governor:
+            self.governor.batch_started()
+        try:
+            with self.instrumentation.timer("salesforce_bulk_batch"):
+                return self._submit_and_wait(
+                    job_id, batch, operation, wait, max_wait, raise_on_failed_batch
+                )
+        finally:
+            if self.governor:
+                self.governor.batch_finished()
+
+    def _submit_and_wait(
+        self,
+        job_id: str,
+        batch: List[dict],
+        operation: str,
+        wait: float,
+        max_wait: float,
+        raise_on_failed_batch: bool = True,
+    ) -> List[dict]:
+        self.instrumentation.incr("salesforce_api_calls")
+        try:
+            batch_info = self._add_batch(job_id=job_id, data=batch, operation=operation)
+        except SalesforceMalformedRequest as exception:
+            if "Exceeded max size limit" not in str(exception):
+                raise
+            assert len(batch) > 1, "A single record exceeds the max size limit!"
+            batch_bytes = 2 + sum(measure_record(record) for record in batch)
+            limit = learn_max_batch_bytes(self.object_name, batch_bytes)
+            print(
+                f"Payload too large. Splitting the batch in two. {batch_bytes} bytes -> {limit} bytes max for {self.object_name}"
+            )
+            self.instrumentation.incr("salesforce_bulk_batch_splits")
+            middle = len(batch) // 2
+            return self._submit_and_wait(
+                job_id, batch[:middle], operation, wait, max_wait, raise_on_failed_batch
+            ) + self._submit_and_wait(
+                job_id, batch[middle:], operation, wait, max_wait, raise_on_failed_batch
+            )
+        while batch_info["state"] not in BATCH_DONE_STATES:
+            time.sleep(wait)
+            wait = min(wait * 2, max_wait)
+            batch_info = self._get_batch(job_id=job_id, batch_id=batch_info["id"])
+            self.instrumentation.incr("salesforce_api_calls")
+
+        if batch_info["state"] != "Completed" and raise_on_failed_batch:
+            raise SalesforceGeneralError(
+                f"{self.bulk_url}job/{job_id}/batch/{batch_info['id']}",
+                400,
+                self.object_name,
+                batch_info.get("stateMessage"),
+            )
+
+        self.instrumentation.incr("salesforce_api_calls")
+        return [
+            result
+            for results in self._get_batch_results(
+                job_id=job_id, batch_id=batch_info["id"], operation=operation
+            )
+            for result in results
+        ]
+
+    def _add_batch(self, job_id: str, data, operation: str):
+        if operation in ("query", "queryAll") or not self.gzip_requests:
+            return super()._add_batch(job_id=job_id, data=data, operation=operation)
+
+        payload = json.dumps(data, allow_nan=False).encode("utf-8")
+        result = call_salesforce(
+            url=f"{self.bulk_url}job/{job_id}/batch",
+            method="POST",
+            session=self.session,
+            headers={**self.headers, "Content-Encoding": "gzip"},
+            data=gzip.compress(payload, compresslevel=self.gzip_level),
+        )
+        return result.json(object_pairs_hook=OrderedDict)
+
     def _bulk_operation(
         self,
-        *args,
+        operation,
+        data,
+        use_serial=False,
+        external_id_field=None,
         batch_size=10000,
+        wait=5,
         **kwargs,
     ):
-        try:
+        """
+        Routes DML operations through pipeline, so they get payload-size aware
+        batching. Queries and the options pipeline doesn't support go to
+        simple salesforce
+
+        Like simple salesforce, failed batches' results are returned rather
+        than raised, see pipeline's raise_on_failed_batch
+
+        This is simple salesforce 1.12's signature. Older versions call it
+        with an object_name, hence the ^1.12 requirement
+        """
+        if operation in ("query", "queryAll") or any(kwargs.values()):
             return super()._bulk_operation(
-                *args,
+                operation,
+                data,
+                use_serial=use_serial,
+                external_id_field=external_id_field,
                 batch_size=batch_size,
+                wait=wait,
                 **kwargs,
             )
-        except SalesforceMalformedRequest as exception:
-            if "Exceeded max size limit" in str(exception):
-                new_batch_size = batch_size - 1000
-                assert new_batch_size > 0, "Batch Size Too Low!"
-                print(
-                    f"Payload too large. Retrying with a lower batch size. {batch_size} -> {new_batch_size}"
-                )
-                return super()._bulk_operation(
-                    *args,
-                    batch_size=new_batch_size,
-                    **kwargs,
-                )
-            raise exception
+        if not data:
+            raise ValueError(f"data should not be empty for {operation}")
+        if batch_size == "auto":
+            batch_size = MAX_BATCH_RECORDS
+
+        return [
+            result
+            for _, results in self.pipeline(
+                operation,
+                data,
+                external_id_field=external_id_field,
+                batch_size=batch_size,
+                use_serial=use_serial,
+                wait=min(1, wait),
+                max_wait=wait,
+                raise_on_failed_batch=False,
+            )
+            for result in results
+        ]
 
 
 class SFBulkHandler(BaseSFBulkHandler):
+    instrumentation: Instrumentation = Instrumentation()
+    governor: "ApiLimitGovernor" = None
+
     def __getattr__(self, name):
         """
         Source code from simple salesforce, but with SFBulkType swapped out
         for a subclassed version with back-off handling due to excessive
         payload size
+
+        Types don't hold any state of their own, so each is made once and
+        kept as an attribute, where __getattr__ won't be called for it again
         """
-        return SFBulkType(
+        if name.startswith("__"):
+            raise AttributeError(name)
+        bulk_type = SFBulkType(
             object_name=name,
             bulk_url=self.bulk_url,
             headers=self.headers,
             session=self.session,
         )
+        bulk_type.instrumentation = self.instrumentation
+        bulk_type.governor = self.governor
+        setattr(self, name, bulk_type)
+        return bulk_type
+
+
+class Bulk2JobResults:
+    """
+    The outcome of a Bulk API 2.0 ingest job
+
+    Each result stream is read lazily from Salesforce as you iterate. They
+    yield (result, record) pairs, where result is shaped like a Bulk API 1.0
+    result so everything built for parse_bulk_upsert_results keeps working
+    """
+
+    def __init__(self, bulk_type: "SFBulk2Type", job: dict) -> None:
+        self.bulk_type = bulk_type
+        self.job = job
+        self.job_id: str = job["id"]
+
+    def successful(self) -> Iterator[Tuple[dict, dict]]:
+        for row in self.bulk_type._get_results(self.job_id, "successfulResults"):
+            result = {
+                "success": True,
+                "created": row.pop("sf__Created") == "true",
+                "id": row.pop("sf__Id"),
+                "errors": [],
+            }
+            yield result, row
+
+    def failed(self) -> Iterator[Tuple[dict, dict]]:
+        for row in self.bulk_type._get_results(self.job_id, "failedResults"):
+            row.pop("sf__Id", None)
+            # e.g., REQUIRED_FIELD_MISSING:Required fields are missing: [Name]:--
+            code, _, message = row.pop("sf__Error").partition(":")
+            result = {
+                "success": False,
+                "created": False,
+                "id": None,
+                "errors": [{"statusCode": code, "message": message}],
+            }
+            yield result, row
+
+    def unprocessed(self) -> Iterator[Tuple[dict, dict]]:
+        for row in self.bulk_type._get_results(self.job_id, "unprocessedrecords"):
+            result = {
+                "success": False,
+                "created": False,
+                "id": None,
+                "errors": [
+                    {
+                        "statusCode": "UNPROCESSED",
+                        "message": "Salesforce didn't process this record",
+                    }
+                ],
+            }
+            yield result, row
+
+    def batches(self, size: int = 10000) -> Iterator[Tuple[List[dict], List[dict]]]:
+        """
+        Yields (results, data) from all three result streams in chunks of size,
+        ready for parse_bulk_upsert_results or Orchestrator.log_batch
+        """
+        pairs = itertools.chain(self.successful(), self.failed(), self.unprocessed())
+        for chunk in batch_collection(pairs, size):
+            results, data = zip(*chunk)
+            yield list(results), list(data)
+
+
+class SFBulk2Type:
+    """
+    Bulk API 2.0 ingest for one object, using CSV payloads
+
+    Bulk API 2.0 takes a single upload per job, so large inputs are spread
+    over several jobs of at most max_upload_bytes each. Each upload is
+    streamed to Salesforce as it's encoded rather than built up in memory
+
+    insert, update and upsert run every job before returning their results;
+    ingest yields each job's results as it completes, and only runs the
+    jobs as it's iterated
+    """
+
+    # gzip uploads as they're streamed; max_upload_bytes still counts the CSV
+    gzip_uploads: bool = True
+    gzip_level: int = 6
+
+    def __init__(
+        self, object_name: str, bulk2_url: str, headers: dict, session
+    ) -> None:
+        self.object_name = object_name
+        self.bulk2_url = bulk2_url
+        self.headers = headers
+        self.session = session
+
+    def insert(
+        self, data: Union[Iterable[dict], str, Path], **kwargs
+    ) -> List[Bulk2JobResults]:
+        return list(self.ingest("insert", data, **kwargs))
+
+    def update(
+        self, data: Union[Iterable[dict], str, Path], **kwargs
+    ) -> List[Bulk2JobResults]:
+        return list(self.ingest("update", data, **kwargs))
+
+    def upsert(
+        self, data: Union[Iterable[dict], str, Path], external_id_field: str, **kwargs
+    ) -> List[Bulk2JobResults]:
+        return list(
+            self.ingest("upsert", data, external_id_field=external_id_field, **kwargs)
+        )
+
+    def ingest(
+        self,
+        operation: str,
+        data: Union[Iterable[dict], str, Path],
+        external_id_field: str = None,
+        max_upload_bytes: int = BULK2_MAX_UPLOAD_BYTES,
+        wait: float = 1,
+        max_wait: float = 30,
+    ) -> Iterator[Bulk2JobResults]:
+        """
+        Runs data through one or more ingest jobs, yielding each job's results
+        as soon as it's complete
+
+        data is either an iterable of records, or a path to a CSV file whose
+        headers are Salesforce field names, e.g., Orchestrator.downloaded_file.
+        Files small enough for a single job are uploaded as they are, with
+        their own line endings
+        """
+        if isinstance(data, (str, Path)) and os.path.getsize(data) <= max_upload_bytes:
+            with open(data, "rb") as file:
+                line_ending = _detect_line_ending(file)
+                yield self._run_job(
+                    operation, external_id_field, file, wait, max_wait, line_ending
+                )
+            return
+
+        if isinstance(data, (str, Path)):
+            with open(data, newline="", encoding="utf-8") as file:
+                yield from self.ingest(
+                    operation,
+                    csv.DictReader(file),
+                    external_id_field=external_id_field,
+                    max_upload_bytes=max_upload_bytes,
+                    wait=wait,
+                    max_wait=max_wait,
+                )
+            return
+
+        records = iter(data)
+        first = next(records, None)
+        if first is None:
+            return
+        fieldnames = list(first.keys())
+        records = itertools.chain([first], records)
+        while True:
+            try:
+                first = next(records)
+            except StopIteration:
+                return
+            records = itertools.chain([first], records)
+            body = _encode_csv_upload(records, fieldnames, max_upload_bytes)
+            yield self._run_job(operation, external_id_field, body, wait, max_wait)
+
+    def _run_job(
+        self, operation, external_id_field, body, wait, max_wait, line_ending="LF"
+    ):
+        payload = {
+            "object": self.object_name,
+            "operation": operation,
+            "contentType": "CSV",
+            "lineEnding": line_ending,
+        }
+        if operation == "upsert":
+            payload["externalIdFieldName"] = external_id_field
+
+        job = call_salesforce(
+            url=self.bulk2_url,
+            method="POST",
+            session=self.session,
+            headers=self.headers,
+            data=json.dumps(payload),
+        ).json()
+        job_url = f"{self.bulk2_url}{job['id']}"
+
+        upload_headers = {**self.headers, "Content-Type": "text/csv"}
+        if self.gzip_uploads:
+            upload_headers["Content-Encoding"] = "gzip"
+            body = _gzip_chunks(body, self.gzip_level)
+        call_salesforce(
+            url=f"{job_url}/batches",
+            method="PUT",
+            session=self.session,
+            headers=upload_headers,
+            data=body,
+        )
+        job = call_salesforce(
+            url=job_url,
+            method="PATCH",
+            session=self.session,
+            headers=self.headers,
+            data=json.dumps({"state": "UploadComplete"}),
+        ).json()
+
+        while job["state"] not in BULK2_DONE_STATES:
+            time.sleep(wait)
+            wait = min(wait * 2, max_wait)
+            job = call_salesforce(
+                url=job_url, method="GET", session=self.session, headers=self.headers
+            ).json()
+
+        if job["state"] != "JobComplete":
+            raise SalesforceGeneralError(
+                job_url, 400, self.object_name, job.get("errorMessage")
+            )
+
+        return Bulk2JobResults(self, job)
+
+    def _get_results(self, job_id: str, result_type: str) -> Iterator[dict]:
+        url = f"{self.bulk2_url}{job_id}/{result_type}/"
+        locator = None
+        while True:
+            response = call_salesforce(
+                url=url,
+                method="GET",
+                session=self.session,
+                headers=self.headers,
+                params={"locator": locator} if locator else None,
+                stream=True,
+            )
+            response.encoding = "utf-8"
+            with response:
+                yield from csv.DictReader(response.iter_lines(decode_unicode=True))
+            # big result sets come back a page at a time
+            locator = response.headers.get("Sforce-Locator")
+            if not locator or locator == "null":
+                return
+
+
+def _encode_csv_upload(
+    records: Iterator[dict], fieldnames: List[str], max_bytes: int
+) -> Iterator[bytes]:
+    """
+    Encodes records as CSV in chunks of about 1MB, stopping before max_bytes
+
+    Only consumes as many records as fit, so the rest can go in the next job
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, lineterminator="\n")
+    writer.writeheader()
+    sent = 0
+    for record in records:
+        # Bulk API 2.0 wants #N/A for nulls, blanks leave the field as is
+        writer.writerow(
+            {key: "#N/A" if value is None else value for key, value in record.items()}
+        )
+        if buffer.tell() >= BULK2_CHUNK_CHARS:
+            chunk = buffer.getvalue().encode("utf-8")
+            sent += len(chunk)
+            yield chunk
+            buffer.seek(0)
+            buffer.truncate()
+            if sent + BULK2_CHUNK_CHARS * 4 > max_bytes:
+                # leave room so that the next chunk can't go over
+                break
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _detect_line_ending(file) -> str:
+    """
+    LF or CRLF, going by the end of the header row, e.g., for files saved by
+    Excel. Leaves the file where it was
+    """
+    position = file.tell()
+    line = file.readline()
+    file.seek(position)
+    return "CRLF" if line.endswith(b"\r\n") else "LF"
+
+
+def _gzip_chunks(body, level: int) -> Iterator[bytes]:
+    """
+    Gzips a file, or an iterable of bytes, a chunk at a time
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    chunks = body
+    if hasattr(body, "read"):
+        chunks = iter(lambda: body.read(BULK2_CHUNK_CHARS), b"")
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class SFBulk2Handler:
+    """
+    Lets you do sf_client.bulk2.Contact.upsert(...), like SFBulkHandler
+    """
+
+    def __init__(self, session_id: str, bulk2_url: str, session) -> None:
+        self.session_id = session_id
+        self.bulk2_url = bulk2_url
+        self.session = session
+        self.headers = {
+            "Authorization": f"Bearer {session_id}",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        bulk_type = SFBulk2Type(
+            object_name=name,
+            bulk2_url=self.bulk2_url,
+            headers=self.headers,
+            session=self.session,
+        )
+        # kept, like SFBulkHandler's
+        setattr(self, name, bulk_type)
+        return bulk_type
+
+
+class SessionCache:
+    """
+    Keeps Salesforce sessions (session id and instance), so that SfClients
+    don't log in every time they're constructed
+
+    Sessions are always kept in memory, for the life of the process. Pass a
+    store to share them between processes too: anything with load, save and
+    delete, like checkpoint_helpers' LocalCheckpointStore (which also locks,
+    so that only one worker at a time logs in) or S3CheckpointStore. Bear in
+    mind that session ids are credentials
+
+    Sessions older than max_age seconds aren't used. Otherwise, a session
+    that's expired is only found out about when Salesforce rejects it, and
+    SfClient logs in again then
+    """
+
+    def __init__(self, store=None, max_age: float = None, folder: str = "sessions"):
+        self.store = store
+        self.max_age = max_age
+        self.folder = folder
+        self.sessions: Dict[str, dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def get_name(self, key: str) -> str:
+        return f"{self.folder}/{key}"
+
+    def is_fresh(self, session: Optional[dict]) -> bool:
+        if not session:
+            return False
+        if self.max_age is None:
+            return True
+        return time.time() - session["created"] < self.max_age
+
+    def get(self, key: str) -> Optional[dict]:
+        session = self.sessions.get(key)
+        if not self.is_fresh(session) and self.store:
+            session = self.store.load(self.get_name(key))
+            if self.is_fresh(session):
+                self.sessions[key] = session
+        return session if self.is_fresh(session) else None
+
+    def set(self, key: str, session_id: str, sf_instance: str):
+        session = {
+            "session_id": session_id,
+            "sf_instance": sf_instance,
+            "created": time.time(),
+        }
+        self.sessions[key] = session
+        if self.store:
+            self.store.save(self.get_name(key), session)
+
+    def clear(self):
+        self.sessions.clear()
+
+    @contextmanager
+    def lock(self, key: str):
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            store_lock = getattr(self.store, "lock", None)
+            if store_lock:
+                with store_lock(self.get_name(key)):
+                    yield
+            else:
+                yield
+
+
+# shared by every SfClient that isn't given its own
+default_session_cache = SessionCache()
+
+
+def is_invalid_session(response: requests.Response) -> bool:
+    if response.status_code == 401:
+        return True
+    if response.status_code != 400:
+        return False
+    # Bulk API 1.0 says so with a 400
+    return "InvalidSessionId" in response.text or "INVALID_SESSION_ID" in response.text
+
+
+def is_limit_exceeded(response: requests.Response) -> bool:
+    if response.status_code not in (400, 403):
+        return False
+    # REST says REQUEST_LIMIT_EXCEEDED, Bulk API 1.0 says ExceededQuota
+    return "REQUEST_LIMIT_EXCEEDED" in response.text or "ExceededQuota" in response.text
+
+
+class ApiLimitExhausted(Exception):
+    """
+    Raised when the org's API budget stays below the governor's reserve for
+    longer than it's willing to pause
+    """
+
+
+class ApiLimitGovernor:
+    """
+    Keeps track of how much of the org's API budget is left, and holds back
+    when it runs low, so that other integrations sharing the org get theirs
+
+    Daily API usage is read off every response's Sforce-Limit-Info header,
+    and the remaining daily Bulk API batches off the /limits resource (at
+    most every refresh_interval seconds, and only when there's a reserve to
+    protect). Bulk pipelines ask the governor before every batch:
+
+    - once less than throttle_below of the budget is left, batches are sent
+      one at a time
+    - once less than reserve is left, submission pauses, pause seconds at a
+      time and for up to max_pause in all, then ApiLimitExhausted is raised
+
+    max_concurrent_batches caps the batches in flight across every pipeline
+    sharing the governor. And whatever the budget, requests that come back
+    with REQUEST_LIMIT_EXCEEDED are retried with exponential back-off, up to
+    max_retries times
+
+    The defaults only back off, and keep count
+    """
+
+    def __init__(
+        self,
+        reserve: float = 0.0,
+        throttle_below: float = None,
+        pause: float = 60,
+        max_pause: float = 0,
+        max_concurrent_batches: int = None,
+        max_retries: int = 5,
+        backoff: float = 1,
+        max_backoff: float = 60,
+        refresh_interval: float = 300,
+    ) -> None:
+        self.reserve = reserve
+        self.throttle_below = throttle_below if throttle_below else reserve * 2
+        self.pause = pause
+        self.max_pause = max_pause
+        self.max_concurrent_batches = max_concurrent_batches
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.refresh_interval = refresh_interval
+        # returns the /limits resource, e.g., SfClient.limits
+        self.get_limits: Callable[[], dict] = None
+
+        self.api_used: int = None
+        self.api_max: int = None
+        self.bulk_batches_remaining: int = None
+        self.bulk_batches_max: int = None
+        self.refreshed: float = None
+        self.in_flight = 0
+        self.pauses = 0
+        self.backoffs = 0
+        self._condition = threading.Condition()
+
+    def observe(self, response: requests.Response):
+        limit_info = response.headers.get("Sforce-Limit-Info")
+        if not limit_info:
+            return
+        usage = Salesforce.parse_api_usage(limit_info).get("api-usage")
+        if usage:
+            with self._condition:
+                self.api_used, self.api_max = usage.used, usage.total
+
+    def update_limits(self, limits: dict):
+        """
+        Takes in what the /limits resource returns
+        """
+        with self._condition:
+            if "DailyApiRequests" in limits:
+                daily = limits["DailyApiRequests"]
+                self.api_max = daily["Max"]
+                self.api_used = daily["Max"] - daily["Remaining"]
+            if "DailyBulkApiBatches" in limits:
+                batches = limits["DailyBulkApiBatches"]
+                self.bulk_batches_max = batches["Max"]
+                self.bulk_batches_remaining = batches["Remaining"]
+            self.refreshed = time.monotonic()
+
+    def refresh(self, force: bool = False):
+        if not self.get_limits:
+            return
+        stale = (
+            self.refreshed is None
+            or time.monotonic() - self.refreshed > self.refresh_interval
+        )
+        if force or stale:
+            self.update_limits(self.get_limits())
+
+    @property
+    def api_remaining(self) -> Optional[int]:
+        if self.api_max is None:
+            return None
+        return self.api_max - self.api_used
+
+    @property
+    def remaining_fraction(self) -> Optional[float]:
+        """
+        The smaller of the daily API calls and Bulk API batches left, as a
+        fraction of the limit. None until it's known
+        """
+        fractions = []
+        if self.api_max:
+            fractions.append(self.api_remaining / self.api_max)
+        if self.bulk_batches_max:
+            fractions.append(self.bulk_batches_remaining / self.bulk_batches_max)
+        return min(fractions) if fractions else None
+
+    def allowed_in_flight(self, max_in_flight: int) -> int:
+        fraction = self.remaining_fraction
+        if fraction is not None and fraction < self.throttle_below:
+            return 1
+        return max_in_flight
+
+    def wait_for_budget(self):
+        """
+        Returns once there's more than the reserve left, pausing if need be
+        """
+        if not self.reserve:
+            return
+        self.refresh()
+        paused = 0
+        while True:
+            fraction = self.remaining_fraction
+            if fraction is None or fraction > self.reserve:
+                return
+            if paused >= self.max_pause:
+                raise ApiLimitExhausted(
+                    f"Only {fraction:.1%} of the API budget is left, "
+                    f"{self.reserve:.1%} is reserved: {self.budget()}"
+                )
+            delay = min(self.pause, self.max_pause - paused)
+            self.pauses += 1
+            print(f"API budget is low ({fraction:.1%} left). Pausing for {delay}s")
+            time.sleep(delay)
+            paused += delay
+            self.refresh(force=True)
+
+    def get_backoff(self, attempt: int) -> Optional[float]:
+        """
+        How long to wait before retrying a request that hit a limit, or None
+        to give up
+        """
+        if attempt >= self.max_retries:
+            return None
+        with self._condition:
+            self.backoffs += 1
+        return min(self.backoff * 2**attempt, self.max_backoff)
+
+    def batch_started(self):
+        with self._condition:
+            while (
+                self.max_concurrent_batches
+                and self.in_flight >= self.max_concurrent_batches
+            ):
+                self._condition.wait()
+            self.in_flight += 1
+            if self.bulk_batches_remaining is not None:
+                self.bulk_batches_remaining -= 1
+
+    def batch_finished(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def budget(self) -> dict:
+        """
+        Where things stand, e.g., for Orchestrator.execution_sfdc_hash
+        """
+        return {
+            "api_used": self.api_used,
+            "api_max": self.api_max,
+            "api_remaining": self.api_remaining,
+            "bulk_batches_remaining": self.bulk_batches_remaining,
+            "bulk_batches_max": self.bulk_batches_max,
+            "remaining_fraction": self.remaining_fraction,
+            "batches_in_flight": self.in_flight,
+            "pauses": self.pauses,
+            "backoffs": self.backoffs,
+        }
+
+
+class ReauthenticatingSession(requests.Session):
+    """
+    A requests Session that, when Salesforce rejects the session id, asks
+    reauthenticate for a new one and retries the request once with it
+
+    The session id is swapped in the headers dict that was passed in, so that
+    whoever owns it (e.g., an SFBulkType) uses the new one from then on.
+
+    With a governor, every response is shown to it, and requests that hit
+    REQUEST_LIMIT_EXCEEDED are retried after its back-off. Requests with a
+    streamed body can't be replayed, so aren't retried
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        # takes the rejected session id, returns the new one
+        self.reauthenticate: Callable[[str], str] = None
+        self.governor: ApiLimitGovernor = None
+
+    def request(self, method, url, *args, headers=None, **kwargs):
+        body = kwargs.get("data")
+        replayable = body is None or isinstance(body, (str, bytes, dict))
+        reauthenticated = False
+        attempt = 0
+        while True:
+            response = super().request(method, url, *args, headers=headers, **kwargs)
+            if self.governor:
+                self.governor.observe(response)
+            if not replayable:
+                return response
+
+            if (
+                self.reauthenticate
+                and headers
+                and not reauthenticated
+                and is_invalid_session(response)
+            ):
+                # the id that was actually sent; by now, headers may already
+                # hold a new one that another thread logged in for
+                rejected = _get_session_id(response.request.headers)
+                if not rejected:
+                    return response
+                session_id = self.reauthenticate(rejected)
+                for name, value in headers.items():
+                    if isinstance(value, str) and rejected in value:
+                        headers[name] = value.replace(rejected, session_id)
+                reauthenticated = True
+                response.close()
+                continue
+
+            if self.governor and is_limit_exceeded(response):
+                delay = self.governor.get_backoff(attempt)
+                if delay is not None:
+                    print(f"Salesforce API limit exceeded. Retrying in {delay}s")
+                    response.close()
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+
+            return response
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter whose connections have TCP keep-alive on, so that idle ones
+    (e.g., while a bulk batch is polled with back-off) aren't silently dropped
+    by NATs and load balancers, and can be reused
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = list(HTTPConnection.default_socket_options)
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30))
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10))
+        kwargs["socket_options"] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _get_session_id(headers: dict) -> Optional[str]:
+    if headers.get("X-SFDC-Session"):
+        return headers["X-SFDC-Session"]
+    authorization = headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[len("Bearer ") :]
+    return None
 
 
 class SfClient(Salesforce):
-    def __init__(self):
+    """
+    simple_salesforce's Salesforce, logged in with the SFDC_* settings
+
+    Sessions are reused from session_cache (by default, one shared by the
+    whole process) rather than logging in every time, and if Salesforce
+    rejects one, a new one is logged into and the request is retried,
+    including Bulk API requests
+
+    Connections are pooled (up to pool_size per host) and kept alive, and the
+    bulk and bulk2 handlers (and their types) are made once per session.
+    connection_stats shows how well connections are being reused
+
+    Every client has an ApiLimitGovernor, which backs off when Salesforce says
+    an API limit's been hit. Pass your own to also hold back when the org's
+    budget runs low (e.g., ApiLimitGovernor(reserve=0.2, max_pause=300))
+    """
+
+    def __init__(
+        self,
+        instrumentation: Instrumentation = None,
+        session_cache: SessionCache = None,
+        pool_size: int = HTTP_POOL_SIZE,
+        governor: ApiLimitGovernor = None,
+    ):
+        # the session handling below overrides simple_salesforce 1.12's login
+        # hooks, which older versions don't have, so it would silently do nothing
+        if not hasattr(Salesforce, "_refresh_session"):
+            raise RuntimeError("SfClient needs simple-salesforce 1.12 or newer")
+        # always set, Salesforce.__getattr__ treats missing attributes as SObjects
+        self.instrumentation = instrumentation if instrumentation else Instrumentation()
+        self.session_cache = session_cache if session_cache else default_session_cache
         config = {
-            "username": settings.SFDC_USERNAME,
-            "password": settings.SFDC_PASSWORD,
-            "security_token": settings.SFDC_SECURITY_TOKEN,
+            "username": get_setting("SFDC_USERNAME"),
+            "password": get_setting("SFDC_PASSWORD"),
+            "security_token": get_setting("SFDC_SECURITY_TOKEN"),
         }
-        if settings.SFDC_DOMAIN.lower() != "na":
-            config["domain"] = settings.SFDC_DOMAIN
+        domain = get_setting("SFDC_DOMAIN")
+        if domain.lower() != "na":
+            config["domain"] = domain
+        self.session_cache_key = f"{config['username']}@{domain.lower()}"
+        self._reauthenticate_lock = threading.Lock()
+        self.governor = governor if governor else ApiLimitGovernor()
 
-        super().__init__(**config)
+        session = ReauthenticatingSession()
+        adapter = KeepAliveAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        self._recorded_connection_stats = {"connections": 0, "requests": 0}
+        session.governor = self.governor
+        super().__init__(**config, session=session)
+        session.reauthenticate = self.reauthenticate
+        self.governor.get_limits = self.limits
+
+    def _refresh_session(self):
+        """
+        Called by simple_salesforce to log in, and when the session expires.
+        Uses the cached session, unless it's the one that's just been rejected
+        """
+        # not getattr, Salesforce.__getattr__ would treat it as an SObject
+        rejected = self.__dict__.get("session_id")
+        with self.session_cache.lock(self.session_cache_key):
+            session = self.session_cache.get(self.session_cache_key)
+            if session and session["session_id"] != rejected:
+                self.session_id = session["session_id"]
+                self.sf_instance = session["sf_instance"]
+            else:
+                self.session_id, self.sf_instance = self._salesforce_login_partial()
+                self.session_cache.set(
+                    self.session_cache_key, self.session_id, self.sf_instance
+                )
+                self.instrumentation.incr("salesforce_logins")
+        self._generate_headers()
+        # the cached handlers were made with the old session id
+        self.__dict__.pop("bulk", None)
+        self.__dict__.pop("bulk2", None)
+
+    def reauthenticate(self, rejected_session_id: str) -> str:
+        """
+        Gets a new session in place of rejected_session_id, unless another
+        thread already has, and returns its id
+        """
+        with self._reauthenticate_lock:
+            if self.session_id == rejected_session_id:
+                self._refresh_session()
+            return self.session_id
 
     def __getattr__(self, name):
         """
@@ -70,7 +1146,53 @@ class SfClient(Salesforce):
         """
         if name == "bulk":
             # Deal with bulk API functions
-            return SFBulkHandler(
+            handler = SFBulkHandler(
                 self.session_id, self.bulk_url, self.proxies, self.session
             )
+            handler.instrumentation = self.instrumentation
+            handler.governor = self.governor
+            # kept until the session changes, see _refresh_session
+            self.bulk = handler
+            return handler
+        if name == "bulk2":
+            handler = SFBulk2Handler(
+                self.session_id, f"{self.base_url}jobs/ingest/", self.session
+            )
+            self.bulk2 = handler
+            return handler
         return super().__getattr__(name)
+
+    def connection_stats(self) -> Dict[str, int]:
+        """
+        How many connections have been opened to Salesforce and how many
+        requests they've carried, across urllib3's pools. The difference
+        is how many requests went over a reused connection
+        """
+        stats = {"connections": 0, "requests": 0}
+        for adapter in self.session.adapters.values():
+            pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+            if pools is None:
+                continue
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    stats["connections"] += pool.num_connections
+                    stats["requests"] += pool.num_requests
+        stats["reused"] = stats["requests"] - stats["connections"]
+        return stats
+
+    def record_connection_stats(self, instrumentation: Instrumentation = None):
+        """
+        Counts the connections and requests since the last call on the
+        instrumentation (by default, the client's own), as
+        salesforce_http_connections/requests
+        """
+        if instrumentation is None:
+            instrumentation = self.instrumentation
+        stats = self.connection_stats()
+        for name in ("connections", "requests"):
+            instrumentation.incr(
+                f"salesforce_http_{name}",
+                stats[name] - self._recorded_connection_stats[name],
+            )
+            self._recorded_connection_stats[name] = stats[name]
@@ -1,11 +1,165 @@
-from typing import Tuple
+import csv
+import itertools
+import json
+import re
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+ERROR_FIELDS = (
+    "salesforce_object",
+    "code",
+    "message",
+    "upsert_key",
+    "upsert_key_value",
+    "object_json",
+)
+
+
+class BulkError:
+    """
+    One error from a bulk upsert, as yielded by iter_bulk_upsert_errors
+
+    Reads like the dicts parse_bulk_upsert_results returns, i.e.,
+    error["message"], but it's a fraction of the size: it only keeps a
+    reference to the pushed record, and upsert_key_value and object_json are
+    looked up from it when they're read, e.g., when the report is written.
+    It's read-only; to_dict gives you a plain (e.g., JSON-serializable) dict
+    """
+
+    __slots__ = ("salesforce_object", "code", "message", "upsert_key", "pushed")
+
+    def __init__(
+        self,
+        salesforce_object: str,
+        code: str,
+        message: str,
+        upsert_key: str,
+        pushed: dict,
+    ) -> None:
+        self.salesforce_object = salesforce_object
+        self.code = code
+        self.message = message
+        self.upsert_key = upsert_key
+        self.pushed = pushed
+
+    @property
+    def upsert_key_value(self):
+        return self.pushed.get(self.upsert_key)
+
+    @property
+    def object_json(self) -> dict:
+        return self.pushed
+
+    def __getitem__(self, key: str):
+        if key not in ERROR_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return self[key] if key in ERROR_FIELDS else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return ERROR_FIELDS
+
+    def to_row(self) -> list:
+        """
+        The error as a row with the default error report headers
+        """
+        pushed = self.pushed
+        return [
+            self.salesforce_object,
+            self.code,
+            self.message,
+            self.upsert_key,
+            pushed.get(self.upsert_key),
+            pushed,
+        ]
+
+    def to_dict(self) -> dict:
+        return dict(zip(ERROR_FIELDS, self.to_row()))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (BulkError, dict)):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"BulkError({self.to_dict()!r})"
+
+
+class BulkUpsertCounts:
+    """
+    Tallies records, successes and errors as iter_bulk_upsert_errors runs,
+    since it doesn't hand back the successes themselves. A record can have
+    more than one error, so errors can add up to more than the records
+
+    Pass collect_ids=True to also keep the Salesforce Ids of the successes
+    """
+
+    def __init__(self, collect_ids: bool = False) -> None:
+        self.records = 0
+        self.successes = 0
+        self.errors = 0
+        self.success_ids: List[str] = [] if collect_ids else None
+
+
+def iter_bulk_upsert_errors(
+    results: Iterable[dict],
+    data: Iterable[dict],
+    salesforce_object: str,
+    upsert_key: str,
+    counts: BulkUpsertCounts = None,
+) -> Iterator[BulkError]:
+    """
+    Lazy version of parse_bulk_upsert_results that only yields the errors,
+    one at a time (as BulkErrors), so neither results nor data need to be lists
+
+    If results and data turn out to be different lengths, an AssertionError is
+    raised once the shorter one runs out (or up front, if both have a len)
+    """
+    if hasattr(results, "__len__") and hasattr(data, "__len__"):
+        assert len(results) == len(
+            data
+        ), f"Results ({len(results)}) and upload data ({len(data)}) have different lengths!"
+
+    missing = object()
+    pairs = itertools.zip_longest(results, data, fillvalue=missing)
+    for idx, (result, pushed) in enumerate(pairs):
+        assert (
+            result is not missing and pushed is not missing
+        ), f"Results and upload data have different lengths! One of them ran out after {idx} rows"
+
+        if counts:
+            counts.records += 1
+        if result.get("success"):
+            if counts:
+                counts.successes += 1
+                if counts.success_ids is not None:
+                    counts.success_ids.append(result.get("id"))
+        for error in result.get("errors"):
+            if counts:
+                counts.errors += 1
+            yield BulkError(
+                salesforce_object,
+                error.get("statusCode"),
+                error.get("message"),
+                upsert_key,
+                pushed,
+            )
 
 
 def parse_bulk_upsert_results(
     results: list, data: list, salesforce_object: str, upsert_key: str
 ) -> Tuple[list, list]:
     """
-    Parses the results of a bulk upsert call, collecting errors and successes
+    Parses the results of a bulk upsert call, collecting errors (as dicts)
+    and successes
+
+    If you only need the errors, iter_bulk_upsert_errors doesn't hold on to
+    every success, or make a dict per error
 
     # TODO: allow a custom serializer for errors
     # TODO: do something more with successes
@@ -14,22 +168,13 @@ def parse_bulk_upsert_results(
         data
     ), f"Results ({len(results)}) and upload data ({len(data)}) have different lengths!"
 
-    successes = list()
-    errors = list()
-    for result, pushed in zip(results, data):
-        if result.get("success"):
-            successes.append(result)
-        for error in result.get("errors"):
-            errors.append(
-                {
-                    "salesforce_object": salesforce_object,
-                    "code": error.get("statusCode"),
-                    "message": error.get("message"),
-                    "upsert_key": upsert_key,
-                    "upsert_key_value": pushed.get(upsert_key),
-                    "object_json": pushed,
-                }
-            )
+    successes = [result for result in results if result.get("success")]
+    errors = [
+        error.to_dict()
+        for error in iter_bulk_upsert_errors(
+            results, data, salesforce_object, upsert_key
+        )
+    ]
     return successes, errors
 
 
@@ -43,3 +188,126 @@ def extract_errors_from_results(results: list) -> list:
         if not success:
             errors += result.get("errors")
     return errors
+
+
+# quoted values, then Salesforce Ids (15 or 18 characters, at least one
+# digit), then any other numbers
+MESSAGE_VARIABLES = (
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "<value>"),
+    (re.compile(r"\b(?=[a-zA-Z]*\d)[a-zA-Z0-9]{15}(?:[a-zA-Z0-9]{3})?\b"), "<id>"),
+    (re.compile(r"\d+(?:\.\d+)?"), "<n>"),
+)
+
+ERROR_SUMMARY_HEADERS = ["salesforce_object", "code", "message", "count", "samples"]
+
+
+def normalize_error_message(message: str) -> str:
+    """
+    Swaps the record-specific parts of an error message for placeholders, so
+    that the same error on different records reads the same
+    """
+    if not message:
+        return ""
+    for pattern, placeholder in MESSAGE_VARIABLES:
+        message = pattern.sub(placeholder, message)
+    return message
+
+
+class ErrorAggregator:
+    """
+    Groups errors by object, code and normalized message as they go by,
+    keeping a count and the first sample_size errors of each group
+
+        aggregator = ErrorAggregator()
+        create_error_report(aggregator.aggregate(errors), report_path)
+        aggregator.write_summary(summary_path)
+
+    When a whole load fails the same way, the summary is a few lines long,
+    however many rows the full report has
+    """
+
+    def __init__(self, sample_size: int = 5) -> None:
+        self.sample_size = sample_size
+        # (salesforce_object, code, message) -> [count, samples]
+        self.groups: Dict[Tuple[str, str, str], list] = {}
+        self._normalized: Dict[str, str] = {}
+
+    def add(self, error):
+        message = error["message"]
+        normalized = self._normalized.get(message)
+        if normalized is None:
+            normalized = normalize_error_message(message)
+            # messages are usually few, but don't let unique ones pile up
+            if len(self._normalized) < 10000:
+                self._normalized[message] = normalized
+
+        key = (error["salesforce_object"], error["code"], normalized)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0, []]
+        group[0] += 1
+        if len(group[1]) < self.sample_size:
+            group[1].append(dict(error))
+
+    def aggregate(self, errors: Iterable) -> Iterator:
+        """
+        Adds every error, passing it along, e.g., to an ErrorReportWriter
+        """
+        for error in errors:
+            self.add(error)
+            yield error
+
+    @property
+    def error_count(self) -> int:
+        return sum(group[0] for group in self.groups.values())
+
+    def summary(self) -> List[dict]:
+        """
+        The groups, biggest first
+        """
+        rows = [
+            {
+                "salesforce_object": salesforce_object,
+                "code": code,
+                "message": message,
+                "count": count,
+                "samples": samples,
+            }
+            for (salesforce_object, code, message), (
+                count,
+                samples,
+            ) in self.groups.items()
+        ]
+        rows.sort(key=lambda row: row["count"], reverse=True)
+        return rows
+
+    def load(self, summary: List[dict]):
+        """
+        Adds a summary (e.g., a previous run's) back into the groups
+        """
+        for row in summary:
+            key = (row["salesforce_object"], row["code"], row["message"])
+            group = self.groups.setdefault(key, [0, []])
+            group[0] += row["count"]
+            room = self.sample_size - len(group[1])
+            group[1].extend(row["samples"][: max(room, 0)])
+
+    def write_summary(self, summary_path: Path) -> Path:
+        """
+        Writes the summary as json, or as csv (samples as a json list) if
+        summary_path ends with .csv
+        """
+        summary_path = Path(summary_path)
+        summary_path.parent.mkdir(parents=True, exist_ok=True)
+        summary = self.summary()
+        if summary_path.suffix == ".csv":
+            with open(summary_path, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(ERROR_SUMMARY_HEADERS)
+                for row in summary:
+                    row["samples"] = json.dumps(row["samples"], default=str)
+                    writer.writerow([row[header] for header in ERROR_SUMMARY_HEADERS])
+        else:
+            with open(summary_path, "w") as file:
+                json.dump(summary, file, default=str)
+        return summary_path
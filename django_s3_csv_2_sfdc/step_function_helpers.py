@@ -1,47 +1,194 @@
-import boto3
+import gzip
+import io
 import json
+import zlib
 
 from pathlib import Path
 
-from typing import Union
+from typing import Iterable, Iterator, Union
 
+from django_s3_csv_2_sfdc.aws_helpers import get_client
 from django_s3_csv_2_sfdc.utils import get_iso
 
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
 CACHED_DATA = Union[list, dict]
 
+COMPRESSIONS = ("gzip", "zstd")
+EXTENSIONS = {None: ".json", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# S3 requires every part but the last to be at least 5MB
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
 
-def cache_data_in_s3(data: CACHED_DATA, bucket: str, s3_key: Union[Path, str] = None):
+def cache_data_in_s3(
+    data: Union[CACHED_DATA, Iterable],
+    bucket: str,
+    s3_key: Union[Path, str] = None,
+    s3_client=None,
+    compression: str = None,
+):
     """
     Caches data in a json file in s3
 
     Useful when using step functions where payload size is a limit
+
+    Pass compression="gzip" or "zstd" (needs the zstandard package) to write
+    data as compressed, newline-delimited json (one record per line) instead.
+    data can then be any iterable, e.g., a generator; it's compressed and
+    uploaded in parts as it's consumed, so it's never all in memory
     """
-    s3 = boto3.client("s3")
+    s3 = s3_client if s3_client else get_client("s3")
+
+    assert (
+        compression is None or compression in COMPRESSIONS
+    ), f"compression must be one of {COMPRESSIONS}"
 
     if not s3_key:
         iso_stamp = get_iso()
-        s3_key = f"data-{iso_stamp}.json"
+        s3_key = f"data-{iso_stamp}{EXTENSIONS[compression]}"
 
     s3_key = str(s3_key)
 
-    s3.put_object(Body=json.dumps(data), Bucket=bucket, Key=s3_key)
+    if compression:
+        if isinstance(data, dict):
+            data = [data]
+        _upload_compressed_lines(s3, data, bucket, s3_key, compression)
+    else:
+        s3.put_object(Body=json.dumps(data), Bucket=bucket, Key=s3_key)
 
     return s3_key
 
 
-def pull_cached_data_from_s3(bucket: str, s3_key: str, delete: bool = False):
+def _get_compressor(compression: str):
+    if compression == "gzip":
+        return zlib.compressobj(wbits=31)
+    assert zstandard, "zstandard must be installed to use zstd compression"
+    return zstandard.ZstdCompressor().compressobj()
+
+
+def _upload_compressed_lines(s3, data: Iterable, bucket: str, s3_key: str, compression):
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=s3_key)["UploadId"]
+    parts = []
+
+    def upload_part(body: bytes):
+        part_number = len(parts) + 1
+        response = s3.upload_part(
+            Body=body,
+            Bucket=bucket,
+            Key=s3_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+        )
+        parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    try:
+        compressor = _get_compressor(compression)
+        buffer = bytearray()
+        for record in data:
+            buffer += compressor.compress(json.dumps(record).encode("utf-8") + b"\n")
+            if len(buffer) >= MULTIPART_PART_SIZE:
+                upload_part(bytes(buffer))
+                buffer.clear()
+        buffer += compressor.flush()
+        upload_part(bytes(buffer))
+
+        s3.complete_multipart_upload(
+            Bucket=bucket,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket, Key=s3_key, UploadId=upload_id)
+        raise
+
+
+class _PeekedStream(io.RawIOBase):
+    """
+    Puts bytes already read off a stream back in front of it
+    """
+
+    def __init__(self, head: bytes, stream) -> None:
+        self.head = head
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.head:
+            chunk, self.head = self.head[: len(buffer)], self.head[len(buffer) :]
+        else:
+            chunk = self.stream.read(len(buffer))
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
+
+def iter_cached_data_from_s3(
+    bucket: str, s3_key: str, s3_client=None
+) -> Iterator[Union[dict, list]]:
+    """
+    Yields the records cached by cache_data_in_s3, one at a time
+
+    Compressed files are decompressed and parsed a line at a time as they're
+    downloaded. Plain json files have to be read whole; if they hold a list
+    its elements are yielded, otherwise the object itself is
+    """
+    s3 = s3_client if s3_client else get_client("s3")
+    body = s3.get_object(Bucket=bucket, Key=s3_key)["Body"]
+    head = body.read(len(ZSTD_MAGIC))
+    stream = io.BufferedReader(_PeekedStream(head, body))
+
+    if head.startswith(GZIP_MAGIC):
+        lines = io.TextIOWrapper(gzip.GzipFile(fileobj=stream), encoding="utf-8")
+    elif head.startswith(ZSTD_MAGIC):
+        assert zstandard, "zstandard must be installed to read zstd compressed data"
+        reader = zstandard.ZstdDecompressor().stream_reader(stream)
+        lines = io.TextIOWrapper(reader, encoding="utf-8")
+    else:
+        data: CACHED_DATA = json.loads(stream.read().decode("utf-8"))
+        if isinstance(data, list):
+            yield from data
+        else:
+            yield data
+        return
+
+    with lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def pull_cached_data_from_s3(
+    bucket: str, s3_key: str, delete: bool = False, s3_client=None
+):
     """
     Pulls cached data from a json file in s3
 
+    Compressed files written by cache_data_in_s3 are detected automatically,
+    and come back as a list of their records. To avoid loading them whole,
+    use iter_cached_data_from_s3
+
     You can pass delete = True to clean-up the file, but it may be
     safer to delete explicitly once the step is done and the data
     has been been processed
     """
-    s3 = boto3.resource("s3")
-    s3_object = s3.Object(bucket, s3_key)
-
-    file_content = s3_object.get()["Body"].read().decode("utf-8")
-    data: CACHED_DATA = json.loads(file_content)
+    s3 = s3_client if s3_client else get_client("s3")
+
+    body = s3.get_object(Bucket=bucket, Key=s3_key)["Body"]
+    head = body.read(len(ZSTD_MAGIC))
+    if head.startswith(GZIP_MAGIC) or head.startswith(ZSTD_MAGIC):
+        body.close()
+        data: CACHED_DATA = list(iter_cached_data_from_s3(bucket, s3_key, s3_client=s3))
+    else:
+        file_content = (head + body.read()).decode("utf-8")
+        data: CACHED_DATA = json.loads(file_content)
 
     if delete:
         s3.delete_object(Bucket=bucket, Key=s3_key)
@@ -1,16 +1,19 @@
 import datetime
 import itertools
+import operator
 from typing import Iterable
 
-from django.conf import settings
 from pathlib import Path
 
+from django_s3_csv_2_sfdc.conf import get_setting
+
 
 def get_temp() -> Path:
-    assert hasattr(
-        settings, "TEMP"
-    ), "TEMP must be defined in your django settings; it should be a path to some folder on your local machine"
-    return Path(settings.TEMP)
+    temp = get_setting("TEMP", None)
+    assert (
+        temp
+    ), "TEMP must be defined in your settings; it should be a path to some folder on your local machine"
+    return Path(temp)
 
 
 def get_iso() -> str:
@@ -54,20 +57,21 @@ def batch_collection(iterable: Iterable, size: int):
         yield chunk
 
 
-def dedupe(elements: list, unique_prop: str) -> list:
-    seen_unique_props = set()
-    deduped_elements = list()
-
-    for element in elements:
-        if isinstance(element, dict):
-            unique_value = element[unique_prop]
-        else:
-            unique_value = getattr(element, unique_prop)
+def dedupe(elements: Iterable, unique_prop: str) -> list:
+    """
+    Drops every element whose unique_prop was already seen, keeping the first
 
-        if unique_value in seen_unique_props:
-            continue
+    Elements can be dicts or objects, or a mix of the two
+    """
+    get_item = operator.itemgetter(unique_prop)
+    get_attr = operator.attrgetter(unique_prop)
 
-        seen_unique_props.add(unique_value)
-        deduped_elements.append(element)
+    # dicts keep insertion order, and setdefault keeps the first value
+    first_elements = {}
+    for element in elements:
+        unique_value = (
+            get_item(element) if isinstance(element, dict) else get_attr(element)
+        )
+        first_elements.setdefault(unique_value, element)
 
-    return deduped_elements
+    return list(first_elements.values())
@@ -0,0 +1,11 @@
+import pytest
+
+from django_s3_csv_2_sfdc.aws_helpers import clear_clients
+
+
+@pytest.fixture(autouse=True)
+def fresh_aws_clients():
+    # cached clients outlive moto's mocks, so start every test from scratch
+    clear_clients()
+    yield
+    clear_clients()
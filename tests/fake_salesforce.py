@@ -0,0 +1,283 @@
+import csv
+import gzip
+import io
+import json
+import random
+import re
+import threading
+import time
+
+from requests import Response
+from requests.adapters import BaseAdapter
+
+from django_s3_csv_2_sfdc.salesforce_client import SFBulkType
+
+
+class FakeBulkType(SFBulkType):
+    """
+    Stands in for the Bulk API. Records whose Name is "bad" fail, as does
+    each record with probability error_rate, and so do failed_batches
+
+    Without a latency, every batch takes a random amount of time to add (so
+    they finish out of order); with one, every call to Salesforce sleeps for
+    that many seconds. Pass keep_batches=False to forget each batch once its
+    results are fetched, so that the fake doesn't hold on to every record
+    """
+
+    def __init__(
+        self,
+        object_name="Contact",
+        failed_batches=(),
+        latency=None,
+        error_rate=0.0,
+        seed=0,
+        keep_batches=True,
+    ) -> None:
+        super().__init__(object_name, "https://fake/", {}, None)
+        self.lock = threading.Lock()
+        self.batches = {}
+        self.running = 0
+        self.max_running = 0
+        self.closed = False
+        self.failed_batches = failed_batches
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.keep_batches = keep_batches
+        self.added = 0
+        self.api_calls = 0
+
+    def call(self):
+        with self.lock:
+            self.api_calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _create_job(self, operation, use_serial, external_id_field=None):
+        self.call()
+        return {"id": "job"}
+
+    def _close_job(self, job_id):
+        self.call()
+        self.closed = True
+
+    def _add_batch(self, job_id, data, operation):
+        self.call()
+        with self.lock:
+            batch_id = str(self.added)
+            self.added += 1
+            self.batches[batch_id] = data
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        if self.latency is None:
+            time.sleep(random.uniform(0, 0.02))
+        return {"id": batch_id, "state": "Queued"}
+
+    def _get_batch(self, job_id, batch_id):
+        self.call()
+        with self.lock:
+            self.running -= 1
+        state = "Failed" if batch_id in self.failed_batches else "Completed"
+        return {"id": batch_id, "state": state, "stateMessage": "nope"}
+
+    def _get_batch_results(self, job_id, batch_id, operation):
+        self.call()
+        batch = (
+            self.batches[batch_id] if self.keep_batches else self.batches.pop(batch_id)
+        )
+        results = []
+        for record in batch:
+            failed = record.get("Name") == "bad"
+            if self.error_rate:
+                with self.lock:
+                    failed = failed or self.random.random() < self.error_rate
+            results.append(
+                {
+                    "success": not failed,
+                    "created": True,
+                    "id": record["ID"],
+                    "errors": (
+                        [{"statusCode": "BAD", "message": "bad name"}] if failed else []
+                    ),
+                }
+            )
+        yield results
+
+
+class FakeBulkAdapter(BaseAdapter):
+    """
+    A local stand-in for Salesforce's Bulk API (1.0) endpoints, so SFBulkType
+    runs simple_salesforce's own requests, rather than FakeBulkType's
+
+    Mount it on a requests session. Records whose Name is "bad" fail
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        path = re.sub(r"^https://[^/]+/job", "", request.url.split("?")[0])
+        parts = [part for part in path.split("/") if part]
+
+        if request.method == "POST" and not parts:
+            with self.lock:
+                job_id = f"job{len(self.jobs)}"
+                self.jobs[job_id] = {**json.loads(request.body), "id": job_id}
+                self.jobs[job_id]["batches"] = {}
+            return self.respond(request, {"id": job_id, "state": "Open"})
+
+        job = self.jobs[parts[0]]
+        if request.method == "POST" and len(parts) == 1:
+            job["state"] = json.loads(request.body)["state"]
+            return self.respond(request, {"id": job["id"], "state": job["state"]})
+        if request.method == "POST":
+            body = request.body
+            if request.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            with self.lock:
+                batch_id = str(len(job["batches"]))
+                job["batches"][batch_id] = json.loads(body)
+            return self.respond(
+                request, {"id": batch_id, "jobId": job["id"], "state": "Queued"}
+            )
+
+        batch_id = parts[2]
+        if len(parts) == 3:
+            return self.respond(
+                request, {"id": batch_id, "jobId": job["id"], "state": "Completed"}
+            )
+        return self.respond(
+            request,
+            [
+                {
+                    "success": record["Name"] != "bad",
+                    "created": True,
+                    "id": None if record["Name"] == "bad" else f"003{idx}",
+                    "errors": (
+                        [{"statusCode": "BAD", "message": "bad name"}]
+                        if record["Name"] == "bad"
+                        else []
+                    ),
+                }
+                for idx, record in enumerate(job["batches"][batch_id])
+            ],
+        )
+
+    def respond(self, request, payload, status=200):
+        response = Response()
+        response.status_code = status
+        response.request = request
+        response.url = request.url
+        response._content = json.dumps(payload).encode("utf-8")
+        response._content_consumed = True
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    def close(self):
+        pass
+
+
+class FakeBulk2Adapter(BaseAdapter):
+    """
+    A local stand-in for Salesforce's Bulk API 2.0 ingest endpoints
+
+    Mount it on a requests session. Records whose Name is "bad" fail and
+    records whose Name is "skip" aren't processed
+    """
+
+    def __init__(self, page_size=None) -> None:
+        super().__init__()
+        self.jobs = {}
+        self.page_size = page_size
+
+    def send(self, request, **kwargs):
+        path = re.sub(r"^https://[^/]+/jobs/ingest/", "", request.url.split("?")[0])
+        parts = [part for part in path.split("/") if part]
+
+        if request.method == "POST" and not parts:
+            job_id = f"job{len(self.jobs)}"
+            self.jobs[job_id] = {**json.loads(request.body), "id": job_id}
+            self.jobs[job_id]["state"] = "Open"
+            return self.respond(request, self.jobs[job_id])
+
+        job = self.jobs[parts[0]]
+        if request.method == "PUT":
+            body = request.body
+            if hasattr(body, "read"):
+                body = body.read()
+            elif not isinstance(body, (bytes, str)):
+                body = b"".join(body)
+            if request.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            if isinstance(body, bytes):
+                body = body.decode("utf-8")
+            # like Salesforce, rejects uploads whose lines end differently than the job said
+            if ("\r\n" in body) != (job["lineEnding"] == "CRLF"):
+                return self.respond(
+                    request,
+                    [{"errorCode": "INVALIDJOB", "message": "wrong lineEnding"}],
+                    status=400,
+                )
+            job["rows"] = list(csv.DictReader(io.StringIO(body)))
+            return self.respond(request, None, status=201)
+        if request.method == "PATCH":
+            job["state"] = "UploadComplete"
+            return self.respond(request, job)
+        if len(parts) == 1:
+            job["state"] = "JobComplete"
+            return self.respond(
+                request, {key: value for key, value in job.items() if key != "rows"}
+            )
+
+        result_type = parts[1]
+        rows = job["rows"]
+        if result_type == "successfulResults":
+            rows = [
+                {"sf__Id": f"00{idx}", "sf__Created": "true", **row}
+                for idx, row in enumerate(rows)
+                if row["Name"] not in ("bad", "skip")
+            ]
+        elif result_type == "failedResults":
+            rows = [
+                {"sf__Id": "", "sf__Error": "BAD_NAME:that's a bad name:--", **row}
+                for row in rows
+                if row["Name"] == "bad"
+            ]
+        else:
+            rows = [row for row in rows if row["Name"] == "skip"]
+
+        locator = None
+        if self.page_size:
+            start = (
+                int(request.url.split("locator=")[1])
+                if "locator=" in request.url
+                else 0
+            )
+            if start + self.page_size < len(rows):
+                locator = str(start + self.page_size)
+            rows = rows[start : start + self.page_size]
+
+        buffer = io.StringIO()
+        fieldnames = list(rows[0].keys()) if rows else ["sf__Id"]
+        writer = csv.DictWriter(buffer, fieldnames=fieldnames, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+        response = self.respond(request, None)
+        response._content = buffer.getvalue().encode("utf-8")
+        response.headers["Sforce-Locator"] = locator or "null"
+        return response
+
+    def respond(self, request, payload, status=200):
+        response = Response()
+        response.status_code = status
+        response.request = request
+        response.url = request.url
+        response._content = json.dumps(payload).encode("utf-8") if payload else b""
+        response._content_consumed = True
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,175 @@
+import asyncio
+import csv
+
+from django_s3_csv_2_sfdc.async_orchestrator import AsyncOrchestrator
+
+import django_s3_csv_2_sfdc.async_orchestrator as async_orchestrator_module
+import django_s3_csv_2_sfdc.orchestrator as orchestrator_module
+
+
+class FakeBody:
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+
+    async def read(self, size):
+        chunk, self.content = self.content[:size], self.content[size:]
+        await asyncio.sleep(0)
+        return chunk
+
+
+class FakeAsyncS3:
+    """
+    Stands in for an aiobotocore S3 client
+    """
+
+    def __init__(self, objects: dict) -> None:
+        self.objects = objects
+
+    async def get_object(self, Bucket, Key):
+        return {"Body": FakeBody(self.objects[Key])}
+
+    async def put_object(self, Body, Bucket, Key):
+        self.objects[Key] = Body
+
+    async def copy_object(self, Bucket, Key, CopySource):
+        self.objects[Key] = self.objects[CopySource["Key"]]
+
+    async def delete_object(self, Bucket, Key):
+        del self.objects[Key]
+
+    async def create_multipart_upload(self, Bucket, Key):
+        self.objects[Key] = []
+        return {"UploadId": Key}
+
+    async def upload_part(self, Body, Bucket, Key, PartNumber, UploadId):
+        self.objects[UploadId].append(Body)
+        return {"ETag": str(PartNumber)}
+
+    async def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        assert [part["ETag"] for part in MultipartUpload["Parts"]] == [
+            str(idx + 1) for idx in range(len(self.objects[UploadId]))
+        ]
+        self.objects[Key] = b"".join(self.objects[UploadId])
+
+
+class ExecutionObject:
+    created = []
+
+    def create(self, data):
+        self.created.append(data)
+
+
+class FakeSfClient:
+    Integration_Execution__c = ExecutionObject()
+
+
+class MyAsyncOrchestrator(AsyncOrchestrator):
+    concurrent_report = True
+
+    @property
+    def execution_sfdc_hash(self):
+        return {"Origin_Path__c": self.s3_object_key, "Errors": self.error_count}
+
+
+def test_async_orchestrator(monkeypatch, tmp_path):
+    monkeypatch.setattr(async_orchestrator_module, "get_temp", lambda: tmp_path)
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda: tmp_path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("S3 should only be called through the async client")
+
+    monkeypatch.setattr(orchestrator_module, "download_file", fail)
+    with open("tests/sample.csv", "rb") as file:
+        content = file.read()
+    keys = [f"incoming/{idx}.csv" for idx in range(3)]
+    s3 = FakeAsyncS3({key: content for key in keys})
+
+    async def handle(s3_object_key):
+        orchestrator = await MyAsyncOrchestrator.acreate(
+            s3_object_key,
+            "a bucket",
+            sf_client=FakeSfClient(),
+            execution_object_name="Integration_Execution__c",
+            error_report_file_name=f"{s3_object_key.replace('/', '_')}-errors.csv",
+            async_s3_client=s3,
+        )
+        rows = list(orchestrator.iter_rows())
+        results = [{"success": row["Name"] != "Sarah", "errors": []} for row in rows]
+        results[1]["errors"] = [{"statusCode": "BAD", "message": "nope"}]
+        await orchestrator.alog_batch(results, rows, "Contact", "ID")
+        await orchestrator.aautomagically_finish_up()
+        return orchestrator
+
+    async def handle_all():
+        return await asyncio.gather(*(handle(key) for key in keys))
+
+    orchestrators = asyncio.run(handle_all())
+
+    assert [orchestrator.error_count for orchestrator in orchestrators] == [1, 1, 1]
+    assert not any(key in s3.objects for key in keys)
+    for orchestrator in orchestrators:
+        assert s3.objects[orchestrator.archive_file_s3_key] == content
+        report = s3.objects[orchestrator.error_file_s3_key].decode("utf-8")
+        assert [
+            row["upsert_key_value"] for row in csv.DictReader(report.splitlines())
+        ] == ["2"]
+    assert sorted(data["Origin_Path__c"] for data in ExecutionObject.created) == keys
+
+
+def test_async_orchestrator_without_async_client(monkeypatch, tmp_path):
+    uploaded = []
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda: tmp_path)
+    monkeypatch.setattr(
+        orchestrator_module, "download_file", lambda *args, **kwargs: "tests/sample.csv"
+    )
+    monkeypatch.setattr(
+        orchestrator_module,
+        "upload_file",
+        lambda path, bucket, s3_key, **kwargs: uploaded.append(s3_key),
+    )
+
+    async def handle():
+        orchestrator = await AsyncOrchestrator.acreate("junk.csv", "a bucket")
+        await orchestrator.aupload_error_report()
+        return orchestrator
+
+    orchestrator = asyncio.run(handle())
+
+    assert orchestrator.downloaded_file == "tests/sample.csv"
+    assert uploaded == [orchestrator.error_file_s3_key]
+
+
+def test_async_orchestrator_uploads_in_parts_and_uses_overrides(monkeypatch, tmp_path):
+    monkeypatch.setattr(async_orchestrator_module, "get_temp", lambda: tmp_path)
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda: tmp_path)
+    monkeypatch.setattr(async_orchestrator_module, "DEFAULT_CHUNK_SIZE", 10)
+    with open("tests/sample.csv", "rb") as file:
+        content = file.read()
+    s3 = FakeAsyncS3({"incoming/file.csv": content})
+    archived = []
+
+    class ArchivingOrchestrator(MyAsyncOrchestrator):
+        def archive_file(self):
+            archived.append(self.s3_object_key)
+
+    async def handle():
+        orchestrator = await ArchivingOrchestrator.acreate(
+            "incoming/file.csv",
+            "a bucket",
+            sf_client=FakeSfClient(),
+            execution_object_name="Integration_Execution__c",
+            async_s3_client=s3,
+        )
+        await orchestrator.aupload(orchestrator.downloaded_file, "copy.csv")
+        await orchestrator.aautomagically_finish_up()
+        return orchestrator
+
+    orchestrator = asyncio.run(handle())
+
+    assert s3.objects["copy.csv"] == content
+    # the override, rather than copy_object
+    assert archived == ["incoming/file.csv"]
+    assert "incoming/file.csv" in s3.objects
+    # nothing was logged, so it's just the headers
+    report = s3.objects[orchestrator.error_file_s3_key].decode("utf-8")
+    assert report.splitlines()[0].startswith("salesforce_object,")
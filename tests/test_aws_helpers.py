@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django_s3_csv_2_sfdc.aws_helpers import get_client, set_client
+
+
+def test_get_client_is_cached():
+    client = get_client("s3", region_name="us-west-2")
+
+    assert get_client("s3", region_name="us-west-2") is client
+    assert get_client("s3", region_name="us-east-1") is not client
+    assert client.meta.config.max_pool_connections == 50
+
+
+def test_get_client_is_thread_safe():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        clients = list(pool.map(lambda _: get_client("s3"), range(32)))
+
+    assert all(client is clients[0] for client in clients)
+
+
+def test_set_client():
+    class FakeClient:
+        pass
+
+    fake_client = FakeClient()
+    set_client(fake_client, "s3")
+    assert get_client("s3") is fake_client
+
+    set_client(None, "s3")
+    assert get_client("s3") is not fake_client
@@ -0,0 +1,46 @@
+import boto3
+import pytest
+
+from moto import mock_s3
+
+from django_s3_csv_2_sfdc.checkpoint_helpers import (
+    LocalCheckpointStore,
+    S3CheckpointStore,
+)
+
+
+@mock_s3
+def test_s3_checkpoint_store():
+    s3 = boto3.client("s3")
+    bucket_name = "a-bucket"
+    s3.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+    )
+    store = S3CheckpointStore(bucket_name)
+
+    assert store.load("a-bucket/incoming/file.csv") is None
+
+    store.save("a-bucket/incoming/file.csv", {"completed_records": {"Contact": 9}})
+    assert store.load("a-bucket/incoming/file.csv") == {
+        "completed_records": {"Contact": 9}
+    }
+
+    store.delete("a-bucket/incoming/file.csv")
+    assert store.load("a-bucket/incoming/file.csv") is None
+
+
+def test_local_checkpoint_store(tmp_path):
+    store = LocalCheckpointStore(tmp_path)
+
+    assert store.load("a-bucket/file.csv") is None
+
+    store.save("a-bucket/file.csv", {"error_count": 1})
+    store.save("a-bucket/file.csv", {"error_count": 2})
+    assert store.load("a-bucket/file.csv") == {"error_count": 2}
+    assert [path.name for path in (tmp_path / "a-bucket").iterdir()] == [
+        "file.csv.json"
+    ]
+
+    store.delete("a-bucket/file.csv")
+    assert store.load("a-bucket/file.csv") is None
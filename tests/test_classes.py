@@ -1,11 +1,16 @@
 import csv
 import os
+import pytest
+import shutil
 
 from pathlib import Path
 
 from tempfile import gettempdir
 
-from django_s3_csv_2_sfdc.orchestrator import Orchestrator
+from simple_salesforce.exceptions import SalesforceGeneralError
+
+from django_s3_csv_2_sfdc.instrumentation import MetricsRecorder
+from django_s3_csv_2_sfdc.orchestrator import MultiFileOrchestrator, Orchestrator
 from django_s3_csv_2_sfdc.utils import get_iso
 
 import django_s3_csv_2_sfdc.orchestrator as orchestrator_module
@@ -19,7 +24,9 @@ class MockSfClient:
 
 def test_orchestrator(monkeypatch):
     monkeypatch.setattr(
-        orchestrator_module, "download_file", lambda *args: "tests/sample.csv"
+        orchestrator_module,
+        "download_file",
+        lambda *args, **kwargs: "tests/sample.csv",
     )
     monkeypatch.setattr(orchestrator_module, "SfClient", MockSfClient)
     monkeypatch.setattr(
@@ -142,3 +149,573 @@ def test_orchestrator(monkeypatch):
     assert orchestrator.error_file_s3_key == f"errors/error-report-{timestamp}.csv"
 
     os.remove(orchestrator.error_report_path)
+
+
+def test_orchestrator_stream(monkeypatch):
+    def fail(*args):
+        raise AssertionError("streaming shouldn't download the file")
+
+    monkeypatch.setattr(orchestrator_module, "download_file", fail)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "open_s3_stream",
+        lambda *args, **kwargs: open("tests/sample.csv", newline=""),
+    )
+    monkeypatch.setattr(
+        orchestrator_module, "get_temp", lambda *args: Path(gettempdir())
+    )
+
+    orchestrator = Orchestrator("junk.csv", "a bucket", stream=True)
+
+    assert orchestrator.downloaded_file is None
+    assert [row["Name"] for row in orchestrator.iter_rows()] == ["Bob", "Sarah", "Jack"]
+
+
+def test_orchestrator_bulk_upsert(monkeypatch, tmp_path):
+    from tests.fake_salesforce import FakeBulkType
+
+    class BulkHandler:
+        def __getattr__(self, name):
+            return FakeBulkType(name)
+
+    class BulkSfClient:
+        bulk = BulkHandler()
+
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda *args: tmp_path)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "download_file",
+        lambda *args, **kwargs: "tests/sample.csv",
+    )
+
+    orchestrator = Orchestrator("junk.csv", "a bucket", sf_client=BulkSfClient())
+    data = [{"ID": idx, "Name": "bad" if idx % 4 else "good"} for idx in range(20)]
+
+    pushed = orchestrator.bulk_upsert(
+        "Contact", data, "ID", batch_size=3, max_in_flight=2, wait=0
+    )
+
+    assert pushed == 20
+    assert orchestrator.error_count == 15
+
+
+def test_orchestrator_error_summary(monkeypatch, tmp_path):
+    from tests.fake_salesforce import FakeBulkType
+
+    uploaded = {}
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda *args: tmp_path)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "download_file",
+        lambda *args, **kwargs: "tests/sample.csv",
+    )
+    monkeypatch.setattr(
+        orchestrator_module,
+        "upload_file",
+        lambda path, bucket, s3_key, **kwargs: uploaded.update({s3_key: path}),
+    )
+
+    class BulkSfClient:
+        class bulk:
+            Contact = FakeBulkType()
+
+    class SummarizingOrchestrator(Orchestrator):
+        max_error_report_rows = 4
+
+        def archive_file(self):
+            pass
+
+        def create_execution_object(self):
+            pass
+
+    orchestrator = SummarizingOrchestrator(
+        "junk.csv", "a bucket", sf_client=BulkSfClient()
+    )
+    data = [{"ID": idx, "Name": "bad" if idx % 4 else "good"} for idx in range(20)]
+    orchestrator.bulk_upsert("Contact", data, "ID", batch_size=3, wait=0)
+    orchestrator.automagically_finish_up()
+
+    assert orchestrator.error_count == 15
+    assert orchestrator.error_report_overflow == 11
+    with open(uploaded[orchestrator.error_file_s3_key], newline="") as report:
+        assert len(list(csv.DictReader(report))) == 4
+    assert orchestrator.error_summary_s3_key.endswith("-summary.csv")
+    with open(uploaded[orchestrator.error_summary_s3_key], newline="") as summary:
+        rows = list(csv.DictReader(summary))
+    assert [row["count"] for row in rows] == ["15"]
+
+
+def test_orchestrator_skips_unchanged_records(monkeypatch, tmp_path):
+    from django_s3_csv_2_sfdc.fingerprint_helpers import FingerprintIndex
+    from tests.fake_salesforce import FakeBulkType
+
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda *args: tmp_path)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "download_file",
+        lambda *args, **kwargs: "tests/sample.csv",
+    )
+    path = tmp_path / "fingerprints.bin"
+    data = [{"ID": idx, "Name": "bad" if idx % 4 else "good"} for idx in range(8)]
+
+    def run(data):
+        class BulkSfClient:
+            class bulk:
+                Contact = FakeBulkType()
+
+        orchestrator = Orchestrator(
+            "junk.csv",
+            "a bucket",
+            sf_client=BulkSfClient(),
+            fingerprint_index=FingerprintIndex("ID", path=path).load(),
+        )
+        pushed = orchestrator.bulk_upsert("Contact", data, "ID", wait=0)
+        orchestrator.report = lambda: None
+        orchestrator.automagically_finish_up()
+        return orchestrator, pushed
+
+    orchestrator, pushed = run(data + data[:2])
+    assert (pushed, orchestrator.skipped_count, orchestrator.error_count) == (8, 2, 6)
+
+    # only the records that failed are sent again
+    data[0]["Name"] = "changed"
+    orchestrator, pushed = run(data)
+    assert (pushed, orchestrator.skipped_count, orchestrator.error_count) == (7, 1, 6)
+
+    # each call counts just the records it skipped
+    class BulkSfClient:
+        class bulk:
+            Contact = FakeBulkType()
+
+    orchestrator = Orchestrator(
+        "junk.csv",
+        "a bucket",
+        sf_client=BulkSfClient(),
+        fingerprint_index=FingerprintIndex("ID", path=path).load(),
+        instrumentation=MetricsRecorder(),
+    )
+    orchestrator.bulk_upsert("Contact", data[:4], "ID", wait=0)
+    orchestrator.bulk_upsert("Contact", data[4:], "ID", wait=0)
+    assert orchestrator.metrics["counters"]["records_skipped"] == 2
+
+
+@pytest.fixture
+def checkpoint_bucket(monkeypatch, tmp_path):
+    """
+    Stands in for S3 (tmp_path / "bucket") and TEMP (tmp_path / "local"),
+    keeping track of how many bytes are uploaded
+    """
+    bucket = tmp_path / "bucket"
+    local = tmp_path / "local"
+    uploaded = []
+
+    def put(s3_key, data):
+        (bucket / s3_key).parent.mkdir(parents=True, exist_ok=True)
+        (bucket / s3_key).write_bytes(data)
+        uploaded.append(len(data))
+
+    def download_file(s3_key, bucket_name, **kwargs):
+        if s3_key == "junk.csv":
+            return "tests/sample.csv"
+        (local / s3_key).parent.mkdir(parents=True, exist_ok=True)
+        return shutil.copy(bucket / s3_key, local / s3_key)
+
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda *args: local)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "upload_file",
+        lambda path, bucket_name, s3_key, **kwargs: put(
+            s3_key, Path(path).read_bytes()
+        ),
+    )
+    monkeypatch.setattr(
+        orchestrator_module,
+        "upload_bytes",
+        lambda data, bucket_name, s3_key, **kwargs: put(s3_key, data),
+    )
+    monkeypatch.setattr(orchestrator_module, "download_file", download_file)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "download_bytes",
+        lambda s3_key, bucket_name, **kwargs: (bucket / s3_key).read_bytes(),
+    )
+    monkeypatch.setattr(
+        orchestrator_module,
+        "delete_files",
+        lambda s3_keys, bucket_name, **kwargs: [
+            (bucket / s3_key).unlink() for s3_key in s3_keys
+        ],
+    )
+    return bucket, local, uploaded
+
+
+def test_orchestrator_resumes_from_checkpoint(checkpoint_bucket, tmp_path):
+    from simple_salesforce.exceptions import SalesforceGeneralError
+
+    from django_s3_csv_2_sfdc.checkpoint_helpers import LocalCheckpointStore
+    from tests.fake_salesforce import FakeBulkType
+
+    bucket, local, uploaded = checkpoint_bucket
+
+    def run(bulk_type):
+        class BulkSfClient:
+            class bulk:
+                Contact = bulk_type
+
+        orchestrator = Orchestrator(
+            "junk.csv",
+            "a bucket",
+            sf_client=BulkSfClient(),
+            checkpoint_store=LocalCheckpointStore(tmp_path / "checkpoints"),
+        )
+        data = [{"ID": idx, "Name": "bad" if idx % 4 else "good"} for idx in range(20)]
+        orchestrator.bulk_upsert(
+            "Contact", data, "ID", batch_size=3, max_in_flight=1, wait=0
+        )
+        return orchestrator
+
+    # times out, as it were, on the fourth batch
+    with pytest.raises(SalesforceGeneralError):
+        run(FakeBulkType(failed_batches=("3",)))
+    shutil.rmtree(local)
+
+    retried = FakeBulkType()
+    orchestrator = run(retried)
+
+    assert [record["ID"] for record in retried.batches["0"]] == [9, 10, 11]
+    assert orchestrator.error_count == 15
+    assert orchestrator.completed_records == {"Contact": 20}
+    orchestrator.error_report_writer.close()
+    with open(orchestrator.error_report_path) as report:
+        rows = list(csv.DictReader(report))
+    assert len(rows) == 15
+    assert orchestrator.error_file_s3_key.startswith("errors/error-report-")
+    # only what each batch added to the report was uploaded
+    assert sum(uploaded) == os.path.getsize(orchestrator.error_report_path)
+    assert len(orchestrator.error_report_parts) == 7
+
+    orchestrator.report = lambda: None
+    parts = orchestrator.error_report_parts
+    orchestrator.automagically_finish_up()
+    assert orchestrator.checkpoint_store.load(orchestrator.checkpoint_name) is None
+    assert not any((bucket / part).exists() for part in parts)
+
+
+def test_orchestrator_resumes_on_a_warm_container(checkpoint_bucket, tmp_path):
+    from django_s3_csv_2_sfdc.checkpoint_helpers import LocalCheckpointStore
+    from tests.fake_salesforce import FakeBulkType
+
+    bucket, local, uploaded = checkpoint_bucket
+    store = LocalCheckpointStore(tmp_path / "checkpoints")
+    # a checkpoint without any parts yet, and the report the run that made it
+    # left behind, with errors from a batch it never checkpointed
+    store.save(
+        "a bucket/junk.csv",
+        {
+            "timestamp": "20210101T0000",
+            "error_folder": "errors",
+            "error_report_file_name": "report.csv",
+            "error_count": 0,
+            "success_count": 3,
+            "completed_records": {"Contact": 3},
+        },
+    )
+    (local / "errors").mkdir(parents=True)
+    stale = ["salesforce_object,code,message,upsert_key,upsert_key_value,object_json"]
+    stale.append('Contact,BAD,bad name,ID,4,"{""ID"": 4}"')
+    (local / "errors" / "report.csv").write_text("\n".join(stale) + "\n")
+
+    class BulkSfClient:
+        class bulk:
+            Contact = FakeBulkType()
+
+    orchestrator = Orchestrator(
+        "junk.csv", "a bucket", sf_client=BulkSfClient(), checkpoint_store=store
+    )
+    data = [{"ID": idx, "Name": "bad" if idx == 4 else "good"} for idx in range(9)]
+    orchestrator.bulk_upsert("Contact", data, "ID", batch_size=3, wait=0)
+
+    assert orchestrator.error_count == 1
+    orchestrator.error_report_writer.close()
+    with open(orchestrator.error_report_path) as report:
+        rows = list(csv.DictReader(report))
+    assert [row["upsert_key_value"] for row in rows] == ["4"]
+    # and nothing was uploaded twice
+    assert sum(uploaded) == os.path.getsize(orchestrator.error_report_path)
+
+
+def test_orchestrator_resumes_rows_from_checkpoint(checkpoint_bucket, tmp_path):
+    from simple_salesforce.exceptions import SalesforceGeneralError
+
+    from django_s3_csv_2_sfdc.checkpoint_helpers import LocalCheckpointStore
+    from tests.fake_salesforce import FakeBulkType
+
+    bucket, local, uploaded = checkpoint_bucket
+    source = tmp_path / "rows.csv"
+    with open(source, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["ID", "Name"])
+        writer.writerows([idx, "bad" if idx % 4 else "good"] for idx in range(20))
+
+    serialized = []
+
+    class RowsOrchestrator(Orchestrator):
+        def download_s3_file(self):
+            self.downloaded_file = source
+
+    def serialize(row):
+        serialized.append(row["ID"])
+        # every tenth row is left out
+        return None if row["ID"].endswith("5") else row
+
+    def run(bulk_type):
+        class BulkSfClient:
+            class bulk:
+                Contact = bulk_type
+
+        orchestrator = RowsOrchestrator(
+            "rows.csv",
+            "a bucket",
+            sf_client=BulkSfClient(),
+            checkpoint_store=LocalCheckpointStore(tmp_path / "checkpoints"),
+        )
+        orchestrator.bulk_upsert_rows(
+            "Contact",
+            serialize,
+            "ID",
+            batch_size=3,
+            max_in_flight=1,
+            wait=0,
+        )
+        return orchestrator
+
+    with pytest.raises(SalesforceGeneralError):
+        run(FakeBulkType(failed_batches=("3",)))
+    shutil.rmtree(local)
+    serialized.clear()
+
+    retried = FakeBulkType()
+    orchestrator = run(retried)
+
+    # the rows that were done aren't read again
+    assert serialized == [str(idx) for idx in range(10, 20)]
+    # rows 0-9 went in three batches (5 was left out), so it picks up at 10
+    assert [record["ID"] for record in retried.batches["0"]] == ["10", "11", "12"]
+    pushed = [record["ID"] for batch in retried.batches.values() for record in batch]
+    assert pushed == [str(idx) for idx in range(10, 20) if idx != 15]
+    assert orchestrator.completed_records == {"Contact": 18}
+    with open(source, "rb") as file:
+        assert orchestrator.row_offsets == {"Contact": len(file.read())}
+    assert orchestrator.error_count == 13
+
+
+def test_orchestrator_resumes_with_a_fingerprint_index(checkpoint_bucket, tmp_path):
+    from simple_salesforce.exceptions import SalesforceGeneralError
+
+    from django_s3_csv_2_sfdc.checkpoint_helpers import LocalCheckpointStore
+    from django_s3_csv_2_sfdc.fingerprint_helpers import FingerprintIndex
+    from tests.fake_salesforce import FakeBulkType
+
+    bucket, local, uploaded = checkpoint_bucket
+    path = tmp_path / "fingerprints.bin"
+    # the record that fails is in the first batch, which is checkpointed
+    data = [{"ID": idx, "Name": "bad" if idx == 1 else "good"} for idx in range(9)]
+
+    def run(bulk_type):
+        class BulkSfClient:
+            class bulk:
+                Contact = bulk_type
+
+        orchestrator = Orchestrator(
+            "junk.csv",
+            "a bucket",
+            sf_client=BulkSfClient(),
+            checkpoint_store=LocalCheckpointStore(tmp_path / "checkpoints"),
+            fingerprint_index=FingerprintIndex("ID", path=path).load(),
+        )
+        orchestrator.bulk_upsert(
+            "Contact", data, "ID", batch_size=3, max_in_flight=1, wait=0
+        )
+        orchestrator.report = lambda: None
+        orchestrator.automagically_finish_up()
+        return orchestrator
+
+    with pytest.raises(SalesforceGeneralError):
+        run(FakeBulkType(failed_batches=("2",)))
+    shutil.rmtree(local)
+
+    retried = FakeBulkType()
+    run(retried)
+
+    assert [record["ID"] for record in retried.batches["0"]] == [6, 7, 8]
+    saved = FingerprintIndex("ID", path=path).load()
+    # so that it's sent again next time
+    assert "1" not in saved.fingerprints
+    assert set(saved.fingerprints) == {str(idx) for idx in range(9) if idx != 1}
+
+
+@pytest.mark.parametrize("concurrent_report", [True, False])
+def test_orchestrator_report(monkeypatch, tmp_path, concurrent_report):
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda *args: tmp_path)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "download_file",
+        lambda *args, **kwargs: "tests/sample.csv",
+    )
+    ran = []
+
+    class ReportingOrchestrator(Orchestrator):
+        def archive_file(self):
+            ran.append("archive_file")
+
+        def upload_error_report(self):
+            raise ValueError("upload failed")
+
+        def create_execution_object(self):
+            ran.append("create_execution_object")
+
+    orchestrator = ReportingOrchestrator("junk.csv", "a bucket")
+    orchestrator.concurrent_report = concurrent_report
+
+    with pytest.raises(ValueError):
+        orchestrator.report()
+
+    if concurrent_report:
+        assert sorted(ran) == ["archive_file", "create_execution_object"]
+    else:
+        assert ran == ["archive_file"]
+
+
+def test_multi_file_orchestrator(monkeypatch, tmp_path):
+    from tests.fake_salesforce import FakeBulkType
+
+    files = {
+        "incoming/a.csv": [("1", "good"), ("2", "bad"), ("3", "good")],
+        "incoming/b.csv": [("4", "bad"), ("5", "good")],
+        # never reaches log_batch
+        "incoming/empty.csv": [],
+    }
+    for s3_key, rows in files.items():
+        path = tmp_path / s3_key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["ID", "Name"])
+            writer.writerows(rows)
+
+    moved = {}
+    uploaded = []
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda *args: tmp_path)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "download_file",
+        lambda s3_key, *args, **kwargs: tmp_path / s3_key,
+    )
+    monkeypatch.setattr(
+        orchestrator_module,
+        "move_files",
+        lambda moves, *args, **kwargs: moved.update(moves),
+    )
+    monkeypatch.setattr(
+        orchestrator_module,
+        "upload_file",
+        lambda local_path, bucket, s3_key, **kwargs: uploaded.append(s3_key),
+    )
+
+    class BulkHandler:
+        def __getattr__(self, name):
+            return FakeBulkType(name)
+
+    class FakeSfClient:
+        bulk = BulkHandler()
+        composite_calls = []
+
+        def restful(self, path, method, json):
+            self.composite_calls.append((path, method, json))
+            return [{"success": True} for _ in json["records"]]
+
+    wrapped_up = []
+
+    class CountingOrchestrator(Orchestrator):
+        summarize_errors = True
+
+        def wrap_up(self):
+            wrapped_up.append(self.s3_object_key)
+            super().wrap_up()
+
+        @property
+        def execution_sfdc_hash(self):
+            return {"Data_File__c": self.s3_object_key, "Errors__c": self.error_count}
+
+    sf_client = FakeSfClient()
+    orchestrator = MultiFileOrchestrator(
+        "a bucket",
+        s3_object_keys=list(files),
+        orchestrator_class=CountingOrchestrator,
+        sf_client=sf_client,
+        execution_object_name="Execution__c",
+        error_report_file_name="report.csv",
+    )
+    assert list(orchestrator.orchestrators) == list(files)
+
+    pushed = orchestrator.bulk_upsert(
+        "Contact", orchestrator.iter_rows(), "ID", batch_size=2, wait=0
+    )
+    orchestrator.automagically_finish_up()
+
+    assert pushed == 5
+    assert sorted(wrapped_up) == sorted(files)
+    a, b, empty = orchestrator.orchestrators.values()
+    assert (a.error_count, b.error_count, empty.error_count) == (1, 1, 0)
+    assert a.error_report_file_name == "report-incoming_a.csv.csv"
+    with open(a.error_report_path) as report:
+        assert [row["upsert_key_value"] for row in csv.DictReader(report)] == ["2"]
+    with open(b.error_report_path) as report:
+        assert [row["upsert_key_value"] for row in csv.DictReader(report)] == ["4"]
+
+    assert set(moved) == set(files)
+    with open(empty.error_report_path) as report:
+        assert list(csv.DictReader(report)) == []
+    assert sorted(uploaded) == sorted(
+        key
+        for each in (a, b, empty)
+        for key in (each.error_file_s3_key, each.error_summary_s3_key)
+    )
+
+    ((path, method, body),) = sf_client.composite_calls
+    assert (path, method) == ("composite/sobjects", "POST")
+    assert body["records"] == [
+        {"attributes": {"type": "Execution__c"}, "Data_File__c": key, "Errors__c": 1}
+        for key in ("incoming/a.csv", "incoming/b.csv")
+    ] + [
+        {
+            "attributes": {"type": "Execution__c"},
+            "Data_File__c": "incoming/empty.csv",
+            "Errors__c": 0,
+        }
+    ]
+
+    sf_client.restful = lambda path, method, json: [
+        {"success": True},
+        {"success": False, "errors": [{"statusCode": "REQUIRED_FIELD_MISSING"}]},
+        {"success": True},
+    ]
+    with pytest.raises(SalesforceGeneralError) as raised:
+        orchestrator.create_execution_objects()
+    assert "incoming/b.csv" in str(raised.value)
+
+    # results that don't line up with the data aren't quietly cut short
+    with pytest.raises(AssertionError):
+        orchestrator.log_batch(
+            [{"success": True, "errors": []}],
+            [{"ID": "1"}, {"ID": "2"}],
+            "Contact",
+            "ID",
+            ["incoming/a.csv", "incoming/a.csv"],
+        )
+    with pytest.raises(AssertionError):
+        MultiFileOrchestrator(
+            "a bucket",
+            s3_object_keys=list(files),
+            checkpoint_store=object(),
+        )
@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from pathlib import Path
+
+from django_s3_csv_2_sfdc import conf
+from django_s3_csv_2_sfdc.utils import get_temp
+
+
+@pytest.fixture(autouse=True)
+def unconfigured(monkeypatch):
+    monkeypatch.setattr(conf, "_configured", None)
+    monkeypatch.setattr(conf, "_get_django_setting", lambda name: conf._missing)
+
+
+def test_configure(monkeypatch):
+    monkeypatch.setenv("SFDC_USERNAME", "from the environment")
+    monkeypatch.delenv("SFDC_DOMAIN", raising=False)
+    monkeypatch.delenv("SFDC_PASSWORD", raising=False)
+    conf.configure(TEMP="/somewhere", SFDC_USERNAME="configured")
+
+    assert get_temp() == Path("/somewhere")
+    assert conf.get_setting("SFDC_USERNAME") == "configured"
+    assert conf.get_setting("SFDC_DOMAIN") == "na"
+    with pytest.raises(AttributeError):
+        conf.get_setting("SFDC_PASSWORD")
+
+
+def test_environment_settings(monkeypatch):
+    monkeypatch.setenv("SFDC_DOMAIN", "test")
+    monkeypatch.delenv("SFDC_PASSWORD", raising=False)
+
+    assert conf.get_setting("SFDC_DOMAIN") == "test"
+    assert conf.get_setting("SFDC_PASSWORD", "default") == "default"
+
+    # what isn't configured still comes from the environment
+    conf.configure(conf.Settings(SFDC_PASSWORD="configured"))
+    assert conf.get_setting("SFDC_PASSWORD") == "configured"
+    assert conf.get_setting("SFDC_DOMAIN") == "test"
+
+
+def test_django_settings(tmp_path):
+    (tmp_path / "probe_settings.py").write_text(
+        "TEMP = '/from/django'\nSFDC_USERNAME = 'django user'\n"
+    )
+    # nothing's touched Django's settings before get_setting does
+    probe = (
+        "from django_s3_csv_2_sfdc import conf;"
+        "from django_s3_csv_2_sfdc.utils import get_temp;"
+        "print(get_temp());"
+        "print(conf.get_setting('SFDC_USERNAME'));"
+        "conf.configure(SFDC_USERNAME='configured');"
+        "print(conf.get_setting('SFDC_USERNAME'), conf.get_setting('TEMP'))"
+    )
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "probe_settings",
+        "PYTHONPATH": os.pathsep.join([str(tmp_path), os.getcwd()]),
+    }
+    output = subprocess.run(
+        [sys.executable, "-c", probe],
+        check=True,
+        capture_output=True,
+        text=True,
+        env=env,
+    ).stdout
+
+    assert output.splitlines() == [
+        "/from/django",
+        "django user",
+        "configured /from/django",
+    ]
+
+
+def test_lazy_imports():
+    probe = (
+        "import sys, django_s3_csv_2_sfdc, django_s3_csv_2_sfdc.utils;"
+        "print(sorted(name for name in ('django', 'boto3', 'simple_salesforce') if name in sys.modules));"
+        "django_s3_csv_2_sfdc.Orchestrator;"
+        "print('boto3' in sys.modules);"
+        "print('pyarrow' in sys.modules)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", probe], check=True, capture_output=True, text=True
+    ).stdout
+
+    # pyarrow waits for a RecordSerializer
+    assert output.splitlines() == ["[]", "True", "False"]
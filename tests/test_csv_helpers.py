@@ -0,0 +1,183 @@
+import csv
+import io
+import pytest
+
+from django_s3_csv_2_sfdc.csv_helpers import (
+    ErrorReportWriter,
+    Field,
+    RecordSerializer,
+    create_error_report,
+)
+from django_s3_csv_2_sfdc.sfdc_helpers import BulkError
+
+
+def make_error(idx):
+    return {
+        "salesforce_object": "Contact",
+        "code": "BAD",
+        "message": "it broke",
+        "upsert_key": "ID",
+        "upsert_key_value": idx,
+        "object_json": {"ID": idx},
+    }
+
+
+def read_report(report_path):
+    with open(report_path, newline="") as report:
+        return list(csv.DictReader(report))
+
+
+def test_error_report_writer(tmp_path):
+    report_path = tmp_path / "errors" / "report.csv"
+    writer = ErrorReportWriter(report_path, flush_every_write=False)
+
+    assert writer.write(make_error(idx) for idx in range(3)) == 3
+    assert writer.write([]) == 0
+    assert writer.write(make_error(idx) for idx in range(3, 5)) == 2
+    writer.close()
+
+    rows = read_report(report_path)
+    assert writer.error_count == 5
+    assert [row["upsert_key_value"] for row in rows] == ["0", "1", "2", "3", "4"]
+
+    # appends without repeating the headers
+    create_error_report([make_error(5)], report_path)
+    assert len(read_report(report_path)) == 6
+
+
+def test_error_report_writer_flushes_every_write(tmp_path):
+    report_path = tmp_path / "report.csv"
+    writer = ErrorReportWriter(report_path)
+
+    writer.write([make_error(0)])
+
+    assert len(read_report(report_path)) == 1
+    writer.close()
+
+
+SERIALIZER_CSV = """Email,Joined,Score,Active,Notes
+a@example.com,03/27/2021,1.5,yes, hi
+b@example.com,,N/A,no,
+c@example.com,12/01/2020, 2 ,TRUE,there
+"""
+
+
+def make_serializer(**kwargs):
+    return RecordSerializer(
+        [
+            Field("Email", "Email__c"),
+            Field("Joined", "Join_Date__c", type="date", date_format="%m/%d/%Y"),
+            Field(
+                "Score",
+                "Score__c",
+                type="float",
+                null_values=("", "N/A"),
+                omit_nulls=True,
+            ),
+            Field("Active", "Active__c", type="bool"),
+            Field("Notes", "Notes__c", default="none"),
+        ],
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("engine", ["python", "pyarrow"])
+def test_record_serializer(engine):
+    if engine == "pyarrow":
+        pytest.importorskip("pyarrow")
+    serializer = make_serializer(chunk_size=2, engine=engine)
+
+    batches = list(serializer.iter_batches(io.StringIO(SERIALIZER_CSV)))
+
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert [record for batch in batches for record in batch] == [
+        {
+            "Email__c": "a@example.com",
+            "Join_Date__c": "2021-03-27",
+            "Score__c": 1.5,
+            "Active__c": True,
+            "Notes__c": "hi",
+        },
+        {
+            "Email__c": "b@example.com",
+            "Join_Date__c": None,
+            "Active__c": False,
+            "Notes__c": "none",
+        },
+        {
+            "Email__c": "c@example.com",
+            "Join_Date__c": "2020-12-01",
+            "Score__c": 2.0,
+            "Active__c": True,
+            "Notes__c": "there",
+        },
+    ]
+
+
+ENGINE_VALUES = {
+    "str": [" a ", "b", "", "N/A", None],
+    "int": ["1", " +5 ", "-3", "007", "", None],
+    "float": ["1.5", "+2", "1e3", ".5", "5.", "-inf", "", None],
+    "date": ["2021-03-27", " 2020-12-01 ", "", None],
+    "datetime": ["2021-03-27T10:30:00", "2021-03-27 10:30:00.250000", "", None],
+    str.lower: [" A ", "", None],
+}
+
+
+@pytest.mark.parametrize("field_type", list(ENGINE_VALUES))
+def test_record_serializer_engines_agree(field_type):
+    pytest.importorskip("pyarrow")
+    field = Field("Column", type=field_type, null_values=("", "N/A"), default="-")
+    columns = {"Column": ENGINE_VALUES[field_type]}
+
+    python = RecordSerializer([field], engine="python").serialize_columns(columns)
+    pyarrow = RecordSerializer([field], engine="pyarrow").serialize_columns(columns)
+
+    assert python == pyarrow
+    assert [type(record["Column"]) for record in python] == [
+        type(record["Column"]) for record in pyarrow
+    ]
+
+
+@pytest.mark.parametrize(
+    "field_type, value",
+    [("int", "1_000"), ("int", "0x1f"), ("int", "1.0"), ("float", "1_0.5")],
+)
+def test_record_serializer_engines_reject_the_same_values(field_type, value):
+    pytest.importorskip("pyarrow")
+    field = Field("Column", type=field_type)
+
+    for engine in ("python", "pyarrow"):
+        with pytest.raises(ValueError, match="Column"):
+            RecordSerializer([field], engine=engine).serialize_columns(
+                {"Column": ["1", value]}
+            )
+
+
+def test_record_serializer_rows_and_errors():
+    serializer = make_serializer()
+    rows = list(csv.DictReader(io.StringIO(SERIALIZER_CSV)))
+
+    assert serializer.serialize_rows(rows) == list(
+        serializer.iter_records(io.StringIO(SERIALIZER_CSV))
+    )
+
+    rows[1]["Active"] = "maybe"
+    with pytest.raises(ValueError, match="Active"):
+        serializer.serialize_rows(rows)
+
+    with pytest.raises(AssertionError):
+        list(serializer.iter_records(io.StringIO("Email\na@example.com\n")))
+
+
+def test_error_report_writer_bulk_errors(tmp_path):
+    errors = [
+        BulkError("Contact", "BAD", "it broke", "ID", {"ID": idx}) for idx in range(3)
+    ]
+
+    create_error_report(errors, tmp_path / "bulk_errors.csv")
+    create_error_report([make_error(idx) for idx in range(3)], tmp_path / "dicts.csv")
+
+    assert read_report(tmp_path / "bulk_errors.csv") == read_report(
+        tmp_path / "dicts.csv"
+    )
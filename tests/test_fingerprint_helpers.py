@@ -0,0 +1,54 @@
+import boto3
+
+from moto import mock_s3
+
+from django_s3_csv_2_sfdc.fingerprint_helpers import FingerprintIndex
+
+
+def test_fingerprint_index(tmp_path):
+    path = tmp_path / "fingerprints" / "contacts.bin"
+    records = [
+        {"ID": 1, "Name": "Bob"},
+        {"ID": 2, "Name": "Sarah"},
+        {"ID": 1, "Name": "Bobby"},
+    ]
+
+    index = FingerprintIndex("ID", path=path).load()
+    assert list(index.filter(records)) == records[:2]
+    assert (index.new_count, index.duplicate_count) == (2, 1)
+    index.save()
+
+    index = FingerprintIndex("ID", path=path).load()
+    changed = [{"ID": 1, "Name": "Bob"}, {"ID": 2, "Name": "Sara"}, {"ID": "3"}]
+    assert list(index.filter(changed)) == changed[1:]
+    assert (index.new_count, index.changed_count, index.skipped_count) == (1, 1, 1)
+
+    index.forget(3)
+    assert list(index.filter([{"ID": "3"}])) == [{"ID": "3"}]
+
+
+def test_fingerprint_index_fields():
+    index = FingerprintIndex("ID", fields=["Name"], path="unused")
+
+    assert index.fingerprint({"ID": 1, "Name": "Bob", "Seen": 1}) == index.fingerprint(
+        {"ID": 2, "Name": "Bob", "Seen": 2}
+    )
+
+
+@mock_s3
+def test_fingerprint_index_in_s3():
+    s3 = boto3.client("s3")
+    bucket_name = "a-bucket"
+    s3.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+    )
+    records = [{"ID": idx, "Name": f"Name {idx}"} for idx in range(1000)]
+
+    index = FingerprintIndex("ID", bucket=bucket_name, s3_key="fp.bin").load()
+    assert len(list(index.filter(records))) == 1000
+    index.save()
+
+    index = FingerprintIndex("ID", bucket=bucket_name, s3_key="fp.bin").load()
+    assert list(index.filter(records)) == []
+    assert index.unchanged_count == 1000
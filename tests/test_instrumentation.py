@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+
+from pathlib import Path
+
+import django_s3_csv_2_sfdc.orchestrator as orchestrator_module
+
+from django_s3_csv_2_sfdc.instrumentation import (
+    EMFInstrumentation,
+    Instrumentation,
+    LoggingInstrumentation,
+    MetricsRecorder,
+)
+from django_s3_csv_2_sfdc.orchestrator import Orchestrator
+
+from tests.fake_salesforce import FakeBulkType
+
+
+def test_noop_instrumentation():
+    instrumentation = Instrumentation()
+
+    with instrumentation.timer("something"):
+        instrumentation.incr("things")
+
+    assert instrumentation.snapshot() == {"timings": {}, "counters": {}}
+
+
+def test_metrics_recorder():
+    recorder = MetricsRecorder()
+
+    with recorder.timer("step"):
+        recorder.incr("rows", 5)
+    with recorder.timer("step"):
+        recorder.incr("rows", 2)
+
+    snapshot = recorder.snapshot()
+    assert snapshot["counters"] == {"rows": 7}
+    assert snapshot["timings"]["step"] >= 0
+
+
+def test_emf_instrumentation(capsys):
+    instrumentation = EMFInstrumentation("Integrations", bucket="a-bucket")
+    with instrumentation.timer("log_batch"):
+        instrumentation.incr("errors", 3)
+
+    instrumentation.flush()
+
+    emf = json.loads(capsys.readouterr().out)
+    directive = emf["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == "Integrations"
+    assert directive["Dimensions"] == [["bucket"]]
+    assert {"Name": "errors", "Unit": "Count"} in directive["Metrics"]
+    assert {"Name": "log_batch", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert emf["bucket"] == "a-bucket"
+    assert emf["errors"] == 3
+
+
+def test_logging_instrumentation(caplog):
+    instrumentation = LoggingInstrumentation(s3_object_key="file.csv")
+    instrumentation.incr("rows")
+
+    with caplog.at_level(logging.INFO):
+        instrumentation.flush()
+
+    logged = json.loads(caplog.records[-1].getMessage())
+    assert logged["s3_object_key"] == "file.csv"
+    assert logged["counters"] == {"rows": 1}
+
+
+def test_orchestrator_metrics(monkeypatch, tmp_path):
+    class BulkHandler:
+        instrumentation = Instrumentation()
+
+        def __getattr__(self, name):
+            bulk_type = FakeBulkType(name)
+            bulk_type.instrumentation = self.instrumentation
+            return bulk_type
+
+    class BulkSfClient:
+        def __init__(self) -> None:
+            self.instrumentation = Instrumentation()
+
+        @property
+        def bulk(self):
+            handler = BulkHandler()
+            handler.instrumentation = self.instrumentation
+            return handler
+
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda *args: tmp_path)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "download_file",
+        lambda *args, **kwargs: "tests/sample.csv",
+    )
+
+    sf_client = BulkSfClient()
+    orchestrator, other = [
+        Orchestrator(
+            "junk.csv",
+            "a bucket",
+            sf_client=sf_client,
+            instrumentation=MetricsRecorder(),
+        )
+        for _ in range(2)
+    ]
+    # it's shared, so it's left alone
+    assert not sf_client.instrumentation.enabled
+
+    data = [{"ID": idx, "Name": "bad" if idx == 0 else "good"} for idx in range(10)]
+    orchestrator.bulk_upsert("Contact", data, "ID", batch_size=5, wait=0)
+    other.bulk_upsert("Contact", data[:3], "ID", batch_size=5, wait=0)
+
+    assert other.metrics["counters"]["rows"] == 3
+    assert other.metrics["counters"]["salesforce_api_calls"] == 5
+    metrics = orchestrator.metrics
+    assert metrics["counters"]["rows"] == 10
+    assert metrics["counters"]["errors"] == 1
+    assert metrics["counters"]["batches"] == 2
+    # create and close the job, then add, check and get results for each batch
+    assert metrics["counters"]["salesforce_api_calls"] == 8
+    assert (
+        metrics["counters"]["bytes_downloaded"]
+        == Path("tests/sample.csv").stat().st_size
+    )
+    assert set(metrics["timings"]) >= {"download_s3_file", "log_batch"}
+
+
+def test_orchestrator_counts_rows_not_errors(monkeypatch, tmp_path):
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda *args: tmp_path)
+    monkeypatch.setattr(
+        orchestrator_module,
+        "download_file",
+        lambda *args, **kwargs: "tests/sample.csv",
+    )
+    orchestrator = Orchestrator(
+        "junk.csv", "a bucket", instrumentation=MetricsRecorder()
+    )
+    errors = [
+        {"statusCode": "BAD", "message": "bad name"},
+        {"statusCode": "WORSE", "message": "bad email"},
+    ]
+    results = [
+        {"success": True, "errors": []},
+        {"success": False, "errors": errors},
+        {"success": False, "errors": errors[:1]},
+    ]
+    data = [{"ID": idx} for idx in range(3)]
+
+    orchestrator.log_batch(results, data, "Contact", "ID")
+
+    assert orchestrator.metrics["counters"]["rows"] == 3
+    assert orchestrator.metrics["counters"]["errors"] == 3
+
+
+def test_orchestrator_without_a_downloaded_file(monkeypatch, tmp_path):
+    from django_s3_csv_2_sfdc.async_orchestrator import AsyncOrchestrator
+
+    monkeypatch.setattr(orchestrator_module, "get_temp", lambda *args: tmp_path)
+
+    class NoDownload:
+        def download_s3_file(self):
+            pass
+
+    class NoDownloadOrchestrator(NoDownload, Orchestrator):
+        pass
+
+    class NoDownloadAsyncOrchestrator(NoDownload, AsyncOrchestrator):
+        pass
+
+    orchestrator = NoDownloadOrchestrator(
+        "junk.csv", "a bucket", instrumentation=MetricsRecorder()
+    )
+    async_orchestrator = asyncio.run(
+        NoDownloadAsyncOrchestrator.acreate(
+            "junk.csv", "a bucket", instrumentation=MetricsRecorder()
+        )
+    )
+
+    for each in (orchestrator, async_orchestrator):
+        assert each.downloaded_file is None
+        assert "bytes_downloaded" not in each.metrics["counters"]
+        assert "download_s3_file" in each.metrics["timings"]
@@ -1,5 +1,10 @@
 import boto3
+import csv
+import datetime
+import json
 import os
+import threading
+import time
 import pytest
 
 import django_s3_csv_2_sfdc.s3_helpers as s3_helpers_module
@@ -14,9 +19,17 @@ from django_s3_csv_2_sfdc.utils import get_iso
 from django_s3_csv_2_sfdc.s3_helpers import (
     timestamp_s3_key,
     respond_to_s3_event,
+    respond_to_s3_event_concurrently,
+    get_batch_item_failures,
     move_file,
+    move_files,
+    list_s3_keys,
+    drain_s3_prefix,
+    delete_files,
     upload_file,
     download_file,
+    open_s3_binary_stream,
+    open_s3_stream,
     get_filename_from_s3_key,
     get_prefix_from_s3_key,
 )
@@ -93,6 +106,164 @@ def test_move_file_to_another_bucket(monkeypatch):
     assert failed
 
 
+@pytest.mark.parametrize("part_size", [1, 5, 1024])
+@mock_s3
+def test_download_file_in_parts(monkeypatch, tmp_path, part_size):
+    monkeypatch.setattr(s3_helpers_module, "get_temp", lambda *args: tmp_path)
+    s3_client = boto3.client("s3")
+    bucket_name = "a-bucket"
+    s3_client.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+    )
+    s3_key = "nested/file.csv"
+    upload_file(Path("tests") / "sample.csv", bucket_name, s3_key)
+
+    progress = []
+    download_path = download_file(
+        s3_key,
+        bucket_name,
+        part_size=part_size,
+        max_workers=4,
+        callback=lambda done, total, elapsed: progress.append((done, total)),
+    )
+
+    expected = (Path("tests") / "sample.csv").read_bytes()
+    assert download_path == tmp_path / s3_key
+    assert download_path.read_bytes() == expected
+    assert progress[-1] == (len(expected), len(expected))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+@mock_s3
+def test_open_s3_stream(chunk_size):
+    s3_client = boto3.client("s3")
+    bucket_name = "a-bucket"
+    s3_client.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+    )
+    s3_key = "file.csv"
+    upload_file(Path("tests") / "sample.csv", bucket_name, s3_key)
+
+    with open(Path("tests") / "sample.csv", newline="") as file:
+        expected = list(csv.DictReader(file))
+
+    with open_s3_stream(s3_key, bucket_name, chunk_size=chunk_size) as stream:
+        rows = list(csv.DictReader(stream))
+
+    assert rows == expected
+
+    with open(Path("tests") / "sample.csv", "rb") as file:
+        file.seek(10)
+        expected = file.read()
+    with open_s3_binary_stream(s3_key, bucket_name, chunk_size=chunk_size) as stream:
+        stream.read(3)
+        stream.seek(10)
+        assert stream.read() == expected
+
+
+@mock_s3
+def test_move_files(monkeypatch):
+    monkeypatch.setattr(s3_helpers_module, "MAX_DELETE_KEYS", 2)
+    s3_client = boto3.client("s3")
+    bucket_name = "a-bucket"
+    s3_client.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+    )
+    for idx in range(5):
+        s3_client.put_object(Bucket=bucket_name, Key=f"in/{idx}.csv", Body=b"x")
+
+    moves = {f"in/{idx}.csv": f"archive/{idx}.csv" for idx in range(5)}
+    moves["in/missing.csv"] = "archive/missing.csv"
+
+    with pytest.raises(ClientError):
+        move_files(moves, bucket_name, max_workers=3)
+
+    listed = s3_client.list_objects_v2(Bucket=bucket_name)["Contents"]
+    assert sorted(item["Key"] for item in listed) == [
+        f"archive/{idx}.csv" for idx in range(5)
+    ]
+
+    assert delete_files([f"archive/{idx}.csv" for idx in range(5)], bucket_name) == []
+    assert "Contents" not in s3_client.list_objects_v2(Bucket=bucket_name)
+
+
+@mock_s3
+def test_list_s3_keys(monkeypatch):
+    s3_client = boto3.client("s3")
+    bucket_name = "a-bucket"
+    s3_client.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+    )
+    for idx in range(5):
+        s3_client.put_object(Bucket=bucket_name, Key=f"in/{idx}.csv", Body=b"x" * idx)
+    s3_client.put_object(Bucket=bucket_name, Key="in/notes.txt", Body=b"x")
+    s3_client.put_object(Bucket=bucket_name, Key="out/0.csv", Body=b"x")
+
+    assert len(list(list_s3_keys(bucket_name, "in/"))) == 6
+    assert list(
+        list_s3_keys(bucket_name, "in/", suffix=".csv", min_size=1, max_size=3)
+    ) == [
+        "in/1.csv",
+        "in/2.csv",
+        "in/3.csv",
+    ]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    hour = datetime.timedelta(hours=1)
+    assert list(list_s3_keys(bucket_name, modified_after=now + hour)) == []
+    assert list(list_s3_keys(bucket_name, modified_before=now - hour)) == []
+    assert len(list(list_s3_keys(bucket_name, modified_after=now - hour))) == 7
+
+
+@mock_s3
+def test_drain_s3_prefix(tmp_path):
+    s3_client = boto3.client("s3")
+    bucket_name = "a-bucket"
+    s3_client.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+    )
+    keys = [f"in/{idx}.csv" for idx in range(20)]
+    for key in keys:
+        s3_client.put_object(Bucket=bucket_name, Key=key, Body=b"x")
+    checkpoint_path = tmp_path / "drain.checkpoint"
+
+    processed = []
+    lock = threading.Lock()
+
+    def flaky(s3_object_key, bucket_name):
+        if s3_object_key.endswith("7.csv"):
+            raise ValueError(s3_object_key)
+        with lock:
+            processed.append(s3_object_key)
+
+    summary = drain_s3_prefix(
+        bucket_name, flaky, prefix="in/", max_workers=3, checkpoint_path=checkpoint_path
+    )
+
+    assert summary["processed"] == 18
+    assert summary["skipped"] == 0
+    assert sorted(failure["s3_object_key"] for failure in summary["failed"]) == [
+        "in/17.csv",
+        "in/7.csv",
+    ]
+
+    # resuming only retries what didn't go through
+    processed.clear()
+    summary = drain_s3_prefix(
+        bucket_name,
+        lambda s3_object_key, bucket_name: processed.append(s3_object_key),
+        prefix="in/",
+        checkpoint_path=checkpoint_path,
+    )
+
+    assert sorted(processed) == ["in/17.csv", "in/7.csv"]
+    assert summary == {"processed": 2, "skipped": 18, "failed": []}
+
+
 @pytest.mark.parametrize(
     "s3_key,keep_folder,expected",
     [
@@ -136,6 +307,72 @@ def test_respond_to_s3_event(s3_key, expected_s3_key, bucket, expected_bucket):
     respond_to_s3_event(event, process)
 
 
+def make_s3_record(s3_key, bucket="bucket"):
+    return {"s3": {"bucket": {"name": bucket}, "object": {"key": s3_key}}}
+
+
+def test_respond_to_s3_event_concurrently():
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def process(s3_object_key, bucket_name, suffix):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        if "bad" in s3_object_key:
+            raise ValueError(s3_object_key)
+        return s3_object_key + suffix
+
+    keys = ["a.csv", "bad.csv", "c.csv", "d.csv"]
+    event = {"Records": [make_s3_record(key) for key in keys]}
+
+    summary = respond_to_s3_event_concurrently(event, process, "!", max_workers=3)
+
+    assert [record["s3_object_key"] for record in summary] == keys
+    assert [record["result"] for record in summary] == [
+        "a.csv!",
+        None,
+        "c.csv!",
+        "d.csv!",
+    ]
+    assert isinstance(summary[1]["exception"], ValueError)
+    assert 1 < max_running <= 3
+
+
+def test_respond_to_s3_event_concurrently_from_sqs():
+    def process(s3_object_key, bucket_name):
+        if "bad" in s3_object_key:
+            raise ValueError(s3_object_key)
+
+    event = {
+        "Records": [
+            {
+                "messageId": "message-1",
+                "body": json.dumps({"Records": [make_s3_record("a.csv")]}),
+            },
+            {
+                "messageId": "message-2",
+                "body": json.dumps(
+                    {"Records": [make_s3_record("bad.csv"), make_s3_record("bad2.csv")]}
+                ),
+            },
+            {"messageId": "message-3", "body": json.dumps({"Event": "s3:TestEvent"})},
+        ]
+    }
+
+    summary = respond_to_s3_event_concurrently(event, process)
+
+    assert len(summary) == 3
+    assert get_batch_item_failures(summary) == {
+        "batchItemFailures": [{"itemIdentifier": "message-2"}]
+    }
+
+
 @pytest.mark.parametrize(
     "s3_key,expected",
     [
@@ -0,0 +1,522 @@
+import gzip
+import http.server
+import json
+import threading
+
+import pytest
+import requests
+import simple_salesforce.api
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pathlib import Path
+
+from simple_salesforce.exceptions import (
+    SalesforceGeneralError,
+    SalesforceMalformedRequest,
+)
+from simple_salesforce.util import call_salesforce
+
+import django_s3_csv_2_sfdc.salesforce_client as salesforce_client_module
+
+from django_s3_csv_2_sfdc.salesforce_client import (
+    MAX_BATCH_BYTES,
+    ApiLimitExhausted,
+    ApiLimitGovernor,
+    SFBulk2Handler,
+    SFBulkType,
+    SessionCache,
+    SfClient,
+    get_max_batch_bytes,
+    measure_record,
+    pack_batches,
+)
+from django_s3_csv_2_sfdc.sfdc_helpers import parse_bulk_upsert_results
+
+from tests.fake_salesforce import FakeBulk2Adapter, FakeBulkAdapter, FakeBulkType
+
+
+def test_pipeline_yields_batches_in_order():
+    bulk_type = FakeBulkType()
+    data = ({"ID": idx, "Name": "good"} for idx in range(95))
+
+    batches = list(
+        bulk_type.pipeline_upsert(data, "ID", batch_size=10, max_in_flight=3, wait=0)
+    )
+
+    assert len(batches) == 10
+    pushed = [record["ID"] for batch, _ in batches for record in batch]
+    returned = [result["id"] for _, results in batches for result in results]
+    assert pushed == list(range(95))
+    assert returned == list(range(95))
+    assert 1 < bulk_type.max_running <= 3
+    assert bulk_type.closed
+
+
+def test_pipeline_raises_on_failed_batch():
+    bulk_type = FakeBulkType(failed_batches=("1",))
+    data = [{"ID": idx, "Name": "good"} for idx in range(30)]
+
+    with pytest.raises(SalesforceGeneralError):
+        list(bulk_type.pipeline_upsert(data, "ID", batch_size=10, wait=0))
+    assert bulk_type.closed
+
+
+def test_bulk_operation_returns_failed_batches():
+    bulk_type = FakeBulkType(failed_batches=("1",))
+    data = [{"ID": idx, "Name": "good"} for idx in range(30)]
+
+    # like simple salesforce, rather than raising
+    results = bulk_type._bulk_operation(
+        "upsert", data, external_id_field="ID", batch_size=10, wait=0
+    )
+
+    assert [result["id"] for result in results] == list(range(30))
+    assert bulk_type.closed
+
+
+def test_pipeline_against_the_bulk_api():
+    # simple_salesforce's own job, batch and result requests, unlike FakeBulkType
+    adapter = FakeBulkAdapter()
+    session = requests.Session()
+    session.mount("https://", adapter)
+    bulk_type = SFBulkType("Contact", "https://fake/", {"X-SFDC-Session": "s"}, session)
+    data = [{"ID": idx, "Name": "bad" if idx == 3 else "good"} for idx in range(25)]
+
+    batches = list(
+        bulk_type.pipeline_upsert(data, "ID", batch_size=10, max_in_flight=2, wait=0)
+    )
+
+    assert [len(batch) for batch, _ in batches] == [10, 10, 5]
+    results = [result for _, results in batches for result in results]
+    assert len(results) == 25
+    assert [result["success"] for result in results].count(False) == 1
+    assert adapter.jobs["job0"]["externalIdFieldName"] == "ID"
+    assert adapter.jobs["job0"]["state"] == "Closed"
+
+
+def test_bulk_dml_against_the_bulk_api():
+    # simple_salesforce's upsert and insert, calling _bulk_operation their way
+    adapter = FakeBulkAdapter()
+    session = requests.Session()
+    session.mount("https://", adapter)
+    bulk_type = SFBulkType("Contact", "https://fake/", {"X-SFDC-Session": "s"}, session)
+    data = [{"ID": idx, "Name": "bad" if idx == 3 else "good"} for idx in range(25)]
+
+    upserted = bulk_type.upsert(data, "ID", batch_size=10)
+    inserted = bulk_type.insert(data[:5])
+
+    assert len(upserted) == 25
+    assert [result["success"] for result in upserted].count(False) == 1
+    assert len(inserted) == 5
+    assert [job["operation"] for job in adapter.jobs.values()] == ["upsert", "insert"]
+
+
+def test_pack_batches():
+    data = [{"Name": "x" * 10} for _ in range(10)]
+    record_bytes = measure_record(data[0])
+
+    by_count = list(pack_batches(data, max_records=4))
+    by_size = list(pack_batches(data, max_bytes=2 + record_bytes * 3))
+
+    assert [len(batch) for batch in by_count] == [4, 4, 2]
+    assert [len(batch) for batch in by_size] == [3, 3, 3, 1]
+
+
+class TooBigBulkType(FakeBulkType):
+    def __init__(self, max_bytes, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.max_bytes = max_bytes
+        self.rejected = 0
+
+    def _add_batch(self, job_id, data, operation):
+        if 2 + sum(measure_record(record) for record in data) > self.max_bytes:
+            with self.lock:
+                self.rejected += 1
+            raise SalesforceMalformedRequest(
+                "https://fake/", 400, self.object_name, "Exceeded max size limit"
+            )
+        return super()._add_batch(job_id, data, operation)
+
+
+def test_oversized_batches_are_split_and_remembered(monkeypatch):
+    monkeypatch.setattr(salesforce_client_module, "_learned_batch_bytes", {})
+    data = [{"ID": idx, "Name": "good"} for idx in range(40)]
+    max_bytes = 2 + measure_record(data[0]) * 5
+
+    bulk_type = TooBigBulkType(max_bytes, object_name="Lead")
+    results = bulk_type._bulk_operation("upsert", data, external_id_field="ID", wait=0)
+
+    assert [result["id"] for result in results] == list(range(40))
+    assert bulk_type.rejected
+    assert get_max_batch_bytes("Lead") < MAX_BATCH_BYTES
+
+    # the next job for the same object packs small enough up front
+    bulk_type = TooBigBulkType(max_bytes, object_name="Lead")
+    results = bulk_type._bulk_operation("upsert", data, external_id_field="ID", wait=0)
+
+    assert len(results) == 40
+    assert not bulk_type.rejected
+
+
+def make_bulk2_handler(**kwargs):
+    adapter = FakeBulk2Adapter(**kwargs)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return SFBulk2Handler("session-id", "https://fake/jobs/ingest/", session), adapter
+
+
+@pytest.mark.parametrize("page_size", [None, 2])
+def test_bulk2_upsert_records(page_size):
+    handler, adapter = make_bulk2_handler(page_size=page_size)
+    names = ["good", "bad", "good", "skip", "good", None]
+    data = ({"ID": str(idx), "Name": name} for idx, name in enumerate(names))
+
+    jobs = handler.Contact.upsert(data, "ID", wait=0)
+
+    assert len(jobs) == 1
+    assert adapter.jobs["job0"]["externalIdFieldName"] == "ID"
+    assert adapter.jobs["job0"]["rows"][-1]["Name"] == "#N/A"
+
+    results, data = next(jobs[0].batches())
+    successes, errors = parse_bulk_upsert_results(results, data, "Contact", "ID")
+    assert len(successes) == 4
+    assert [error["code"] for error in errors] == ["BAD_NAME", "UNPROCESSED"]
+    assert [error["upsert_key_value"] for error in errors] == ["1", "3"]
+    assert errors[0]["message"] == "that's a bad name:--"
+
+
+def test_bulk2_upsert_file_and_multiple_jobs(monkeypatch, tmp_path):
+    handler, adapter = make_bulk2_handler()
+
+    jobs = handler.Contact.upsert(Path("tests") / "sample.csv", "ID", wait=0)
+    assert len(jobs) == 1
+    assert [row["Name"] for row in adapter.jobs["job0"]["rows"]] == [
+        "Bob",
+        "Sarah",
+        "Jack",
+    ]
+
+    # e.g., saved by Excel
+    crlf = tmp_path / "crlf.csv"
+    crlf.write_bytes(b"ID,Name\r\n1,Bob\r\n2,Sarah\r\n")
+    handler.Contact.upsert(crlf, "ID", wait=0)
+    assert adapter.jobs["job1"]["lineEnding"] == "CRLF"
+    assert [row["Name"] for row in adapter.jobs["job1"]["rows"]] == ["Bob", "Sarah"]
+
+    # force every record into its own job
+    monkeypatch.setattr(salesforce_client_module, "BULK2_CHUNK_CHARS", 1)
+    data = [{"ID": str(idx), "Name": "good"} for idx in range(3)]
+    jobs = handler.Contact.upsert(data, "ID", max_upload_bytes=1, wait=0)
+
+    assert len(jobs) == 3
+    assert [len(list(job.successful())) for job in jobs] == [1, 1, 1]
+
+
+class FakeLogin:
+    """
+    Stands in for simple_salesforce's SalesforceLogin, handing out a new
+    session id every time
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, **kwargs):
+        self.count += 1
+        return f"session-{self.count}", "fake.my.salesforce.com"
+
+
+class SessionCheckingAdapter(requests.adapters.BaseAdapter):
+    """
+    Rejects every Bulk API request that isn't made with valid_session_id
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.valid_session_id = None
+        self.requests = 0
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        if request.headers.get("X-SFDC-Session") == self.valid_session_id:
+            response.status_code = 200
+            response._content = b'{"state": "Completed"}'
+        else:
+            response.status_code = 400
+            response._content = (
+                b'{"exceptionCode": "InvalidSessionId", "exceptionMessage": "nope"}'
+            )
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def configured(monkeypatch):
+    from django_s3_csv_2_sfdc import conf
+
+    monkeypatch.setattr(
+        conf,
+        "_configured",
+        conf.Settings(SFDC_USERNAME="me", SFDC_PASSWORD="pw", SFDC_SECURITY_TOKEN="t"),
+    )
+    login = FakeLogin()
+    monkeypatch.setattr(simple_salesforce.api, "SalesforceLogin", login)
+    return login
+
+
+def test_session_cache(configured, tmp_path):
+    from django_s3_csv_2_sfdc.checkpoint_helpers import LocalCheckpointStore
+
+    store = LocalCheckpointStore(tmp_path)
+    cache = SessionCache(store=store)
+
+    clients = [SfClient(session_cache=cache) for _ in range(3)]
+    assert configured.count == 1
+    assert {client.session_id for client in clients} == {"session-1"}
+
+    # another process, sharing the store
+    client = SfClient(session_cache=SessionCache(store=store))
+    assert configured.count == 1
+    assert client.bulk_url.startswith("https://fake.my.salesforce.com/")
+
+    SfClient(session_cache=SessionCache(store=store, max_age=-1))
+    assert configured.count == 2
+
+
+def test_sf_client_needs_simple_salesforce_1_12(configured, monkeypatch):
+    # e.g., 1.10, which logs in without _refresh_session
+    monkeypatch.delattr(simple_salesforce.api.Salesforce, "_refresh_session")
+
+    with pytest.raises(RuntimeError):
+        SfClient(session_cache=SessionCache())
+
+
+def test_reauthenticates_rejected_sessions(configured):
+    client = SfClient(session_cache=SessionCache())
+    adapter = SessionCheckingAdapter()
+    client.session.mount("https://", adapter)
+    bulk_type = client.bulk.Contact
+    adapter.valid_session_id = "session-2"
+
+    def get_batch(idx):
+        return call_salesforce(
+            url=f"{bulk_type.bulk_url}job/j/batch/{idx}",
+            method="GET",
+            session=bulk_type.session,
+            headers=bulk_type.headers,
+        ).json()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        batches = list(pool.map(get_batch, range(8)))
+
+    assert batches == [{"state": "Completed"}] * 8
+    # however many threads were turned away, one login sorted them all out
+    assert configured.count == 2
+    assert bulk_type.headers["X-SFDC-Session"] == "session-2"
+    assert client.session_id == "session-2"
+
+
+def test_requests_in_flight_during_a_login_dont_log_in_again(configured):
+    client = SfClient(session_cache=SessionCache())
+    bulk_type = client.bulk.Contact
+    sent = threading.Event()
+    refreshed = threading.Event()
+
+    class SlowAdapter(SessionCheckingAdapter):
+        def send(self, request, **kwargs):
+            if request.url.endswith("/slow") and not sent.is_set():
+                sent.set()
+                # still on the old session when it comes back
+                refreshed.wait(5)
+            return super().send(request, **kwargs)
+
+    adapter = SlowAdapter()
+    adapter.valid_session_id = "session-2"
+    client.session.mount("https://", adapter)
+
+    def get(path):
+        return call_salesforce(
+            url=f"{bulk_type.bulk_url}{path}",
+            method="GET",
+            session=bulk_type.session,
+            headers=bulk_type.headers,
+        ).json()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        slow = pool.submit(get, "slow")
+        sent.wait(5)
+        assert get("fast") == {"state": "Completed"}
+        refreshed.set()
+        assert slow.result() == {"state": "Completed"}
+
+    assert configured.count == 2
+
+
+def test_bulk_handlers_are_cached(configured):
+    client = SfClient(session_cache=SessionCache())
+
+    assert client.bulk is client.bulk
+    assert client.bulk.Contact is client.bulk.Contact
+    assert client.bulk2.Contact is client.bulk2.Contact
+
+    handler = client.bulk
+    client.reauthenticate(client.session_id)
+    assert client.bulk is not handler
+    assert client.bulk.session_id == "session-2"
+
+
+def test_bulk_batches_are_gzipped():
+    sent = []
+
+    class CapturingAdapter(requests.adapters.BaseAdapter):
+        def send(self, request, **kwargs):
+            sent.append(request)
+            response = requests.Response()
+            response.status_code = 201
+            response._content = b'{"id": "b", "state": "Queued"}'
+            return response
+
+    session = requests.Session()
+    session.mount("https://", CapturingAdapter())
+    bulk_type = SFBulkType("Contact", "https://fake/", {"X-SFDC-Session": "s"}, session)
+    data = [{"ID": idx, "Name": "Bob"} for idx in range(1000)]
+
+    assert bulk_type._add_batch("job", data, "upsert") == {"id": "b", "state": "Queued"}
+
+    request = sent[0]
+    assert request.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(request.body)) == data
+    assert len(request.body) < len(json.dumps(data)) / 5
+    assert "Content-Encoding" not in bulk_type.headers
+
+
+def test_connection_stats(configured):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = SfClient(session_cache=SessionCache())
+    try:
+        for _ in range(3):
+            client.session.get(f"http://127.0.0.1:{server.server_port}/")
+    finally:
+        server.shutdown()
+
+    assert client.connection_stats() == {"connections": 1, "requests": 3, "reused": 2}
+
+
+def limit_response(status_code=200, content=b"{}", used=10, total=100):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers["Sforce-Limit-Info"] = f"api-usage={used}/{total}"
+    return response
+
+
+def test_governor_tracks_the_budget():
+    governor = ApiLimitGovernor(reserve=0.1)
+
+    assert governor.remaining_fraction is None
+    assert governor.allowed_in_flight(5) == 5
+
+    governor.observe(limit_response(used=50, total=100))
+    assert governor.api_remaining == 50
+    assert governor.allowed_in_flight(5) == 5
+
+    governor.observe(limit_response(used=85, total=100))
+    assert governor.allowed_in_flight(5) == 1
+
+    governor.update_limits(
+        {
+            "DailyApiRequests": {"Max": 100, "Remaining": 90},
+            "DailyBulkApiBatches": {"Max": 10, "Remaining": 1},
+        }
+    )
+    assert governor.remaining_fraction == 0.1
+    with pytest.raises(ApiLimitExhausted):
+        governor.wait_for_budget()
+    assert governor.budget()["bulk_batches_remaining"] == 1
+
+
+def test_governor_pauses_until_the_budget_recovers(monkeypatch):
+    monkeypatch.setattr(salesforce_client_module.time, "sleep", lambda _: None)
+    remaining = iter([5, 5, 50])
+    governor = ApiLimitGovernor(reserve=0.1, pause=10, max_pause=60)
+    governor.get_limits = lambda: {
+        "DailyApiRequests": {"Max": 100, "Remaining": next(remaining)}
+    }
+
+    governor.wait_for_budget()
+
+    assert governor.pauses == 2
+    assert governor.api_remaining == 50
+
+
+def test_limit_exceeded_requests_are_retried(monkeypatch):
+    monkeypatch.setattr(salesforce_client_module.time, "sleep", lambda _: None)
+    responses = [
+        limit_response(403, b'[{"errorCode": "REQUEST_LIMIT_EXCEEDED"}]', used=100),
+        limit_response(400, b'{"exceptionCode": "ExceededQuota"}', used=100),
+        limit_response(200, b'{"state": "Completed"}', used=40),
+    ]
+
+    class LimitedAdapter(requests.adapters.BaseAdapter):
+        def send(self, request, **kwargs):
+            return responses.pop(0)
+
+        def close(self):
+            pass
+
+    governor = ApiLimitGovernor()
+    session = salesforce_client_module.ReauthenticatingSession()
+    session.governor = governor
+    session.mount("https://", LimitedAdapter())
+
+    assert session.get("https://fake/limits").json() == {"state": "Completed"}
+    assert governor.backoffs == 2
+    assert governor.api_remaining == 60
+
+    responses.extend([limit_response(403, b"REQUEST_LIMIT_EXCEEDED")] * 2)
+    governor.max_retries = 1
+    assert session.get("https://fake/limits").status_code == 403
+
+
+def test_pipeline_throttles_when_the_budget_runs_low():
+    bulk_type = FakeBulkType()
+    bulk_type.governor = ApiLimitGovernor(reserve=0.05, throttle_below=0.5)
+    bulk_type.governor.update_limits(
+        {"DailyApiRequests": {"Max": 100, "Remaining": 20}}
+    )
+    data = ({"ID": idx, "Name": "good"} for idx in range(50))
+
+    batches = list(
+        bulk_type.pipeline_upsert(data, "ID", batch_size=10, max_in_flight=3, wait=0)
+    )
+
+    assert len(batches) == 5
+    assert bulk_type.max_running == 1
+    assert bulk_type.governor.in_flight == 0
+
+
+def test_sf_client_shares_its_governor(configured):
+    client = SfClient(session_cache=SessionCache())
+
+    assert client.session.governor is client.governor
+    assert client.bulk.Contact.governor is client.governor
+    assert client.governor.get_limits == client.limits
@@ -1,4 +1,16 @@
-from django_s3_csv_2_sfdc.sfdc_helpers import extract_errors_from_results
+import csv
+import json
+import pytest
+import sys
+
+from django_s3_csv_2_sfdc.sfdc_helpers import (
+    BulkError,
+    BulkUpsertCounts,
+    ErrorAggregator,
+    extract_errors_from_results,
+    iter_bulk_upsert_errors,
+    parse_bulk_upsert_results,
+)
 
 
 def test_extract_errors_from_results():
@@ -11,4 +23,109 @@ def test_extract_errors_from_results():
     errors = extract_errors_from_results(results)
 
     assert len(errors) == 2
-    assert errors == [1, 2]
\ No newline at end of file
+    assert errors == [1, 2]
+
+
+def make_results(successes):
+    return [
+        {
+            "success": success,
+            "id": str(idx) if success else None,
+            "errors": [] if success else [{"statusCode": "BAD", "message": "no"}],
+        }
+        for idx, success in enumerate(successes)
+    ]
+
+
+def test_iter_bulk_upsert_errors():
+    results = make_results([True, False, True, False])
+    data = ({"ID": idx} for idx in range(4))
+    counts = BulkUpsertCounts(collect_ids=True)
+
+    errors = iter_bulk_upsert_errors(results, data, "Contact", "ID", counts=counts)
+
+    assert [error["upsert_key_value"] for error in errors] == [1, 3]
+    assert counts.successes == 2
+    assert counts.errors == 2
+    assert counts.success_ids == ["0", "2"]
+
+
+@pytest.mark.parametrize("row_count", [2, 4])
+def test_iter_bulk_upsert_errors_length_mismatch(row_count):
+    results = iter(make_results([True, True, True]))
+    data = ({"ID": idx} for idx in range(row_count))
+
+    with pytest.raises(AssertionError):
+        list(iter_bulk_upsert_errors(results, data, "Contact", "ID"))
+
+
+def test_parse_bulk_upsert_results():
+    results = make_results([True, False])
+    data = [{"ID": 0}, {"ID": 1}]
+
+    successes, errors = parse_bulk_upsert_results(results, data, "Contact", "ID")
+
+    assert successes == [results[0]]
+    assert errors == [
+        {
+            "salesforce_object": "Contact",
+            "code": "BAD",
+            "message": "no",
+            "upsert_key": "ID",
+            "upsert_key_value": 1,
+            "object_json": {"ID": 1},
+        }
+    ]
+    assert type(errors[0]) is dict
+    json.dumps(errors)
+
+
+def test_bulk_error():
+    pushed = {"ID": 7, "Name": "Bob"}
+    error = BulkError("Contact", "BAD", "no", "ID", pushed)
+
+    assert error["upsert_key_value"] == 7
+    assert error["object_json"] is pushed
+    assert error.get("nope") is None
+    with pytest.raises(KeyError):
+        error["nope"]
+    assert error == dict(zip(error.keys(), error.to_row()))
+    assert not hasattr(error, "__dict__")
+    assert sys.getsizeof(error) < sys.getsizeof(error.to_dict())
+
+
+def test_error_aggregator(tmp_path):
+    errors = [
+        BulkError(
+            "Contact",
+            "DUPLICATE_VALUE",
+            f"duplicate id: 0038c00002XyZab{idx:03}",
+            "ID",
+            {"ID": idx},
+        )
+        for idx in range(10)
+    ]
+    errors.append(
+        BulkError("Contact", "REQUIRED_FIELD_MISSING", "[Email]", "ID", {"ID": 10})
+    )
+    aggregator = ErrorAggregator(sample_size=2)
+
+    assert list(aggregator.aggregate(errors)) == errors
+    summary = aggregator.summary()
+
+    assert [(row["code"], row["message"], row["count"]) for row in summary] == [
+        ("DUPLICATE_VALUE", "duplicate id: <id>", 10),
+        ("REQUIRED_FIELD_MISSING", "[Email]", 1),
+    ]
+    assert [sample["upsert_key_value"] for sample in summary[0]["samples"]] == [0, 1]
+
+    aggregator.write_summary(tmp_path / "summary.csv")
+    with open(tmp_path / "summary.csv", newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert [row["count"] for row in rows] == ["10", "1"]
+
+    aggregator.write_summary(tmp_path / "summary.json")
+    with open(tmp_path / "summary.json") as file:
+        reloaded = ErrorAggregator(sample_size=2)
+        reloaded.load(json.load(file))
+    assert reloaded.error_count == 11
@@ -1,9 +1,16 @@
 import boto3
+import os
+import pytest
+
+import django_s3_csv_2_sfdc.step_function_helpers as step_function_helpers_module
+
+from botocore.exceptions import ClientError
 
 from moto import mock_s3
 
 from django_s3_csv_2_sfdc.step_function_helpers import (
     cache_data_in_s3,
+    iter_cached_data_from_s3,
     pull_cached_data_from_s3,
 )
 
@@ -23,3 +30,53 @@ def test_cache_data_in_s3_and_pull_cached_data_from_s3():
     retrieved_data = pull_cached_data_from_s3(bucket_name, s3_key)
 
     assert retrieved_data == data
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+@mock_s3
+def test_compressed_cache(monkeypatch, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    # newer botocores send parts aws-chunked, which moto doesn't decode
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    # S3's minimum part size, so that the data spans a few parts
+    monkeypatch.setattr(
+        step_function_helpers_module, "MULTIPART_PART_SIZE", 5 * 1024 * 1024
+    )
+    s3 = boto3.client("s3")
+    bucket_name = "a-bucket"
+    s3.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+    )
+
+    def records():
+        for idx in range(5000):
+            yield {"ID": idx, "Name": f"Name {idx}", "Notes": os.urandom(1024).hex()}
+
+    s3_key = cache_data_in_s3(records(), bucket_name, compression=compression)
+    parts = s3.head_object(Bucket=bucket_name, Key=s3_key, PartNumber=1)["PartsCount"]
+    assert parts > 1
+
+    retrieved = iter_cached_data_from_s3(bucket_name, s3_key)
+    assert [record["ID"] for record in retrieved] == list(range(5000))
+
+    retrieved = pull_cached_data_from_s3(bucket_name, s3_key, delete=True)
+    assert len(retrieved) == 5000
+
+    with pytest.raises(ClientError):
+        pull_cached_data_from_s3(bucket_name, s3_key)
+
+
+@mock_s3
+def test_iter_cached_data_from_s3_reads_plain_json():
+    s3 = boto3.client("s3")
+    bucket_name = "a-bucket"
+    s3.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+    )
+
+    s3_key = cache_data_in_s3([{"a": 1}, {"b": 2}], bucket_name)
+
+    assert list(iter_cached_data_from_s3(bucket_name, s3_key)) == [{"a": 1}, {"b": 2}]
@@ -43,6 +43,9 @@ class Dud:
             [{"id": 1}, {"id": 2, "name": "test"}],
         ),
         ([Dud(1), Dud(2), Dud(2), Dud(3)], "id", [Dud(1), Dud(2), Dud(3)]),
+        (iter([{"id": 2}, {"id": 1}, {"id": 2}]), "id", [{"id": 2}, {"id": 1}]),
+        ([], "id", []),
+        ([{"id": 1}, Dud(1), Dud(2), {"id": 2}], "id", [{"id": 1}, Dud(2)]),
     ],
 )
 def test_dedupe(data, key, deduped_data):